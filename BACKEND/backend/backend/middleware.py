@@ -0,0 +1,76 @@
+import time
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils.decorators import sync_and_async_middleware
+from .metrics import DB_QUERIES, DB_SECONDS, REQUEST_SECONDS, REQUESTS
+
+# [query count, query seconds] for the request being handled. A context
+# variable rather than a thread local, so queries an async view runs through
+# sync_to_async are still counted against it.
+_query_stats = ContextVar('query_stats', default=None)
+
+
+def _count_queries(execute, sql, params, many, context):
+    stats = _query_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats[0] += 1
+        stats[1] += time.perf_counter() - start
+
+
+def _install_wrapper(connection, **kwargs):
+    # Same hook connection.execute_wrapper() uses, but kept for the lifetime
+    # of the connection so it also covers connections opened in other threads
+    if _count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_queries)
+
+
+connection_created.connect(_install_wrapper, dispatch_uid='metrics_count_queries')
+
+
+def _view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match.route
+
+
+def _start(request):
+    for connection in connections.all(initialized_only=True):
+        _install_wrapper(connection)
+    stats = [0, 0.0]
+    return _query_stats.set(stats), stats, time.perf_counter()
+
+
+def _finish(request, response, token, stats, start):
+    elapsed = time.perf_counter() - start
+    _query_stats.reset(token)
+    view = _view_label(request)
+    REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+    REQUEST_SECONDS.observe(elapsed, view=view)
+    DB_QUERIES.observe(stats[0], view=view)
+    DB_SECONDS.observe(stats[1], view=view)
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """Record wall time and database queries per view for /metrics."""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token, stats, start = _start(request)
+            response = await get_response(request)
+            _finish(request, response, token, stats, start)
+            return response
+    else:
+        def middleware(request):
+            token, stats, start = _start(request)
+            response = get_response(request)
+            _finish(request, response, token, stats, start)
+            return response
+    return middleware
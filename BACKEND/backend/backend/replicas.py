@@ -0,0 +1,92 @@
+"""
+Read-replica routing.
+
+Views decorated with @replica_reads send their queries to the `replica`
+database when one is configured. A user who has written anything in the
+last REPLICA_STICKY_SECONDS is kept on the primary instead, so they always
+see their own writes even while the replica lags behind. The marker for
+that lives in the 'replicas' cache, which is shared by all workers when a
+replica is configured.
+"""
+from contextvars import ContextVar
+from functools import wraps
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+
+REPLICA_ALIAS = 'replica'
+
+_use_replica = ContextVar('use_replica', default=False)
+
+cache = caches['replicas']
+
+
+def _sticky_key(user_id):
+    return f"replicas:recent_write:{user_id}"
+
+
+def mark_user_write(user_id):
+    """Pin a user's reads to the primary for the stickiness window."""
+    if user_id is not None:
+        cache.set(_sticky_key(user_id), True, settings.REPLICA_STICKY_SECONDS)
+
+
+def _record_write(sender, instance, **kwargs):
+    # A row belonging to a user, or the user row itself
+    if sender._meta.label == 'userManagement.User':
+        mark_user_write(instance.pk)
+    else:
+        mark_user_write(instance.user_id)
+
+
+def connect_write_receivers():
+    """
+    Record writes to User and to every model with a foreign key to it, so
+    saving anything else doesn't cost a cache write. Called from
+    userManagement's AppConfig.ready().
+    """
+    from userManagement.models import User
+
+    models = [User] + [
+        relation.related_model for relation in User._meta.related_objects if relation.one_to_many
+    ]
+    for model in models:
+        label = model._meta.label
+        post_save.connect(_record_write, sender=model, dispatch_uid=f'replicas_record_save:{label}')
+        post_delete.connect(_record_write, sender=model, dispatch_uid=f'replicas_record_delete:{label}')
+
+
+def replica_reads(view):
+    """
+    Let a read-only view query the replica. The user is taken from a
+    `user_id` URL argument or query parameter; if they wrote recently, or
+    no replica is configured, queries go to the primary as usual.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        user_id = kwargs.get('user_id', request.GET.get('user_id'))
+        use_replica = (
+            REPLICA_ALIAS in settings.DATABASES
+            and cache.get(_sticky_key(user_id)) is None
+        )
+        token = _use_replica.set(use_replica)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _use_replica.reset(token)
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        # The 'replicas' cache table must be read where it's written
+        if _use_replica.get() and model._meta.app_label != 'django_cache':
+            return REPLICA_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
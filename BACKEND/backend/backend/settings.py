@@ -10,20 +10,35 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 
+def _env_int(name, default=None):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
 
-# SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = 'django-insecure-y)@d9l2o4ls#mmk1ncy(n@429ydf9qqiu((+d)mi)+^0%!b0(x'
-
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# Set DJANGO_DEBUG=0 in production.
+DEBUG = os.environ.get('DJANGO_DEBUG', '1') != '0'
+
+# SECURITY WARNING: keep the secret key used in production secret!
+# It signs the API access and refresh tokens, so anyone who knows it can act
+# as any user. The fallback is published with the source and is only
+# accepted with DEBUG on.
+SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY', '')
+if not SECRET_KEY:
+    if not DEBUG:
+        raise ImproperlyConfigured("Set DJANGO_SECRET_KEY when DJANGO_DEBUG is off")
+    SECRET_KEY = 'django-insecure-y)@d9l2o4ls#mmk1ncy(n@429ydf9qqiu((+d)mi)+^0%!b0(x'
 
 ALLOWED_HOSTS = ['127.0.0.1', 'localhost', '10.0.2.2', '*']
 
@@ -35,6 +50,7 @@ INSTALLED_APPS = [
     'sleep_tracker',
     'userManagement',
     'nurition_tracker',
+    'data_sync',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -45,17 +61,27 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    'backend.middleware.metrics_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'userManagement.middleware.token_authentication_middleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
 ROOT_URLCONF = 'backend.urls'
 
+# Addresses allowed to scrape /metrics (backend.metrics). Behind a proxy on
+# the same host every request comes from 127.0.0.1, so either have the proxy
+# refuse /metrics or set METRICS_TOKEN; scrapers then send
+# "Authorization: Bearer <token>".
+METRICS_ALLOWED_IPS = os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -78,13 +104,213 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
+# DB_ENGINE=postgres switches to PostgreSQL (needs psycopg). Left unset, the
+# local SQLite file is used, which is what development and the tests run on.
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'sehat'),
+            'USER': os.environ.get('DB_USER', 'postgres'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            # Keep connections open between requests instead of reconnecting
+            # every time, and check them before reuse so a restarted server
+            # doesn't surface as a failed request
+            'CONN_MAX_AGE': _env_int('DB_CONN_MAX_AGE', 60),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    # Setting DB_POOL_MAX_SIZE uses psycopg's connection pool (psycopg[pool])
+    # instead of persistent connections; Django requires CONN_MAX_AGE=0 then
+    if _env_int('DB_POOL_MAX_SIZE'):
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': _env_int('DB_POOL_MIN_SIZE', 2),
+            'max_size': _env_int('DB_POOL_MAX_SIZE'),
+            'timeout': _env_int('DB_POOL_TIMEOUT', 10),
+        }
+else:
+    # Pragmas applied to every new SQLite connection. WAL lets readers carry on
+    # while a write is in progress, and with WAL synchronous=NORMAL only syncs
+    # at checkpoints. Negative cache_size is in KiB; mmap_size is in bytes.
+    SQLITE_PRAGMAS = {
+        'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'cache_size': _env_int('SQLITE_CACHE_SIZE', -64 * 1024),
+        'mmap_size': _env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+        'busy_timeout': _env_int('SQLITE_BUSY_TIMEOUT', 5000),
+    }
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                'init_command': ';'.join(
+                    f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()
+                ),
+                # Take the write lock when a transaction starts, so two
+                # transactions can't both read and then fail to upgrade
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
+    }
+
+# Optional read replica for history and analytics endpoints (backend.replicas).
+# DB_REPLICA_HOST points at a PostgreSQL standby; DB_REPLICA_NAME alone can
+# name a second SQLite file for local testing. Tests mirror the primary.
+if os.environ.get('DB_REPLICA_HOST') or os.environ.get('DB_REPLICA_NAME'):
+    DATABASES['replica'] = dict(
+        DATABASES['default'],
+        NAME=os.environ.get('DB_REPLICA_NAME', DATABASES['default']['NAME']),
+        HOST=os.environ.get('DB_REPLICA_HOST', DATABASES['default'].get('HOST', '')),
+        PORT=os.environ.get('DB_REPLICA_PORT', DATABASES['default'].get('PORT', '')),
+        # Only ever read from, so no need to take SQLite's write lock up front
+        OPTIONS={
+            key: value for key, value in DATABASES['default']['OPTIONS'].items()
+            if key != 'transaction_mode'
+        },
+        TEST={'MIRROR': 'default'},
+    )
+
+DATABASE_ROUTERS = ['backend.replicas.ReplicaRouter']
+
+# Seconds a user's reads stay on the primary after they write something.
+REPLICA_STICKY_SECONDS = _env_int('REPLICA_STICKY_SECONDS', 10)
+
+# Delta sync (data_sync). Each resource returns at most SYNC_PAGE_SIZE rows per
+# request. A caught-up cursor is re-read from SYNC_CURSOR_OVERLAP_SECONDS before
+# it, so rows inserted by a transaction stamped before the last sync but
+# committed after it still reach the client. Ids the client already holds are
+# skipped in that window; an update committed that late waits for its next change.
+SYNC_PAGE_SIZE = _env_int('SYNC_PAGE_SIZE', 500)
+SYNC_CURSOR_OVERLAP_SECONDS = _env_int('SYNC_CURSOR_OVERLAP_SECONDS', 30)
+
+
+# Stateless API authentication
+# login_user hands out signed access/refresh tokens; the middleware verifies
+# them without a database or session lookup. Lifetimes are in seconds.
+
+ACCESS_TOKEN_LIFETIME = _env_int('ACCESS_TOKEN_LIFETIME', 15 * 60)
+REFRESH_TOKEN_LIFETIME = _env_int('REFRESH_TOKEN_LIFETIME', 30 * 24 * 60 * 60)
+
+# Seconds a resolved user stays in the per-process cache (userManagement.services)
+USER_CACHE_TTL = _env_int('USER_CACHE_TTL', 30)
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Kept in process memory even when 'default' points at a shared server;
+    # only userManagement.services uses it
+    'users': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'users',
+    },
+    # Recent-write markers for backend.replicas; per process is enough while
+    # every read goes to the primary
+    'replicas': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'replicas',
+    },
+}
+
+# With a replica, a user's writes and later reads can be served by different
+# workers, so the markers go in a table on the primary that they all share.
+# Create it with `python manage.py createcachetable`.
+if 'replica' in DATABASES:
+    CACHES['replicas'] = {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'replica_write_markers',
     }
+
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'userManagement.authentication.SignedTokenAuthentication',
+    ],
 }
 
+# Deleting a user removes their logs in batches of this many rows on a
+# background thread (userManagement.deletion). Set USER_DELETION_IN_BACKGROUND=0
+# to run the job inline, e.g. in tests. A job that makes no progress for
+# USER_DELETION_TIMEOUT_SECONDS is taken to be lost with a restarted worker;
+# it is marked failed and deleting the user again queues a new one.
+USER_DELETION_BATCH_SIZE = _env_int('USER_DELETION_BATCH_SIZE', 1000)
+USER_DELETION_IN_BACKGROUND = os.environ.get('USER_DELETION_IN_BACKGROUND', '1') != '0'
+USER_DELETION_TIMEOUT_SECONDS = _env_int('USER_DELETION_TIMEOUT_SECONDS', 60 * 60)
+
+# Versioned diabetes/hypertension models (mlmodels.model_store). Each model's
+# routing.json is checked for changes at most every ML_ROUTING_POLL_SECONDS;
+# shadow predictions run on ML_SHADOW_WORKERS background threads.
+ML_MODEL_STORE = os.environ.get('ML_MODEL_STORE', str(BASE_DIR / 'mlmodels' / 'mlmodel'))
+ML_ROUTING_POLL_SECONDS = _env_int('ML_ROUTING_POLL_SECONDS', 5)
+ML_SHADOW_WORKERS = _env_int('ML_SHADOW_WORKERS', 2)
+
+# Seconds between checks of loaded model files for changes
+# (mlmodels.model_manager); 0 turns hot reloading off.
+ML_RELOAD_POLL_SECONDS = _env_int('ML_RELOAD_POLL_SECONDS', 10)
+
+# The XGBoost/LightGBM classifiers are served from flat tree arrays that
+# every worker memory-maps from ML_TREE_ARRAY_DIR (mlmodels.tree_arrays).
+# ML_TREE_ARRAYS=0 serves the unpickled models instead.
+ML_TREE_ARRAYS = os.environ.get('ML_TREE_ARRAYS', '1') != '0'
+ML_TREE_ARRAY_DIR = os.environ.get('ML_TREE_ARRAY_DIR', os.path.join(ML_MODEL_STORE, '.compiled'))
+
+# Set by gunicorn.conf.py's preload mode: models are loaded in the master
+# before workers fork, except the Keras models, which each worker loads
+# after the fork because TensorFlow's runtime doesn't survive one.
+ML_PRELOAD_MODELS = os.environ.get('ML_PRELOAD_MODELS') == '1'
+
+# With ML_SIDECAR_SOCKET set, the food and retinopathy CNNs run only in the
+# inference sidecar (manage.py run_inference_sidecar) listening on this Unix
+# socket, and web workers never load TensorFlow (mlmodels.sidecar). Requests
+# arriving within ML_SIDECAR_BATCH_WAIT_MS of each other run as one batch of
+# up to ML_SIDECAR_MAX_BATCH images. Timeout is in seconds.
+ML_SIDECAR_SOCKET = os.environ.get('ML_SIDECAR_SOCKET', '')
+ML_SIDECAR_TIMEOUT = _env_int('ML_SIDECAR_TIMEOUT', 30)
+ML_SIDECAR_MAX_BATCH = _env_int('ML_SIDECAR_MAX_BATCH', 32)
+ML_SIDECAR_BATCH_WAIT_MS = _env_int('ML_SIDECAR_BATCH_WAIT_MS', 5)
+
+# Whether retinopathy requests use test-time augmentation when they don't
+# say; a request's "tta" field overrides it
+ML_DR_TTA = os.environ.get('ML_DR_TTA') == '1'
+
+# Fundus image quality check before the retinopathy model: 'reject' answers
+# a bad image with 422 and its issues, 'flag' grades it anyway and reports
+# them, 'off' skips the check. The thresholds in mlmodels.image_quality are
+# not yet calibrated on real photos, so bad images are only flagged for now
+ML_DR_QUALITY_GATE = os.environ.get('ML_DR_QUALITY_GATE', 'flag')
+
+# Largest request body, in bytes, each image endpoint accepts; anything
+# bigger is answered with 413 before it's read. The image arrives as base64
+# in JSON, so a limit of N allows an image of about 3/4 N. These endpoints
+# stream their body, so DATA_UPLOAD_MAX_MEMORY_SIZE doesn't apply to them.
+ML_FOOD_MAX_UPLOAD_BYTES = _env_int('ML_FOOD_MAX_UPLOAD_BYTES', 10 * 1024 * 1024)
+ML_DR_MAX_UPLOAD_BYTES = _env_int('ML_DR_MAX_UPLOAD_BYTES', 30 * 1024 * 1024)
+
+# Uploaded photos are decoded at no more than about ML_IMAGE_DECODE_SIZE
+# pixels a side before the final resize to the models' 224x224 (JPEGs by the
+# decoder itself), and images over ML_IMAGE_MAX_PIXELS are refused with 413
+ML_IMAGE_DECODE_SIZE = _env_int('ML_IMAGE_DECODE_SIZE', 448)
+ML_IMAGE_MAX_PIXELS = _env_int('ML_IMAGE_MAX_PIXELS', 64 * 1000 * 1000)
+
+# Background image analysis jobs (mlmodels.jobs). Each web worker process runs
+# up to ML_JOB_WORKERS jobs at once and keeps at most ML_JOB_QUEUE_DEPTH more
+# waiting; past that a submission is refused with 429. A status request waits
+# at most ML_JOB_MAX_WAIT_SECONDS for its job. Jobs still running
+# ML_JOB_TIMEOUT_SECONDS after they started are reported failed (their worker
+# was restarted), and jobs are deleted ML_JOB_RETENTION_SECONDS after they
+# were submitted.
+ML_JOB_WORKERS = _env_int('ML_JOB_WORKERS', 2)
+ML_JOB_QUEUE_DEPTH = _env_int('ML_JOB_QUEUE_DEPTH', 16)
+ML_JOB_MAX_WAIT_SECONDS = _env_int('ML_JOB_MAX_WAIT_SECONDS', 25)
+ML_JOB_TIMEOUT_SECONDS = _env_int('ML_JOB_TIMEOUT_SECONDS', 300)
+ML_JOB_RETENTION_SECONDS = _env_int('ML_JOB_RETENTION_SECONDS', 24 * 60 * 60)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -104,6 +330,30 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing
+# PASSWORD_HASHER picks the algorithm for new hashes: pbkdf2, argon2 (needs
+# argon2-cffi) or bcrypt (needs bcrypt). The others stay listed so existing
+# hashes still verify; they are rehashed with the current settings on login.
+# Cost settings left unset keep Django's defaults.
+
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'pbkdf2')
+
+_TUNED_HASHERS = {
+    'pbkdf2': 'userManagement.hashers.TunedPBKDF2PasswordHasher',
+    'argon2': 'userManagement.hashers.TunedArgon2PasswordHasher',
+    'bcrypt': 'userManagement.hashers.TunedBCryptSHA256PasswordHasher',
+}
+
+PASSWORD_HASHERS = [_TUNED_HASHERS[PASSWORD_HASHER]] + [
+    path for name, path in _TUNED_HASHERS.items() if name != PASSWORD_HASHER
+]
+
+PASSWORD_PBKDF2_ITERATIONS = _env_int('PASSWORD_PBKDF2_ITERATIONS')
+PASSWORD_ARGON2_TIME_COST = _env_int('PASSWORD_ARGON2_TIME_COST')
+PASSWORD_ARGON2_MEMORY_COST = _env_int('PASSWORD_ARGON2_MEMORY_COST')  # KiB
+PASSWORD_ARGON2_PARALLELISM = _env_int('PASSWORD_ARGON2_PARALLELISM')
+PASSWORD_BCRYPT_ROUNDS = _env_int('PASSWORD_BCRYPT_ROUNDS')
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
@@ -1,6 +1,7 @@
 
 from django.contrib import admin
 from django.urls import path, include
+from .metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -9,4 +10,6 @@ urlpatterns = [
     path('disease/', include('mlmodels.urls')),
     path('detect/', include('mlmodels.urls')),
     path('meals/', include('nurition_tracker.urls')),
+    path('sync/', include('data_sync.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
@@ -0,0 +1,10 @@
+from django.contrib import admin
+from .models import Tombstone
+
+# Register your models here.
+@admin.register(Tombstone)
+class TombstoneAdmin(admin.ModelAdmin):
+    list_display = ('resource', 'object_id', 'user_id', 'deleted_at')
+    list_filter = ('resource',)
+    search_fields = ('user_id', 'object_id')
+    date_hierarchy = 'deleted_at'
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class DataSyncConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'data_sync'
+
+    def ready(self):
+        # Register the post_delete handlers that write tombstones
+        from . import signals  # noqa: F401
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.7 on 2026-10-19 18:29
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField()),
+                ('resource', models.CharField(choices=[('meals', 'Meals'), ('sleep', 'Sleep')], max_length=10)),
+                ('object_id', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'sync_tombstone',
+                'indexes': [models.Index(fields=['user_id', 'resource', 'deleted_at'], name='sync_tomb_user_res_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import models
+from django.utils import timezone
+
+# Create your models here.
+
+class Tombstone(models.Model):
+    """
+    Marker left behind when a synced row is deleted, so clients holding a
+    copy of it can drop it on their next delta sync.
+    """
+    RESOURCES = [
+        ('meals', 'Meals'),
+        ('sleep', 'Sleep'),
+    ]
+
+    # Plain integer rather than a FK so tombstones survive the user row
+    user_id = models.IntegerField()
+    resource = models.CharField(max_length=10, choices=RESOURCES)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'sync_tombstone'
+        indexes = [
+            models.Index(fields=['user_id', 'resource', 'deleted_at'], name='sync_tomb_user_res_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.resource} #{self.object_id} deleted at {self.deleted_at}"
@@ -0,0 +1,19 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from nurition_tracker.models import FoodLog
+from sleep_tracker.models import SleepLog
+from .models import Tombstone
+
+# post_delete only fires for deletes made through the ORM. Raw SQL deletes,
+# like the batches in userManagement.deletion, leave no tombstones; that
+# user's sync goes away with them.
+
+
+@receiver(post_delete, sender=FoodLog)
+def record_meal_deletion(sender, instance, **kwargs):
+    Tombstone.objects.create(user_id=instance.user_id, resource='meals', object_id=instance.meal_id)
+
+
+@receiver(post_delete, sender=SleepLog)
+def record_sleep_deletion(sender, instance, **kwargs):
+    Tombstone.objects.create(user_id=instance.user_id, resource='sleep', object_id=instance.id)
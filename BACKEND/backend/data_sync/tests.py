@@ -0,0 +1,98 @@
+from datetime import timedelta
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from nurition_tracker.models import FoodLog
+from userManagement.models import User
+from userManagement.tokens import issue_tokens
+
+
+def _meal(user, name):
+    return FoodLog.objects.create(
+        user=user, name=name, calories=100, serving_size=1, protein_g=1,
+        carbohydrates_total_g=1, fat_saturated=0, fat_total_g=1, sugar_g=0,
+        fiber_g=0, potassium_mg=0, sodium_g=0, cholesterol_mg=0,
+    )
+
+
+@override_settings(SYNC_PAGE_SIZE=2, SYNC_CURSOR_OVERLAP_SECONDS=30)
+class SyncChangesTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            UserFirstName='Sync', UserLastName='Test', UserEmail='sync@example.com', UserPassword='x',
+        )
+        self.client.defaults['HTTP_AUTHORIZATION'] = f"Bearer {issue_tokens(self.user.UserID)['access_token']}"
+
+    def _sync(self, cursor=None):
+        query = {'user_id': self.user.UserID, 'resources': 'meals'}
+        if cursor:
+            query['meals_since'] = cursor
+        response = self.client.get(reverse('sync_changes'), query)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['meals']
+
+    def _sync_all(self, cursor=None):
+        """Follow `more` to the end; returns (meal ids in order, deleted ids, cursor)."""
+        ids, deleted = [], []
+        while True:
+            changes = self._sync(cursor)
+            ids += [row[0] for row in changes['rows']]
+            deleted += changes['deleted']
+            cursor = changes['cursor']
+            if not changes['more']:
+                return ids, deleted, cursor
+
+    def test_first_sync_is_paged(self):
+        meals = [_meal(self.user, f'meal {i}') for i in range(5)]
+        first = self._sync()
+        self.assertEqual(len(first['rows']), 2)
+        self.assertTrue(first['more'])
+        self.assertIn('~', first['cursor'])
+
+        ids, deleted, cursor = self._sync_all()
+        self.assertEqual(ids, [meal.meal_id for meal in meals])
+        self.assertEqual(deleted, [])
+        self.assertNotIn('~', cursor)
+
+    def test_pages_continue_through_rows_sharing_a_timestamp(self):
+        meals = [_meal(self.user, f'meal {i}') for i in range(5)]
+        FoodLog.objects.update(updated_at=timezone.now())
+        ids, _, _ = self._sync_all()
+        self.assertEqual(sorted(ids), [meal.meal_id for meal in meals])
+
+    def test_row_stamped_before_the_cursor_is_still_sent(self):
+        _meal(self.user, 'early')
+        _, _, cursor = self._sync_all()
+
+        # Written by a transaction that started before the last sync and
+        # committed after it
+        late = _meal(self.user, 'late')
+        FoodLog.objects.filter(pk=late.pk).update(updated_at=timezone.now() - timedelta(seconds=10))
+        ids, _, _ = self._sync_all(cursor)
+        self.assertIn(late.meal_id, ids)
+
+    def test_caught_up_client_is_not_sent_rows_again(self):
+        meals = [_meal(self.user, f'meal {i}') for i in range(3)]
+        _, _, cursor = self._sync_all()
+        self.assertIn('_', cursor)
+
+        changes = self._sync(cursor)
+        self.assertEqual(changes['rows'], [])
+        self.assertEqual(changes['cursor'], cursor)
+
+        meals[0].name = 'edited'
+        meals[0].save()
+        ids, _, _ = self._sync_all(cursor)
+        self.assertEqual(ids, [meals[0].meal_id])
+
+    def test_deletions_are_reported(self):
+        meal_id = _meal(self.user, 'gone').meal_id
+        _, _, cursor = self._sync_all()
+        FoodLog.objects.get(pk=meal_id).delete()
+        ids, deleted, _ = self._sync_all(cursor)
+        self.assertNotIn(meal_id, ids)
+        self.assertEqual(deleted, [meal_id])
+
+    def test_bad_cursor_is_rejected(self):
+        response = self.client.get(reverse('sync_changes'), {'user_id': self.user.UserID, 'meals_since': 'nope'})
+        self.assertEqual(response.status_code, 400)
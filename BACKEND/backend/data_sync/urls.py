@@ -0,0 +1,6 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('changes/', views.sync_changes, name='sync_changes'),
+]
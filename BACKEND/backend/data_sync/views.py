@@ -0,0 +1,188 @@
+from datetime import timedelta, timezone as dt_timezone
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from rest_framework import status
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+from nurition_tracker.models import FoodLog
+from sleep_tracker.models import SleepLog
+from userManagement.authentication import token_user_error
+from .models import Tombstone
+
+# Columns shipped to the client for each synced resource. Rows are sent as
+# positional lists in this order so field names are not repeated per row.
+SYNC_RESOURCES = {
+    'meals': {
+        'model': FoodLog,
+        'fields': [
+            'meal_id', 'name', 'category', 'calories', 'meal_log_time',
+            'protein_g', 'carbohydrates_total_g', 'fat_total_g', 'sugar_g',
+            'fiber_g', 'potassium_mg', 'sodium_g', 'cholesterol_mg',
+            'serving_size', 'fat_saturated',
+        ],
+    },
+    'sleep': {
+        'model': SleepLog,
+        'fields': ['id', 'date', 'sleep_start', 'sleep_end', 'duration'],
+    },
+}
+
+
+def _parse_cursor(value):
+    """
+    (timestamp, after_pk, held_pk) from a cursor. A cursor that continues a
+    page is "<timestamp>~<pk>", the last row sent. A caught-up one is
+    "<timestamp>_<pk>", the highest id the client has been sent.
+    """
+    held_pk = after_pk = None
+    if '~' in value:
+        value, _, after_pk = value.partition('~')
+        after_pk = int(after_pk)
+    elif '_' in value:
+        value, _, held_pk = value.partition('_')
+        held_pk = int(held_pk)
+    dt = parse_datetime(value)
+    if dt is None:
+        raise ValueError(value)
+    if timezone.is_naive(dt):
+        dt = timezone.make_aware(dt, dt_timezone.utc)
+    return dt, after_pk, held_pk
+
+
+def _format_cursor(dt, after_pk=None, held_pk=None):
+    # 'Z' suffix rather than '+00:00' so the cursor survives a query string as-is
+    cursor = dt.astimezone(dt_timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    if after_pk is not None:
+        return f'{cursor}~{after_pk}'
+    return f'{cursor}_{held_pk}' if held_pk is not None else cursor
+
+
+def _encode_value(value):
+    # Durations go out as seconds, everything else is left to the renderer
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return value
+
+
+def _resource_changes(name, user_id, since, after_pk, held_pk):
+    spec = SYNC_RESOURCES[name]
+    fields = spec['fields']
+    page_size = settings.SYNC_PAGE_SIZE
+
+    queryset = spec['model'].objects.filter(user_id=user_id)
+    window_start = since
+    if since is not None and after_pk is not None:
+        # Continuing a page: resume exactly after the last row sent
+        queryset = queryset.filter(Q(updated_at__gt=since) | Q(updated_at=since, pk__gt=after_pk))
+    elif since is not None:
+        # updated_at is stamped before commit, so a row inserted by a slow
+        # transaction can land behind the cursor; re-read a window before it.
+        # Ids the client already holds are left out of the window, so a
+        # caught-up client isn't sent the same rows on every poll
+        window_start = since - timedelta(seconds=settings.SYNC_CURSOR_OVERLAP_SECONDS)
+        late = Q(updated_at__gte=window_start)
+        if held_pk is not None:
+            late &= Q(pk__gt=held_pk)
+        queryset = queryset.filter(Q(updated_at__gt=since) | late)
+    rows = list(
+        queryset.order_by('updated_at', 'pk').values_list(*fields, 'pk', 'updated_at')[:page_size + 1]
+    )
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    high_water = since
+    if rows and (high_water is None or rows[-1][-1] > high_water):
+        high_water = rows[-1][-1]
+    if rows:
+        held_pk = max([held_pk or 0] + [row[-2] for row in rows])
+
+    deleted = []
+    if window_start is not None:
+        # A first sync has nothing to delete on the client, so tombstones are
+        # only relevant once the client holds a cursor
+        tombstones = Tombstone.objects.filter(
+            user_id=user_id, resource=name, deleted_at__gte=window_start
+        ).order_by('deleted_at').values_list('object_id', 'deleted_at')
+        for object_id, deleted_at in tombstones:
+            deleted.append(object_id)
+            if not more and (high_water is None or deleted_at > high_water):
+                high_water = deleted_at
+
+    if more:
+        cursor = _format_cursor(high_water, rows[-1][-2])
+    else:
+        cursor = _format_cursor(high_water, held_pk=held_pk) if high_water else None
+    changes = {
+        'cursor': cursor,
+        'more': more,
+        'rows': [[_encode_value(v) for v in row[:-2]] for row in rows],
+        'deleted': deleted,
+    }
+    if rows:
+        changes['fields'] = fields
+    return changes
+
+
+@api_view(['GET'])
+def sync_changes(request):
+    """
+    Delta sync for meals and sleep logs.
+
+    The client passes the cursor it got back last time for each resource as
+    `<resource>_since` (e.g. `meals_since`, `sleep_since`). Omitting it starts
+    from the beginning of that resource's history. Rows inserted or updated
+    since the cursor are returned, plus the ids of rows deleted since then,
+    at most SYNC_PAGE_SIZE rows at a time; while `more` is true the client
+    should ask again with the new cursor. Rows from the last
+    SYNC_CURSOR_OVERLAP_SECONDS before a caught-up cursor are checked again,
+    but only ids newer than any the client holds are re-sent; deletions in
+    that window are sent again, so clients apply them by id.
+
+    Only changes made through model save() and delete() are seen:
+    QuerySet.update() leaves updated_at alone and raw SQL deletes, such as
+    the batched user deletion, leave no tombstones.
+    """
+    user_id = request.query_params.get('user_id', None)
+
+    if not user_id:
+        return Response(
+            {'error': 'user_id query parameter is required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    error = token_user_error(request, user_id)
+    if error:
+        return error
+
+    try:
+        user_id = int(user_id)
+    except ValueError:
+        return Response(
+            {'error': 'user_id must be an integer'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    requested = request.query_params.get('resources')
+    names = requested.split(',') if requested else list(SYNC_RESOURCES)
+    unknown = [name for name in names if name not in SYNC_RESOURCES]
+    if unknown:
+        return Response(
+            {'error': f'Unknown resources: {", ".join(unknown)}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    result = {}
+    for name in names:
+        raw_cursor = request.query_params.get(f'{name}_since')
+        try:
+            since, after_pk, held_pk = _parse_cursor(raw_cursor) if raw_cursor else (None, None, None)
+        except ValueError:
+            return Response(
+                {'error': f'{name}_since must be an ISO 8601 timestamp'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        result[name] = _resource_changes(name, user_id, since, after_pk, held_pk)
+
+    return Response(result)
@@ -0,0 +1,36 @@
+# gunicorn backend.wsgi -c gunicorn.conf.py
+#
+# With ML_PRELOAD_MODELS=1 the scalers, PCAs and tree models are loaded once
+# in the master and shared copy-on-write by the forked workers; the tree
+# arrays are memory-mapped, so their pages stay shared even after a reload.
+# Keras models are loaded per worker after the fork, since TensorFlow's
+# runtime isn't fork-safe, unless ML_SIDECAR_SOCKET moves them to the
+# inference sidecar. `manage.py benchmark_model_memory` measures the
+# per-worker difference.
+import gc
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+preload_app = os.environ.get('ML_PRELOAD_MODELS') == '1'
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    from mlmodels.model_manager import model_manager
+    # The master never serves requests; each worker polls the model files
+    # from its own watcher thread, started on its first prediction
+    model_manager.skip_watcher_in_this_process()
+    # Importing the views loads the diabetes and hypertension models
+    import mlmodels.views  # noqa: F401
+    # Keep the collector from touching, and so copying, every preloaded object
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from django.conf import settings
+    if preload_app and not settings.ML_SIDECAR_SOCKET:
+        from mlmodels.keras_models import load_keras_models
+        load_keras_models()
@@ -0,0 +1,11 @@
+import numpy as np
+
+
+def dihedral_views(image):
+    """
+    The 8 rotations and mirror images of a square (H, W, C) image, stacked
+    into one (8, H, W, C) batch for test-time augmentation. Fundus photos
+    have no preferred orientation, so the model should agree on all of them.
+    """
+    rotations = [np.rot90(image, k, axes=(0, 1)) for k in range(4)]
+    return np.stack(rotations + [np.flip(rotation, axis=1) for rotation in rotations])
@@ -0,0 +1,184 @@
+"""
+Grading of decoded images by the food and retinopathy models, shared by the
+request views and the background analysis jobs (mlmodels.jobs).
+"""
+import numpy as np
+from django.conf import settings
+from PIL import ExifTags, Image
+from backend.metrics import ml_phase
+from .augmentation import dihedral_views
+from .image_quality import MESSAGES as QUALITY_MESSAGES, assess_fundus
+from .keras_models import predict_images
+from .uploads import UploadTooLarge
+
+# Map class index to food name
+FOOD_CLASSES = [
+    'apple pie', 'baby back ribs', 'baklava', 'beef carpaccio', 'beef tartare',
+    'beet salad', 'beignets', 'bibimbap', 'bread_pudding', 'breakfast_burrito',
+    'bruschetta', 'caesar salad', 'cannoli', 'caprese salad', 'carrot cake',
+    'ceviche', 'cheesecake', 'cheese plate', 'chicken curry', 'chicken quesadilla',
+    'chicken wings', 'chocolate cake', 'chocolate mousse', 'churros', 'clam chowder',
+    'club sandwich', 'crab cakes', 'creme brulee', 'croque madame', 'cup cakes',
+    'deviled eggs', 'donuts', 'dumplings', 'edamame', 'eggs benedict',
+    'escargots', 'falafel', 'filet mignon', 'fish and chips', 'foie gras',
+    'french fries', 'french onion soup', 'french toast', 'fried calamari', 'fried rice',
+    'frozen yogurt', 'garlic bread', 'gnocchi', 'greek salad', 'grilled cheese sandwich',
+    'grilled salmon', 'guacamole', 'gyoza', 'hamburger', 'hot and sour soup',
+    'hot dog', 'huevos rancheros', 'hummus', 'ice cream', 'lasagna',
+    'lobster bisque', 'lobster roll sandwich', 'macaroni and cheese', 'macarons', 'miso soup',
+    'mussels', 'nachos', 'omelette', 'onion rings', 'oysters',
+    'pad thai', 'paella', 'pancakes', 'panna cotta', 'peking duck',
+    'pho', 'pizza', 'pork chop', 'poutine', 'prime rib',
+    'pulled pork sandwich', 'ramen', 'ravioli', 'red velvet cake', 'risotto',
+    'samosa', 'sashimi', 'scallops', 'seaweed salad', 'shrimp and grits',
+    'spaghetti bolognese', 'spaghetti carbonara', 'spring rolls', 'steak', 'strawberry shortcake',
+    'sushi', 'tacos', 'takoyaki', 'tiramisu', 'tuna tartare',
+    'waffles'
+]
+
+# Input size of both CNNs
+MODEL_INPUT_SIZE = (224, 224)
+
+# The transpose that undoes each EXIF orientation
+_ORIENTATIONS = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+# Class labels (index to severity mapping)
+SEVERITY_CLASSES = ['No DR', 'Mild', 'Moderate', 'Severe', 'Proliferative DR']
+
+
+class ImageRejected(Exception):
+    """A retinopathy image turned away by the quality gate."""
+
+    def __init__(self, quality):
+        super().__init__(" ".join(QUALITY_MESSAGES[issue] for issue in quality['issues']))
+        self.quality = quality
+
+
+def open_image(image_file):
+    """
+    Open an uploaded image file (see uploads.read_image_upload). Only the
+    header is read; raises UploadTooLarge for more than ML_IMAGE_MAX_PIXELS.
+    """
+    image = Image.open(image_file)
+    if image.width * image.height > settings.ML_IMAGE_MAX_PIXELS:
+        raise UploadTooLarge(f"Image is larger than {settings.ML_IMAGE_MAX_PIXELS} pixels")
+    return image
+
+
+def load_image(image, size=MODEL_INPUT_SIZE):
+    """
+    Decode an opened image straight down to `size` in RGB, upright per its
+    EXIF orientation.
+
+    A phone photo has 50-1000 times the pixels the models use. JPEGs are
+    decoded at 1/2, 1/4 or 1/8 scale in the DCT domain (draft), then any
+    image still at least twice ML_IMAGE_DECODE_SIZE on its short side is
+    shrunk by a whole factor with a box filter (reduce), so only a few
+    hundred pixels a side reach the final bicubic resize.
+    """
+    orientation = image.getexif().get(ExifTags.Base.Orientation, 1)
+    transpose = _ORIENTATIONS.get(orientation)
+    if transpose in (Image.Transpose.TRANSPOSE, Image.Transpose.TRANSVERSE,
+                     Image.Transpose.ROTATE_90, Image.Transpose.ROTATE_270):
+        # Resized before it's turned upright, so its sides are swapped
+        size = (size[1], size[0])
+
+    # Never decode below the output size, or the resize would upscale
+    decode_size = max(settings.ML_IMAGE_DECODE_SIZE, *size)
+    image.draft('RGB', (decode_size, decode_size))
+    factor = min(image.width, image.height) // decode_size
+    if factor > 1:
+        image = image.reduce(factor)
+    image = image.convert('RGB').resize(size, Image.BICUBIC)
+    if transpose is not None:
+        image = image.transpose(transpose)
+    return image
+
+
+def wants_tta(value):
+    """A request's "tta" field, falling back to ML_DR_TTA when it's absent."""
+    if value is None:
+        return settings.ML_DR_TTA
+    return str(value).lower() in ['1', 'yes', 'true']
+
+
+def classify_food(image):
+    # Resize image to match model input size
+    with ml_phase('food', 'decode'):
+        image = load_image(image)
+
+    with ml_phase('food', 'preprocess'):
+        # Convert to numpy array and preprocess
+        img_array = np.array(image)
+        img_array = img_array / 255.0  # Normalize
+        img_array = np.expand_dims(img_array, axis=0)
+
+    with ml_phase('food', 'inference'):
+        predictions = predict_images('food', img_array)
+
+    # Get the top prediction
+    predicted_class = int(np.argmax(predictions[0]))
+    confidence = float(predictions[0][predicted_class])
+    predicted_food = FOOD_CLASSES[predicted_class]
+    return {
+        "food": predicted_food,
+        "confidence": confidence,
+        "message": f"Detected {predicted_food} with {confidence:.2%} confidence"
+    }
+
+
+def grade_retinopathy(image, use_tta):
+    """Severity for an opened image; raises ImageRejected if the quality gate turns it away."""
+    with ml_phase('retinopathy', 'decode'):
+        image = load_image(image)
+
+    with ml_phase('retinopathy', 'preprocess'):
+        # Convert to numpy array
+        img_array = np.asarray(image, dtype=np.float32) / 255.0  # Normalize
+
+    # Turn away blurry, badly lit and non-fundus images before they cost a
+    # forward pass
+    quality = None
+    if settings.ML_DR_QUALITY_GATE != 'off':
+        with ml_phase('retinopathy', 'quality'):
+            quality = assess_fundus(img_array)
+        if not quality['ok'] and settings.ML_DR_QUALITY_GATE == 'reject':
+            raise ImageRejected(quality)
+
+    # Test-time augmentation: average the model over flipped and rotated
+    # copies, run as one batch rather than one call per copy
+    with ml_phase('retinopathy', 'preprocess'):
+        if use_tta:
+            img_array = dihedral_views(img_array)
+        else:
+            img_array = np.expand_dims(img_array, axis=0)  # Add batch dimension
+
+    # Predict
+    with ml_phase('retinopathy', 'inference'):
+        predictions = predict_images('retinopathy', img_array)
+    probabilities = predictions.mean(axis=0)
+    predicted_class_index = int(np.argmax(probabilities))
+    confidence_score = float(probabilities[predicted_class_index])
+    severity = SEVERITY_CLASSES[predicted_class_index]
+
+    response = {
+        "severity": severity,
+        "confidence": confidence_score,
+        "probabilities": {
+            label: float(probability) for label, probability in zip(SEVERITY_CLASSES, probabilities)
+        },
+        "tta": use_tta,
+        "message": f"Predicted severity: {severity} ({confidence_score:.2%})"
+    }
+    if quality is not None:
+        # In flag mode a poor image is still graded, with its issues attached
+        response["quality"] = quality
+    return response
@@ -0,0 +1,93 @@
+"""
+Cheap checks that a retinopathy upload is a usable fundus photo.
+
+They run on the 224x224 array the model gets, before the model, so a
+blurry, badly exposed or non-fundus image is turned away in about a
+millisecond instead of costing a forward pass.
+"""
+import numpy as np
+
+# Pixels brighter than this (0-1 gray) are inside the camera's circular field
+FIELD_THRESHOLD = 0.06
+# The field must cover at least this much of the frame ...
+MIN_FIELD_FRACTION = 0.3
+# ... and the corners, outside the circle, must be mostly black
+MAX_CORNER_FIELD_FRACTION = 0.25
+# A retina is red: within the field red must beat green by this much on average
+MIN_RED_MARGIN = 0.05
+# Variance of the Laplacian inside the field; lower is too blurry to grade
+MIN_SHARPNESS = 0.0015
+# Mean brightness of the field
+MIN_BRIGHTNESS = 0.15
+MAX_BRIGHTNESS = 0.75
+# Share of field pixels that are blown out
+MAX_OVEREXPOSED_FRACTION = 0.2
+
+MESSAGES = {
+    'not_fundus': "This doesn't look like a retinal (fundus) photo.",
+    'blurry': "The image is too blurry; retake it with the camera in focus.",
+    'too_dark': "The image is too dark; retake it with more light.",
+    'overexposed': "The image is overexposed; retake it with less light.",
+}
+
+_GRAY = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def assess_fundus(image):
+    """
+    Check a (H, W, 3) float image in [0, 1].
+
+    Returns {'ok', 'issues', 'metrics'}; `issues` are keys of MESSAGES.
+    """
+    gray = image @ _GRAY
+    field = gray > FIELD_THRESHOLD
+    height, width = field.shape
+    field_fraction = float(field.mean())
+
+    corner = max(1, min(height, width) // 10)
+    corners = np.concatenate([
+        field[:corner, :corner].ravel(), field[:corner, -corner:].ravel(),
+        field[-corner:, :corner].ravel(), field[-corner:, -corner:].ravel(),
+    ])
+    corner_field_fraction = float(corners.mean())
+
+    issues = []
+    metrics = {
+        'field_fraction': round(field_fraction, 3),
+        'corner_field_fraction': round(corner_field_fraction, 3),
+    }
+    if field_fraction < MIN_FIELD_FRACTION or corner_field_fraction > MAX_CORNER_FIELD_FRACTION:
+        issues.append('not_fundus')
+        return {'ok': False, 'issues': issues, 'metrics': metrics}
+
+    pixels = image[field]
+    red_margin = float(pixels[:, 0].mean() - pixels[:, 1].mean())
+    field_gray = gray[field]
+    brightness = float(field_gray.mean())
+    overexposed = float((field_gray > 0.95).mean())
+
+    # 4-neighbour Laplacian, only where the whole stencil is inside the
+    # field so the edge of the circle doesn't count as detail
+    laplacian = (4 * gray[1:-1, 1:-1] - gray[:-2, 1:-1] - gray[2:, 1:-1]
+                 - gray[1:-1, :-2] - gray[1:-1, 2:])
+    interior = (field[1:-1, 1:-1] & field[:-2, 1:-1] & field[2:, 1:-1]
+                & field[1:-1, :-2] & field[1:-1, 2:])
+    sharpness = float(laplacian[interior].var()) if interior.any() else 0.0
+
+    metrics.update({
+        'red_margin': round(red_margin, 3),
+        'brightness': round(brightness, 3),
+        'overexposed_fraction': round(overexposed, 3),
+        'sharpness': round(sharpness, 5),
+    })
+    if red_margin < MIN_RED_MARGIN:
+        issues.append('not_fundus')
+    if brightness < MIN_BRIGHTNESS:
+        issues.append('too_dark')
+    if brightness > MAX_BRIGHTNESS or overexposed > MAX_OVEREXPOSED_FRACTION:
+        issues.append('overexposed')
+    # Dark images have little contrast to measure, so only judge focus on
+    # an otherwise usable image
+    if not issues and sharpness < MIN_SHARPNESS:
+        issues.append('blurry')
+    return {'ok': not issues, 'issues': issues, 'metrics': metrics}
@@ -0,0 +1,151 @@
+"""
+Background analysis jobs for the image models.
+
+A client that can't hold a request open while a large photo is graded
+posts it to jobs/<kind>/ and gets a job id straight away. The image is
+graded by a small thread pool in the web worker that received it; the
+job's status and result are kept in the database, so any worker can
+answer a poll. Each worker runs at most ML_JOB_WORKERS jobs at once and
+keeps at most ML_JOB_QUEUE_DEPTH more waiting, so a burst is refused
+instead of piling up.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from backend.metrics import Counter, Histogram
+from .image_analysis import ImageRejected, classify_food, grade_retinopathy
+from .models import AnalysisJob
+
+JOBS = Counter('ml_jobs_total', 'Analysis jobs finished, by kind and status.')
+QUEUE_SECONDS = Histogram('ml_job_queue_seconds', 'Time analysis jobs waited for a worker thread, by kind.')
+
+FINISHED = ('done', 'failed')
+
+
+# kind: function(image, **options) returning the job's result
+ANALYSES = {
+    'dr': grade_retinopathy,
+    'food': classify_food,
+}
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class _Pool:
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=settings.ML_JOB_WORKERS, thread_name_prefix='image-analysis')
+        self.slots = threading.BoundedSemaphore(settings.ML_JOB_WORKERS + settings.ML_JOB_QUEUE_DEPTH)
+        # job id: event set when it finishes, for long polls in this process
+        self.finished = {}
+        self.last_purge = 0
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _pool():
+    # Threads don't survive a fork, so each worker process gets its own pool
+    with _pools_lock:
+        pool = _pools.get(os.getpid())
+        if pool is None:
+            pool = _pools[os.getpid()] = _Pool()
+        return pool
+
+
+def _purge_old_jobs(pool):
+    # At most once a minute per process; finished results aren't kept forever
+    if time.monotonic() - pool.last_purge < 60:
+        return
+    pool.last_purge = time.monotonic()
+    cutoff = timezone.now() - timedelta(seconds=settings.ML_JOB_RETENTION_SECONDS)
+    AnalysisJob.objects.filter(created_at__lt=cutoff).delete()
+
+
+def _run_job(job_id, kind, image, options, queued_at, finished):
+    QUEUE_SECONDS.observe(time.monotonic() - queued_at, kind=kind)
+    try:
+        # Nothing to do if the job was purged while it waited
+        if not AnalysisJob.objects.filter(pk=job_id, status='pending').update(
+            status='running', started_at=timezone.now()
+        ):
+            return
+        try:
+            result = ANALYSES[kind](image, **options)
+            update = {'status': 'done', 'result': result}
+        except ImageRejected as e:
+            update = {'status': 'failed', 'error': str(e), 'result': {'quality': e.quality}}
+        except Exception as e:
+            print(f"ERROR in {kind} analysis job {job_id}: {e}")
+            update = {'status': 'failed', 'error': str(e)}
+        # A job that overran ML_JOB_TIMEOUT_SECONDS was already reported
+        # failed; keep that rather than change the answer under a client
+        if AnalysisJob.objects.filter(pk=job_id, status='running').update(finished_at=timezone.now(), **update):
+            JOBS.inc(kind=kind, status=update['status'])
+    except Exception as e:
+        print(f"ERROR recording analysis job {job_id}: {e}")
+    finally:
+        # The pool thread's connection isn't closed by the request cycle
+        connection.close()
+        pool = _pool()
+        pool.slots.release()
+        pool.finished.pop(job_id, None)
+        finished.set()
+
+
+def submit_job(kind, image, **options):
+    """
+    Record a job and queue `image` for analysis. Raises JobQueueFull when
+    this worker already has as many jobs as it will hold.
+    """
+    pool = _pool()
+    if not pool.slots.acquire(blocking=False):
+        raise JobQueueFull("Too many analysis jobs queued; try again shortly")
+    try:
+        _purge_old_jobs(pool)
+        job = AnalysisJob.objects.create(kind=kind)
+    except Exception:
+        pool.slots.release()
+        raise
+    finished = pool.finished[job.pk] = threading.Event()
+    queued_at = time.monotonic()
+    transaction.on_commit(
+        lambda: pool.executor.submit(_run_job, job.pk, kind, image, options, queued_at, finished)
+    )
+    return job
+
+
+def get_job(job_id, wait=0):
+    """
+    The job, after waiting up to `wait` seconds for it to finish. Returns
+    None if there's no such job.
+    """
+    deadline = time.monotonic() + min(wait, settings.ML_JOB_MAX_WAIT_SECONDS)
+    while True:
+        job = AnalysisJob.objects.filter(pk=job_id).first()
+        if job is None or job.status in FINISHED:
+            return job
+        # Only the run is timed, not the wait for a thread: a job running this
+        # long had its worker restarted and will never finish
+        timeout = timedelta(seconds=settings.ML_JOB_TIMEOUT_SECONDS)
+        if job.status == 'running' and job.started_at < timezone.now() - timeout:
+            AnalysisJob.objects.filter(pk=job.pk, status='running').update(
+                status='failed', error="Job was lost; submit the image again", finished_at=timezone.now(),
+            )
+            continue
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return job
+        finished = _pool().finished.get(job.pk)
+        if finished is not None:
+            # Queued in this process: wake as soon as it's done
+            finished.wait(remaining)
+        else:
+            time.sleep(min(0.25, remaining))
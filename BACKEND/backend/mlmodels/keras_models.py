@@ -0,0 +1,72 @@
+"""
+The food detection and retinopathy CNNs.
+
+By default each web worker loads them itself. With ML_SIDECAR_SOCKET set
+they live only in the inference sidecar (manage.py run_inference_sidecar)
+and workers send it their images, so TensorFlow is never imported in a
+worker.
+"""
+import os
+import numpy as np
+from django.conf import settings
+from .model_manager import model_manager
+from .sidecar import SidecarError, sidecar_client
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mlmodel')
+FOOD_MODEL_PATH = os.path.join(MODEL_DIR, 'FOOD101_FINAL_MODEL_MOBILENETV2.h5')
+DR_MODEL_PATH = os.path.join(MODEL_DIR, 'dr_model_final_DR.keras')
+
+KERAS_MODELS = {
+    'food': FOOD_MODEL_PATH,
+    'retinopathy': DR_MODEL_PATH,
+}
+
+
+class ImageModelUnavailable(Exception):
+    pass
+
+
+def _keras_loader(path):
+    def load():
+        import tensorflow as tf
+        return tf.keras.models.load_model(path)
+    return load
+
+
+def run_keras(keras_model, batch):
+    # Calling the model directly skips predict()'s per-call setup, which
+    # costs far more than the forward pass itself for a handful of images
+    return np.asarray(keras_model(np.asarray(batch, dtype=np.float32), training=False))
+
+
+def _warm_up_keras(keras_model):
+    # The first call initialises the kernels; do it before serving, not on a request
+    shape = [dim or 224 for dim in keras_model.input_shape[1:]]
+    run_keras(keras_model, np.zeros([1] + shape, dtype=np.float32))
+
+
+def load_keras_models(names=None):
+    # Loaded once here and reloaded when their files change (model_manager)
+    for name, path in KERAS_MODELS.items():
+        if names is not None and name not in names:
+            continue
+        model_manager.register(name, [path], _keras_loader(path), warmup=_warm_up_keras)
+
+
+def image_model_available(name):
+    # The sidecar's models can't be checked without a round trip; a request
+    # it can't serve fails in predict_images instead
+    return bool(settings.ML_SIDECAR_SOCKET) or model_manager.get(name) is not None
+
+
+def predict_images(name, batch):
+    """Softmax outputs for a (N, H, W, 3) batch, from this process or the sidecar."""
+    if settings.ML_SIDECAR_SOCKET:
+        try:
+            return sidecar_client.predict(name, batch)
+        except SidecarError as e:
+            raise ImageModelUnavailable(str(e))
+    keras_model = model_manager.get(name)
+    if keras_model is None:
+        raise ImageModelUnavailable(f"{name} model failed to load")
+    return run_keras(keras_model, batch)
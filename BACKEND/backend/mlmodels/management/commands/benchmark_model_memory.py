@@ -0,0 +1,164 @@
+import gc
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import pandas as pd
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# name: environment the scenario runs under
+SCENARIOS = {
+    'baseline': {'ML_PRELOAD_MODELS': '0', 'ML_TREE_ARRAYS': '0'},
+    'tree-arrays': {'ML_PRELOAD_MODELS': '0', 'ML_TREE_ARRAYS': '1'},
+    'preload': {'ML_PRELOAD_MODELS': '1', 'ML_TREE_ARRAYS': '0'},
+    'preload+tree-arrays': {'ML_PRELOAD_MODELS': '1', 'ML_TREE_ARRAYS': '1'},
+}
+
+
+def _memory(pid):
+    """RSS, PSS and USS in KiB from /proc (Linux only)."""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1])
+    return {
+        'rss_kib': values['Rss'],
+        'pss_kib': values['Pss'],
+        'uss_kib': values['Private_Clean'] + values['Private_Dirty'],
+    }
+
+
+def _load_models():
+    from mlmodels import views
+    return views
+
+
+def _serve_some_requests():
+    # Touch the models the way requests would, so lazily built state counts
+    from mlmodels.model_store import model_store
+    for _ in range(20):
+        for name in ('diabetes', 'hypertension'):
+            columns = model_store.active(name).scaler.feature_names_in_
+            model_store.predict(name, pd.DataFrame([[0.0] * len(columns)], columns=columns))
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure per-worker memory with and without preloading models before "
+        "fork and with and without memory-mapped tree arrays. Each scenario "
+        "forks --workers processes from a fresh interpreter, like a preforking "
+        "server, and reports their RSS, PSS (shared pages split between "
+        "processes) and USS (pages only that worker has). Linux only."
+    )
+    # The URL checks import mlmodels.views, which would load the models in
+    # the master for every scenario
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+        parser.add_argument('--json', dest='json_path', default=None, help="Also write results to this file")
+        parser.add_argument('--run-scenario', default=None, help="Internal: run one scenario in this process")
+        parser.add_argument('--output', default=None, help="Internal: where --run-scenario writes its result")
+
+    def handle(self, *args, **options):
+        if not os.path.exists('/proc/self/smaps_rollup'):
+            raise CommandError("Needs Linux /proc/<pid>/smaps_rollup")
+        if options['run_scenario']:
+            result = self._run_scenario(options['workers'])
+            with open(options['output'], 'w') as f:
+                json.dump(result, f)
+            return
+
+        names = options['scenarios'].split(',')
+        unknown = [name for name in names if name not in SCENARIOS]
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(unknown)}")
+
+        results = []
+        for name in names:
+            results.append(dict(self._spawn(name, options['workers']), scenario=name))
+
+        self.stdout.write(
+            f"{'scenario':<22} {'workers':>7} {'RSS/worker':>11} {'PSS/worker':>11} "
+            f"{'USS/worker':>11} {'total PSS':>10}  (MiB)"
+        )
+        for result in results:
+            self.stdout.write(
+                f"{result['scenario']:<22} {result['workers']:>7} "
+                f"{result['worker_rss_kib'] / 1024:>11.1f} {result['worker_pss_kib'] / 1024:>11.1f} "
+                f"{result['worker_uss_kib'] / 1024:>11.1f} {result['total_pss_kib'] / 1024:>10.1f}"
+            )
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Results written to {options['json_path']}")
+
+    def _spawn(self, name, workers):
+        """Run a scenario in a fresh interpreter so earlier ones don't skew it."""
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            env = dict(os.environ, ML_RELOAD_POLL_SECONDS='0', **SCENARIOS[name])
+            completed = subprocess.run(
+                [sys.executable, '-m', 'django', 'benchmark_model_memory',
+                 '--run-scenario', name, '--workers', str(workers), '--output', output.name],
+                cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            )
+            if completed.returncode != 0:
+                raise CommandError(f"{name} failed:\n{completed.stderr.decode()[-2000:]}")
+            with open(output.name) as f:
+                return json.load(f)
+
+    def _run_scenario(self, workers):
+        if settings.ML_PRELOAD_MODELS:
+            # What gunicorn.conf.py does in the master
+            views = _load_models()
+            gc.freeze()
+
+        children = []
+        for _ in range(workers):
+            ready_read, ready_write = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    os.close(ready_read)
+                    if settings.ML_PRELOAD_MODELS:
+                        views.load_keras_models()
+                    else:
+                        views = _load_models()
+                    _serve_some_requests()
+                    os.write(ready_write, b'1')
+                    signal.pause()
+                finally:
+                    os._exit(0)
+            os.close(ready_write)
+            children.append((pid, ready_read))
+
+        try:
+            for pid, ready_read in children:
+                if os.read(ready_read, 1) != b'1':
+                    raise CommandError(f"Worker {pid} exited before loading the models")
+            measurements = [_memory(pid) for pid, _ in children]
+            master = _memory(os.getpid())
+        finally:
+            for pid, ready_read in children:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+                os.close(ready_read)
+
+        def mean(key):
+            return round(sum(m[key] for m in measurements) / len(measurements))
+
+        return {
+            'workers': workers,
+            'worker_rss_kib': mean('rss_kib'),
+            'worker_pss_kib': mean('pss_kib'),
+            'worker_uss_kib': mean('uss_kib'),
+            'master_pss_kib': master['pss_kib'],
+            'total_pss_kib': master['pss_kib'] + sum(m['pss_kib'] for m in measurements),
+        }
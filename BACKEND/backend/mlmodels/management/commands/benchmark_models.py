@@ -0,0 +1,224 @@
+import contextlib
+import io
+import json
+import time
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from mlmodels.keras_models import (
+    ImageModelUnavailable, image_model_available, load_keras_models, predict_images,
+)
+from mlmodels.model_manager import model_manager
+from mlmodels.model_store import model_store
+from mlmodels.synthetic import encode_image_base64, synthetic_image, synthetic_tabular_rows
+
+DEFAULT_BATCH_SIZES = '1,2,4,8,16,32,64,128,256'
+
+
+def _tabular_frame(rows, columns):
+    """
+    Numeric frame with the columns a fitted scaler expects. Strings become
+    small integer codes and one-hot columns (`field_Value`) are set from the
+    row, which is all the timing needs.
+    """
+    data = {}
+    for column in columns:
+        if column in rows[0]:
+            codes = {}
+            values = []
+            for row in rows:
+                value = row[column]
+                if isinstance(value, str):
+                    value = codes.setdefault(value, len(codes))
+                values.append(float(value))
+        else:
+            field, _, category = column.rpartition('_')
+            values = [float(str(row.get(field, '')).lower() == category.lower()) for row in rows]
+        data[column] = values
+    return pd.DataFrame(data, columns=columns)
+
+
+# Both kinds load and predict through the same code the views use, so the
+# numbers include whatever that path adds on top of the raw model call
+
+def _tabular_benchmark(name):
+    def load():
+        # The version routed as active, loaded and warmed up like the server does
+        return model_store.active(name)
+
+    def make_batch(size, seed):
+        return synthetic_tabular_rows(size, seed=seed)
+
+    def predict(bundle, rows):
+        return bundle.predict_batch(_tabular_frame(rows, list(bundle.scaler.feature_names_in_)))
+
+    return load, make_batch, predict
+
+
+def _image_benchmark(name):
+    def load():
+        # With the sidecar configured the model lives there, and so does its load time
+        if not settings.ML_SIDECAR_SOCKET:
+            load_keras_models([name])
+        if not image_model_available(name):
+            raise ImageModelUnavailable(model_manager.error(name))
+        return name
+
+    def make_batch(size, seed):
+        rng = np.random.default_rng(seed)
+        return rng.random((size, 224, 224, 3), dtype=np.float32)
+
+    def predict(loaded, batch):
+        return predict_images(loaded, batch)
+
+    return load, make_batch, predict
+
+
+# name: (benchmark functions, view for end-to-end latency, request payload)
+MODELS = {
+    'diabetes': (
+        _tabular_benchmark('diabetes'),
+        'predict_diabetes',
+        lambda seed: synthetic_tabular_rows(1, seed=seed)[0],
+    ),
+    'hypertension': (
+        _tabular_benchmark('hypertension'),
+        'predict_hypertension',
+        lambda seed: synthetic_tabular_rows(1, seed=seed)[0],
+    ),
+    'food': (
+        _image_benchmark('food'),
+        'detect_food',
+        lambda seed: {'image': encode_image_base64(synthetic_image(seed=seed))},
+    ),
+    'dr': (
+        _image_benchmark('retinopathy'),
+        'predict_retinopathy_severity',
+        lambda seed: {'image': encode_image_base64(synthetic_image(seed=seed, fundus=True))},
+    ),
+}
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+class Command(BaseCommand):
+    # The URL check would import the views, which load the models before
+    # they can be timed
+    requires_system_checks = []
+    help = (
+        "Benchmark the ML models on synthetic inputs: load and warm-up time, first call, "
+        "single-request latency through the view, and batch throughput."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--models', default=','.join(MODELS), help="Comma separated: " + ', '.join(MODELS))
+        parser.add_argument('--samples', type=int, default=50, help="Requests timed through each view")
+        parser.add_argument('--batch-sizes', default=DEFAULT_BATCH_SIZES)
+        parser.add_argument('--repeats', type=int, default=5, help="Timed runs per batch size")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', dest='json_path', default=None, help="Also write results to this file")
+
+    def handle(self, *args, **options):
+        names = options['models'].split(',')
+        unknown = [name for name in names if name not in MODELS]
+        if unknown:
+            raise CommandError(f"Unknown models: {', '.join(unknown)}")
+        batch_sizes = [int(size) for size in options['batch_sizes'].split(',')]
+
+        # Load everything first: importing the views for the latency runs
+        # loads any model not loaded yet, which would hide its load time
+        loads = [self._load(name) for name in names]
+        results = []
+        for name, (result, loaded) in zip(names, loads):
+            if loaded is not None:
+                self._benchmark(name, result, loaded, options, batch_sizes)
+            results.append(result)
+            self._print(result)
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Results written to {options['json_path']}")
+
+    def _load(self, name):
+        load = MODELS[name][0][0]
+        result = {'model': name}
+        try:
+            start = time.perf_counter()
+            loaded = load()
+            result['load_ms'] = _ms(time.perf_counter() - start)
+        except Exception as e:
+            result['error'] = f"failed to load: {e}"
+            return result, None
+        return result, loaded
+
+    def _benchmark(self, name, result, loaded, options, batch_sizes):
+        (_, make_batch, predict), view_name, make_payload = MODELS[name]
+        seed = options['seed']
+
+        # Loading already warms the model up; this is what the first call still pays
+        batch = make_batch(1, seed)
+        start = time.perf_counter()
+        predict(loaded, batch)
+        result['first_call_ms'] = _ms(time.perf_counter() - start)
+
+        result['batches'] = []
+        for size in batch_sizes:
+            batch = make_batch(size, seed + size)
+            predict(loaded, batch)
+            timings = []
+            for _ in range(options['repeats']):
+                start = time.perf_counter()
+                predict(loaded, batch)
+                timings.append(time.perf_counter() - start)
+            median = float(np.median(timings))
+            result['batches'].append({
+                'batch_size': size,
+                'ms_per_batch': _ms(median),
+                'samples_per_second': round(size / median, 1),
+            })
+
+        result['view'] = self._time_view(view_name, make_payload, options['samples'], seed)
+
+    def _time_view(self, view_name, make_payload, samples, seed):
+        """End-to-end latency of the real view, including parsing and preprocessing."""
+        from mlmodels import views
+        view = getattr(views, view_name)
+        factory = RequestFactory()
+        requests = [
+            factory.post('/', json.dumps(make_payload(seed + i)), content_type='application/json')
+            for i in range(samples + 1)
+        ]
+        timings, statuses = [], {}
+        # The views print debug output on every request
+        with contextlib.redirect_stdout(io.StringIO()):
+            view(requests[0])
+            for request in requests[1:]:
+                start = time.perf_counter()
+                response = view(request)
+                timings.append(time.perf_counter() - start)
+                statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+        timings = np.array(timings)
+        return {
+            'p50_ms': _ms(float(np.percentile(timings, 50))),
+            'p95_ms': _ms(float(np.percentile(timings, 95))),
+            'status_codes': statuses,
+        }
+
+    def _print(self, result):
+        self.stdout.write(f"\n{result['model']}")
+        if 'error' in result:
+            self.stdout.write(f"  {result['error']}")
+            return
+        view = result['view']
+        self.stdout.write(
+            f"  load + warm-up {result['load_ms']} ms, first call {result['first_call_ms']} ms, "
+            f"view p50 {view['p50_ms']} ms / p95 {view['p95_ms']} ms {view['status_codes']}"
+        )
+        self.stdout.write(f"  {'batch':>6} {'ms/batch':>10} {'samples/s':>10}")
+        for row in result['batches']:
+            self.stdout.write(f"  {row['batch_size']:>6} {row['ms_per_batch']:>10} {row['samples_per_second']:>10}")
@@ -0,0 +1,80 @@
+import json
+import os
+import shutil
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from mlmodels.model_store import LEGACY_FILES, LEGACY_VERSION, ROLES, ModelStoreError, default_routing, read_routing
+
+
+def _write_json(path, data):
+    # Write then rename so a worker never reads a half-written file
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy a scaler, PCA and model into the model store as a new version and/or "
+        "change which versions are served. Running workers pick the change up "
+        "within ML_ROUTING_POLL_SECONDS."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(LEGACY_FILES))
+        parser.add_argument('version')
+        for role in ROLES:
+            parser.add_argument(f'--{role}', help=f"{role} pickle to publish under this version")
+        mode = parser.add_mutually_exclusive_group()
+        mode.add_argument('--activate', action='store_true', help="Serve this version to all traffic")
+        mode.add_argument('--candidate', action='store_true', help="Make this version the candidate")
+        parser.add_argument('--percent', type=float, default=0, help="Share of traffic the candidate serves")
+        parser.add_argument('--shadow', action='store_true', help="Also run the other version in the background")
+
+    def handle(self, *args, **options):
+        name, version = options['name'], options['version']
+        model_dir = os.path.join(settings.ML_MODEL_STORE, name)
+        version_dir = os.path.join(model_dir, version)
+
+        files = {role: options[role] for role in ROLES if options[role]}
+        if files:
+            if version == LEGACY_VERSION:
+                raise CommandError(f"'{LEGACY_VERSION}' is reserved for the original files")
+            if len(files) != len(ROLES):
+                raise CommandError("Pass all of --scaler, --pca and --model")
+            if os.path.exists(version_dir):
+                raise CommandError(f"{name} {version} already exists; publish a new version instead")
+            os.makedirs(version_dir)
+            manifest = {'files': {}}
+            for role, source in files.items():
+                # Named after the role, so artifacts sharing a basename don't collide
+                filename = role + os.path.splitext(source)[1]
+                shutil.copy2(source, os.path.join(version_dir, filename))
+                manifest['files'][role] = filename
+            _write_json(os.path.join(version_dir, 'manifest.json'), manifest)
+            self.stdout.write(f"Published {name} {version}")
+        elif version != LEGACY_VERSION and not os.path.isfile(os.path.join(version_dir, 'manifest.json')):
+            raise CommandError(f"{name} {version} has not been published")
+
+        if not (options['activate'] or options['candidate']):
+            return
+
+        routing_path = os.path.join(model_dir, 'routing.json')
+        routing = default_routing()
+        if os.path.exists(routing_path):
+            try:
+                routing = read_routing(routing_path)
+            except ModelStoreError as e:
+                raise CommandError(f"{e}; fix or remove it first")
+
+        if options['activate']:
+            routing.update(active=version, candidate=None, candidate_percent=0, shadow=False)
+        else:
+            if not 0 <= options['percent'] <= 100:
+                raise CommandError("--percent must be between 0 and 100")
+            routing.update(candidate=version, candidate_percent=options['percent'], shadow=options['shadow'])
+
+        os.makedirs(model_dir, exist_ok=True)
+        _write_json(routing_path, routing)
+        self.stdout.write(f"Routing for {name}: {json.dumps(routing)}")
@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from mlmodels.keras_models import load_keras_models, run_keras
+from mlmodels.sidecar import InferenceServer
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the inference sidecar: load the food and retinopathy models once "
+        "and serve all web workers over the ML_SIDECAR_SOCKET Unix socket."
+    )
+    # Nothing here needs the URLconf, and importing it would load the
+    # tabular models too
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=settings.ML_SIDECAR_SOCKET)
+        parser.add_argument('--max-batch', type=int, default=settings.ML_SIDECAR_MAX_BATCH,
+                            help="Most images run in one forward pass")
+        parser.add_argument('--batch-wait-ms', type=int, default=settings.ML_SIDECAR_BATCH_WAIT_MS,
+                            help="How long the first request waits for others to batch with")
+
+    def handle(self, *args, **options):
+        if not options['socket']:
+            raise CommandError("Set ML_SIDECAR_SOCKET or pass --socket")
+        load_keras_models()
+        server = InferenceServer(
+            options['socket'], run_keras, max_batch=options['max_batch'], batch_wait=options['batch_wait_ms'] / 1000,
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
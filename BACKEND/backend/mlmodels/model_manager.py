@@ -0,0 +1,177 @@
+"""
+Loaded models that follow their files on disk.
+
+Each registered model is loaded once and its files are polled every
+ML_RELOAD_POLL_SECONDS. When a file's size or mtime changes and its
+checksum really differs, the new model is loaded and warmed up on the
+watcher thread, then swapped in with a single reference assignment.
+Requests that already hold the old model finish on it; it is freed when
+the last of them drops its reference.
+"""
+import gc
+import hashlib
+import os
+import threading
+import time
+from django.conf import settings
+from backend.metrics import Counter
+
+RELOADS = Counter('ml_model_reloads_total', 'Model reloads triggered by changed files, by model and result.')
+
+
+def _signature(paths):
+    """Cheap change check: (mtime, size) of every file, None if one is missing."""
+    try:
+        return tuple((os.stat(path).st_mtime_ns, os.stat(path).st_size) for path in paths)
+    except FileNotFoundError:
+        return None
+
+
+def _checksum(paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _Entry:
+    def __init__(self, key, paths, loader, warmup):
+        self.key = key
+        self.paths = paths
+        self.loader = loader
+        self.warmup = warmup
+        self.current = None
+        self.error = None
+        self.signature = None
+        self.checksum = None
+        # Signature seen on the last poll; a file is only reloaded once it
+        # has stopped changing, so a half-copied file is never loaded
+        self.pending = None
+
+
+class ModelManager:
+    def __init__(self, poll_seconds=10):
+        self.poll_seconds = poll_seconds
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._watcher_pid = None
+        self._collect_pending = False
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def keys(self, prefix=''):
+        return [key for key in list(self._entries) if key.startswith(prefix)]
+
+    def register(self, key, paths, loader, warmup=None):
+        """
+        Load a model now and keep it up to date. `loader()` returns the model
+        and `warmup(model)` runs it once before it serves requests. A model
+        that fails to load is retried when its files change.
+        """
+        with self._lock:
+            if key in self._entries:
+                return
+            entry = _Entry(key, list(paths), loader, warmup)
+            entry.signature = _signature(entry.paths)
+            self._load(entry)
+            self._entries[key] = entry
+        self._ensure_watcher()
+
+    def unregister(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry.current = None
+            # Collected on the watcher thread, not in the request that got here
+            self._collect_pending = True
+
+    def get(self, key):
+        """The current model, or None if it isn't loaded."""
+        self._ensure_watcher()
+        entry = self._entries.get(key)
+        return entry.current if entry is not None else None
+
+    def error(self, key):
+        entry = self._entries.get(key)
+        return entry.error if entry is not None else 'not loaded'
+
+    def _load(self, entry):
+        """Load and warm up a new model; returns False and keeps the old one on failure."""
+        try:
+            checksum = _checksum(entry.paths) if entry.signature is not None else None
+            model = entry.loader()
+            if entry.warmup is not None:
+                entry.warmup(model)
+        except Exception as e:
+            print(f"ERROR loading model {entry.key}: {e}")
+            entry.error = str(e)
+            return False
+        entry.checksum = checksum
+        entry.error = None
+        entry.current = model
+        return True
+
+    def check(self):
+        """One polling pass over every registered model."""
+        for key in self.keys():
+            entry = self._entries.get(key)
+            if entry is None:
+                continue
+            signature = _signature(entry.paths)
+            if signature == entry.signature or signature is None:
+                entry.pending = None
+                continue
+            if signature != entry.pending:
+                entry.pending = signature
+                continue
+            entry.pending = None
+            entry.signature = signature
+            if entry.checksum is not None and _checksum(entry.paths) == entry.checksum:
+                # Touched or copied over with identical content
+                continue
+
+            start = time.perf_counter()
+            old = entry.current
+            if self._load(entry):
+                RELOADS.inc(model=key, result='ok')
+                print(f"Reloaded model {key} in {time.perf_counter() - start:.2f}s")
+                # Release the old model once in-flight requests are done with it;
+                # collecting here frees the reference cycles models tend to have
+                del old
+                gc.collect()
+            else:
+                RELOADS.inc(model=key, result='failed')
+
+    def skip_watcher_in_this_process(self):
+        """
+        For a process that only loads models for forked children to inherit,
+        such as the gunicorn master: its children each start their own.
+        """
+        self._watcher_pid = os.getpid()
+
+    def _ensure_watcher(self):
+        # Threads don't survive fork, so each worker process starts its own
+        if self.poll_seconds <= 0 or self._watcher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._watcher_pid == os.getpid():
+                return
+            self._watcher_pid = os.getpid()
+        threading.Thread(target=self._watch, name='ml-model-watcher', daemon=True).start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_seconds)
+            try:
+                self.check()
+            except Exception as e:
+                print(f"ERROR checking model files: {e}")
+            if self._collect_pending:
+                self._collect_pending = False
+                gc.collect()
+
+
+model_manager = ModelManager(settings.ML_RELOAD_POLL_SECONDS)
@@ -0,0 +1,357 @@
+"""
+Versioned model artifacts for the risk predictors.
+
+Layout under settings.ML_MODEL_STORE:
+
+    <model>/<version>/manifest.json   {"files": {"scaler": ..., "pca": ..., "model": ...}}
+    <model>/<version>/<artifact files>
+    <model>/routing.json              {"active": "v1", "candidate": "v2",
+                                       "candidate_percent": 10, "shadow": true}
+
+`candidate_percent` of requests are served by the candidate. With `shadow`
+the version that didn't serve a request also predicts it in the background,
+and the two results are compared. Without a routing file the flat files that
+predate the store are served as version "legacy". routing.json is re-read
+when it changes, so switching versions doesn't need a restart, and the
+artifacts of loaded versions are watched by mlmodels.model_manager. A newly
+routed version is loaded in the background; until it is ready, requests
+stay on the version they were served by before.
+"""
+import json
+import os
+import pickle
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from backend.metrics import Counter, Histogram
+from .model_manager import model_manager
+from .tree_arrays import UnsupportedModel, load_or_compile
+
+LEGACY_VERSION = 'legacy'
+
+# Artifacts every version has, as listed in its manifest
+ROLES = ('scaler', 'pca', 'model')
+
+# Files served as the "legacy" version, as they were named before the store
+LEGACY_FILES = {
+    'diabetes': {
+        'scaler': 'DiabetesScaler_SMOTE.pkl',
+        'pca': 'DiabetesPca_SMOTE.pkl',
+        'model': 'Diabetes_model_SMOTE.pkl',
+    },
+    'hypertension': {
+        'scaler': 'HP_LGBM_SCALER.pkl',
+        'pca': 'HP_LGBM_PCA.pkl',
+        'model': 'HP_LGBM_MODEL.pkl',
+    },
+}
+
+PREDICTIONS = Counter('ml_predictions_total', 'Predictions served, by model and version.')
+VERSION_SECONDS = Histogram(
+    'ml_version_inference_seconds', 'Scaling, PCA and prediction time, by model, version and role.'
+)
+SHADOW_COMPARISONS = Counter(
+    'ml_shadow_comparisons_total', 'Shadow predictions, by model, both versions and whether they agreed.'
+)
+
+
+class ModelStoreError(Exception):
+    pass
+
+
+def default_routing():
+    return {'active': LEGACY_VERSION, 'candidate': None, 'candidate_percent': 0, 'shadow': False}
+
+
+def read_routing(path):
+    """
+    The routing in `path` over the defaults. Raises ModelStoreError if the
+    file can't be read or isn't a valid routing object.
+    """
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ModelStoreError(f"unreadable routing file {path}: {e}")
+    if not isinstance(data, dict):
+        raise ModelStoreError(f"{path}: routing must be a JSON object")
+
+    config = default_routing()
+    config.update(data)
+    if not isinstance(config['active'], str) or not config['active']:
+        raise ModelStoreError(f"{path}: 'active' must be a version name")
+    if config['candidate'] is not None and not isinstance(config['candidate'], str):
+        raise ModelStoreError(f"{path}: 'candidate' must be a version name or null")
+    percent = config['candidate_percent']
+    if isinstance(percent, bool) or not isinstance(percent, (int, float)) or not 0 <= percent <= 100:
+        raise ModelStoreError(f"{path}: 'candidate_percent' must be a number from 0 to 100")
+    if not isinstance(config['shadow'], bool):
+        raise ModelStoreError(f"{path}: 'shadow' must be true or false")
+    return config
+
+
+def _unpickle(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+class ModelBundle:
+    """Scaler, PCA and classifier of one model version."""
+
+    def __init__(self, name, version, scaler, pca, model):
+        self.name = name
+        self.version = version
+        self.scaler = scaler
+        self.pca = pca
+        self.model = model
+
+    def predict(self, features_df):
+        return int(self.predict_batch(features_df)[0])
+
+    def predict_batch(self, features_df):
+        """Predictions for every row of the frame."""
+        # Versions may be trained on different one-hot columns; give each the
+        # columns its scaler was fitted on, missing ones as 0
+        columns = getattr(self.scaler, 'feature_names_in_', None)
+        if columns is not None:
+            features_df = features_df.reindex(columns=columns, fill_value=0)
+        return self.model.predict(self.pca.transform(self.scaler.transform(features_df)))
+
+    def warm_up(self):
+        columns = getattr(self.scaler, 'feature_names_in_', None)
+        if columns is None:
+            columns = range(self.scaler.n_features_in_)
+        self.predict(pd.DataFrame(np.zeros((1, len(columns))), columns=columns))
+
+
+class ModelStore:
+    def __init__(self, root, poll_seconds=5, shadow_workers=2, max_pending_shadows=100, tree_array_dir=None):
+        self.root = root
+        self.tree_array_dir = tree_array_dir
+        self.poll_seconds = poll_seconds
+        self.max_pending_shadows = max_pending_shadows
+        self._routing = {}
+        self._lock = threading.Lock()
+        self._shadow_pool = ThreadPoolExecutor(max_workers=shadow_workers, thread_name_prefix='ml-shadow')
+        self._pending_shadows = 0
+        # Newly routed versions are loaded one at a time off the request path
+        self._loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ml-model-loader')
+        self._loading = set()
+        # name: the active version last served, kept while its successor loads
+        self._served = {}
+
+    def _model_dir(self, name):
+        return os.path.join(self.root, name)
+
+    def versions(self, name):
+        directory = self._model_dir(name)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(
+            entry for entry in os.listdir(directory)
+            if os.path.isfile(os.path.join(directory, entry, 'manifest.json'))
+        )
+
+    def routing(self, name):
+        """Routing for a model, re-read when routing.json changes on disk."""
+        now = time.monotonic()
+        cached = self._routing.get(name)
+        if cached is not None and now - cached['checked'] < self.poll_seconds:
+            return cached['config']
+
+        path = os.path.join(self._model_dir(name), 'routing.json')
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if cached is not None and cached['mtime'] == mtime:
+            cached['checked'] = now
+            return cached['config']
+
+        config = default_routing()
+        if mtime is not None:
+            try:
+                config = read_routing(path)
+            except ModelStoreError as e:
+                # Keep serving the last good routing rather than failing requests
+                print(f"ERROR reading routing for {name}: {e}")
+                if cached is not None:
+                    cached['mtime'] = mtime
+                    cached['checked'] = now
+                    return cached['config']
+        self._routing[name] = {'config': config, 'mtime': mtime, 'checked': now}
+        if cached is None:
+            # First read: the versions are loaded by whoever asks for them
+            self._release_unrouted(name)
+        else:
+            self._switch(name, config)
+        return config
+
+    def _release_unrouted(self, name):
+        config = self._routing[name]['config']
+        routed = {config['active'], config.get('candidate')}
+        for key in model_manager.keys(f'{name}:'):
+            if key.split(':', 1)[1] not in routed:
+                model_manager.unregister(key)
+
+    def _switch(self, name, config):
+        """
+        Load newly routed versions in the background, then release the
+        versions no longer routed. Until then requests keep the old ones.
+        """
+        new = []
+        with self._lock:
+            for version in (config['active'], config.get('candidate')):
+                key = f'{name}:{version}'
+                if version and key not in model_manager and key not in self._loading:
+                    self._loading.add(key)
+                    new.append(version)
+        if not new:
+            self._release_unrouted(name)
+            return
+        self._loader.submit(self._load_in_background, name, new)
+
+    def _load_in_background(self, name, versions):
+        for version in versions:
+            try:
+                self.load(name, version)
+            except ModelStoreError as e:
+                # Requests for it will load it themselves and report the error
+                print(f"ERROR loading {name} {version} in the background: {e}")
+            finally:
+                with self._lock:
+                    self._loading.discard(f'{name}:{version}')
+        self._release_unrouted(name)
+
+    def _is_loading(self, name, version):
+        return f'{name}:{version}' in self._loading
+
+    def _manifest_path(self, name, version):
+        return os.path.join(self._model_dir(name), version, 'manifest.json')
+
+    def _artifact_paths(self, name, version):
+        if version == LEGACY_VERSION:
+            return {role: os.path.join(self.root, filename) for role, filename in LEGACY_FILES[name].items()}
+        try:
+            with open(self._manifest_path(name, version)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            raise ModelStoreError(f"{name} {version}: unreadable manifest: {e}")
+        files = manifest.get('files') if isinstance(manifest, dict) else None
+        if not isinstance(files, dict) or set(files) != set(ROLES):
+            raise ModelStoreError(f"{name} {version}: manifest must list files for {', '.join(ROLES)}")
+        for filename in files.values():
+            if not isinstance(filename, str) or not filename or os.path.basename(filename) != filename:
+                raise ModelStoreError(f"{name} {version}: bad file name in manifest: {filename!r}")
+        directory = os.path.join(self._model_dir(name), version)
+        return {role: os.path.join(directory, filename) for role, filename in files.items()}
+
+    def _load_trees(self, name, version, path):
+        """The classifier as memory-mapped tree arrays, or None to use the pickle."""
+        try:
+            return load_or_compile(path, os.path.join(self.tree_array_dir, name, version), lambda: _unpickle(path))
+        except (UnsupportedModel, OSError) as e:
+            print(f"Serving {name} {version} from its pickle, not tree arrays: {e}")
+            return None
+
+    def _load_bundle(self, name, version):
+        artifacts = {}
+        for role, path in self._artifact_paths(name, version).items():
+            if role == 'model' and self.tree_array_dir:
+                artifacts[role] = self._load_trees(name, version, path)
+                if artifacts[role] is not None:
+                    continue
+            artifacts[role] = _unpickle(path)
+        return ModelBundle(name, version, artifacts['scaler'], artifacts['pca'], artifacts['model'])
+
+    def load(self, name, version):
+        """A loaded version; loading it the first time it is asked for."""
+        key = f'{name}:{version}'
+        if key not in model_manager:
+            paths = list(self._artifact_paths(name, version).values())
+            if version != LEGACY_VERSION:
+                paths.append(self._manifest_path(name, version))
+            model_manager.register(
+                key, paths, lambda: self._load_bundle(name, version), warmup=ModelBundle.warm_up
+            )
+        bundle = model_manager.get(key)
+        if bundle is None:
+            raise ModelStoreError(f"{name} {version}: {model_manager.error(key)}")
+        return bundle
+
+    def active(self, name):
+        return self.load(name, self.routing(name)['active'])
+
+    def choose(self, name):
+        """(bundle to serve, bundle to shadow or None) for one request."""
+        routing = self.routing(name)
+        active = None
+        if self._is_loading(name, routing['active']):
+            # Switching versions: stay on the old one until the new one is ready
+            active = model_manager.get(f'{name}:{self._served.get(name)}')
+        if active is None:
+            active = self.load(name, routing['active'])
+        self._served[name] = active.version
+        candidate_version = routing.get('candidate')
+        if not candidate_version or candidate_version == active.version or self._is_loading(name, candidate_version):
+            return active, None
+        try:
+            candidate = self.load(name, candidate_version)
+        except ModelStoreError as e:
+            # A broken candidate must not take the active version down with it
+            print(f"ERROR loading candidate: {e}")
+            return active, None
+
+        if random.random() * 100 < routing.get('candidate_percent', 0):
+            served, other = candidate, active
+        else:
+            served, other = active, candidate
+        return served, other if routing.get('shadow') else None
+
+    def predict(self, name, features_df):
+        """Predict with the routed version; returns (prediction, version)."""
+        served, shadow = self.choose(name)
+        start = time.perf_counter()
+        prediction = served.predict(features_df)
+        VERSION_SECONDS.observe(time.perf_counter() - start, model=name, version=served.version, role='served')
+        PREDICTIONS.inc(model=name, version=served.version)
+        if shadow is not None:
+            self._submit_shadow(served, shadow, features_df, prediction)
+        return prediction, served.version
+
+    def _submit_shadow(self, served, shadow, features_df, prediction):
+        with self._lock:
+            # Shadow traffic is best effort; drop it rather than queue without bound
+            if self._pending_shadows >= self.max_pending_shadows:
+                return
+            self._pending_shadows += 1
+        self._shadow_pool.submit(self._run_shadow, served, shadow, features_df, prediction)
+
+    def _run_shadow(self, served, shadow, features_df, prediction):
+        try:
+            start = time.perf_counter()
+            shadow_prediction = shadow.predict(features_df)
+            VERSION_SECONDS.observe(
+                time.perf_counter() - start, model=served.name, version=shadow.version, role='shadow'
+            )
+            SHADOW_COMPARISONS.inc(
+                model=served.name, served=served.version, shadow=shadow.version,
+                agree=str(shadow_prediction == prediction).lower(),
+            )
+        except Exception as e:
+            print(f"ERROR in shadow prediction ({served.name} {shadow.version}): {e}")
+        finally:
+            with self._lock:
+                self._pending_shadows -= 1
+
+
+model_store = ModelStore(
+    settings.ML_MODEL_STORE,
+    poll_seconds=settings.ML_ROUTING_POLL_SECONDS,
+    shadow_workers=settings.ML_SHADOW_WORKERS,
+    tree_array_dir=settings.ML_TREE_ARRAY_DIR if settings.ML_TREE_ARRAYS else None,
+)
@@ -1,3 +1,4 @@
+import uuid
 from django.db import models
 from userManagement.models import User
 
@@ -32,4 +33,30 @@ class HypertensionPredictionLog(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
-        return f"{self.user.UserFirstName}'s hypertension prediction on {self.timestamp}"
\ No newline at end of file
+        return f"{self.user.UserFirstName}'s hypertension prediction on {self.timestamp}"
+
+
+class AnalysisJob(models.Model):
+    STATUSES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    KINDS = [
+        ('dr', 'Retinopathy'),
+        ('food', 'Food'),
+    ]
+
+    # Random ids: results are health data and shouldn't be guessable
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=10, choices=KINDS)
+    status = models.CharField(max_length=10, choices=STATUSES, default='pending')
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.kind} analysis {self.id} ({self.status})"
@@ -0,0 +1,257 @@
+"""
+Local inference sidecar for the CNN models.
+
+One process (manage.py run_inference_sidecar) owns the Keras models and
+serves every web worker over a Unix socket. A worker writes its image
+batch into a shared memory segment it keeps per thread and sends only the
+segment's name, shape and dtype; the pixels are never serialized. Requests
+from all workers that arrive within a few milliseconds of each other run
+as one batch.
+
+Messages on the socket are a 4-byte big-endian length followed by JSON.
+"""
+import json
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+import weakref
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from django.conf import settings
+from .model_manager import model_manager
+
+_HEADER = struct.Struct('!I')
+# Smallest shared memory segment a client allocates; enough for a few images
+MIN_BUFFER_BYTES = 4 * 1024 * 1024
+
+
+class SidecarError(Exception):
+    pass
+
+
+def _release(shm):
+    shm.close()
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class _Segment:
+    """A client's shared memory segment, unlinked when its thread's state goes away."""
+
+    def __init__(self, size):
+        self.shm = SharedMemory(create=True, size=size)
+        self.release = weakref.finalize(self, _release, self.shm)
+
+
+def _send(sock, message):
+    data = json.dumps(message).encode()
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data += chunk
+    return bytes(data)
+
+
+def _recv(sock):
+    (size,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    return json.loads(_recv_exact(sock, size))
+
+
+class InferenceClient:
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _state(self):
+        # Connections and segments belong to one thread of one process
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.pid = os.getpid()
+            self._local.sock = None
+            self._local.segment = None
+        return self._local
+
+    def _buffer(self, state, nbytes):
+        if state.segment is None or state.segment.shm.size < nbytes:
+            if state.segment is not None:
+                state.segment.release()
+            state.segment = _Segment(max(nbytes, MIN_BUFFER_BYTES))
+        return state.segment.shm
+
+    def _close(self, state):
+        if state.sock is not None:
+            state.sock.close()
+            state.sock = None
+
+    def predict(self, model, batch):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        state = self._state()
+        shm = self._buffer(state, batch.nbytes)
+        np.ndarray(batch.shape, dtype=np.float32, buffer=shm.buf)[...] = batch
+        request = {'model': model, 'shm': shm.name, 'shape': list(batch.shape), 'dtype': 'float32'}
+
+        # A kept-open connection may belong to a sidecar that has since
+        # restarted; reconnect once before giving up
+        for attempt in range(2):
+            try:
+                if state.sock is None:
+                    state.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    state.sock.settimeout(self.timeout)
+                    state.sock.connect(self.path)
+                _send(state.sock, request)
+                response = _recv(state.sock)
+                break
+            except (OSError, ConnectionError) as e:
+                self._close(state)
+                if attempt or isinstance(e, socket.timeout):
+                    raise SidecarError(f"inference sidecar unavailable: {e}")
+
+        if 'error' in response:
+            raise SidecarError(response['error'])
+        return np.asarray(response['predictions'], dtype=np.float32)
+
+
+class _Job:
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class InferenceServer:
+    def __init__(self, path, run, max_batch=32, batch_wait=0.005):
+        """`run(keras_model, batch)` returns the model's outputs for a batch."""
+        self.path = path
+        self.run = run
+        self.max_batch = max_batch
+        self.batch_wait = batch_wait
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def serve_forever(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        server.listen(128)
+        print(f"Inference sidecar listening on {self.path}")
+        try:
+            while True:
+                conn, _ = server.accept()
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        finally:
+            server.close()
+            os.unlink(self.path)
+
+    def _attach(self, name):
+        shm = SharedMemory(name=name)
+        # The client owns the segment; without this the sidecar's resource
+        # tracker would unlink it when the sidecar exits
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+    def _handle(self, conn):
+        attached = {}
+        try:
+            while True:
+                try:
+                    request = _recv(conn)
+                except (OSError, ConnectionError):
+                    return
+                inputs = None
+                try:
+                    shm = attached.get(request['shm'])
+                    if shm is None:
+                        # A client only replaces its segment when it needs a bigger one
+                        for old in attached.values():
+                            old.close()
+                        attached = {request['shm']: self._attach(request['shm'])}
+                        shm = attached[request['shm']]
+                    shape = tuple(request['shape'])
+                    if request.get('dtype') != 'float32' or int(np.prod(shape)) * 4 > shm.size:
+                        raise ValueError("batch doesn't match its shared memory segment")
+                    inputs = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+                    response = {'predictions': self._submit(request['model'], inputs).tolist()}
+                except Exception as e:
+                    response = {'error': str(e)}
+                finally:
+                    # Views into the segment must be gone before it can be closed
+                    inputs = None
+                _send(conn, response)
+        finally:
+            conn.close()
+            for shm in attached.values():
+                shm.close()
+
+    def _submit(self, model, inputs):
+        if model not in model_manager:
+            raise ValueError(f"unknown model {model}")
+        with self._lock:
+            jobs = self._queues.get(model)
+            if jobs is None:
+                jobs = self._queues[model] = queue.Queue()
+                threading.Thread(target=self._batch_loop, args=(model, jobs), daemon=True).start()
+        job = _Job(inputs)
+        jobs.put(job)
+        job.done.wait()
+        if job.error is not None:
+            raise SidecarError(job.error)
+        return job.result
+
+    def _batch_loop(self, model, jobs):
+        while True:
+            batch = [jobs.get()]
+            size = len(batch[0].inputs)
+            deadline = time.monotonic() + self.batch_wait
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    job = jobs.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(job)
+                size += len(job.inputs)
+            self._run(model, batch)
+
+    def _run(self, model, batch):
+        keras_model = model_manager.get(model)
+        # Only images of the same size can share a forward pass
+        groups = {}
+        for job in batch:
+            groups.setdefault(job.inputs.shape[1:], []).append(job)
+        for jobs in groups.values():
+            try:
+                if keras_model is None:
+                    raise SidecarError(f"{model} model failed to load")
+                inputs = np.concatenate([job.inputs for job in jobs])
+                outputs = self.run(keras_model, inputs)
+                start = 0
+                for job in jobs:
+                    job.result = outputs[start:start + len(job.inputs)]
+                    start += len(job.inputs)
+            except Exception as e:
+                for job in jobs:
+                    job.error = str(e)
+            finally:
+                for job in jobs:
+                    # Drop the view into the client's segment before replying
+                    job.inputs = None
+                    job.done.set()
+
+
+sidecar_client = InferenceClient(settings.ML_SIDECAR_SOCKET, timeout=settings.ML_SIDECAR_TIMEOUT)
@@ -0,0 +1,65 @@
+import base64
+import io
+import numpy as np
+from PIL import Image, ImageDraw
+
+# Generated inputs for benchmarks, shaped like real requests so no patient
+# data is needed. Values stay inside the ranges predict_diabetes accepts.
+
+GENDERS = ['male', 'female']
+SMOKING_HISTORY = ['never', 'no info', 'current', 'former', 'ever', 'not current']
+YES_NO = ['yes', 'no']
+
+
+def synthetic_tabular_rows(count, seed=0):
+    """Request payloads accepted by both predict_diabetes and predict_hypertension."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for _ in range(count):
+        rows.append({
+            'gender': str(rng.choice(GENDERS)),
+            'age': round(float(rng.uniform(18, 90)), 1),
+            'hypertension': str(rng.choice(YES_NO)),
+            'heart_disease': str(rng.choice(YES_NO)),
+            'diabetes': str(rng.choice(YES_NO)),
+            'smoking_history': str(rng.choice(SMOKING_HISTORY)),
+            'bmi': round(float(rng.uniform(16, 45)), 1),
+            'HbA1c_level': round(float(rng.uniform(4, 9)), 1),
+            'blood_glucose_level': float(rng.integers(80, 300)),
+        })
+    return rows
+
+
+def synthetic_image(size=224, seed=0, fundus=False):
+    """
+    A smooth random RGB image. With `fundus` it is a reddish disc on black
+    crossed by thin dark vessels, roughly what a retinal photo looks like, so
+    image checks see a plausible input.
+    """
+    rng = np.random.default_rng(seed)
+    # Low-resolution noise scaled up, so it compresses like a photo
+    coarse = rng.integers(0, 256, size=(size // 16, size // 16, 3), dtype=np.uint8)
+    image = Image.fromarray(coarse).resize((size, size), Image.BILINEAR)
+    if fundus:
+        pixels = np.asarray(image, dtype=np.float32)
+        pixels = pixels * np.array([0.9, 0.45, 0.2]) + np.array([60, 20, 5])
+        yy, xx = np.mgrid[:size, :size]
+        centre = (size - 1) / 2
+        outside = (yy - centre) ** 2 + (xx - centre) ** 2 > (size * 0.47) ** 2
+        pixels[outside] = 0
+        image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+        # Vessels branching out from the optic disc
+        draw = ImageDraw.Draw(image)
+        disc = (centre + size * 0.15 * rng.uniform(-1, 1), centre + size * 0.1 * rng.uniform(-1, 1))
+        for angle in rng.uniform(0, 2 * np.pi, size=12):
+            length = size * rng.uniform(0.25, 0.45)
+            end = (disc[0] + length * np.cos(angle), disc[1] + length * np.sin(angle))
+            draw.line([disc, end], fill=(90, 25, 10), width=max(1, size // 150))
+        image.paste((0, 0, 0), mask=Image.fromarray((outside * 255).astype(np.uint8)))
+    return image
+
+
+def encode_image_base64(image, format='JPEG', quality=90):
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, quality=quality)
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
@@ -1,3 +1,765 @@
-from django.test import TestCase
+import base64
+import io
+import json
+import os
+import pickle
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+import lightgbm
+import numpy as np
+import pandas as pd
+import xgboost
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import ExifTags, Image, ImageFilter, ImageOps
+from sklearn.decomposition import PCA
+from sklearn.linear_model import LogisticRegression
+from sklearn.preprocessing import StandardScaler
+from . import jobs, uploads
+from .augmentation import dihedral_views
+from .image_analysis import SEVERITY_CLASSES, grade_retinopathy, load_image, open_image
+from .image_quality import assess_fundus
+from .model_manager import ModelManager, model_manager
+from .model_store import LEGACY_VERSION, ModelStore, ModelStoreError
+from .sidecar import InferenceClient, InferenceServer, SidecarError, _recv, _send
+from .models import AnalysisJob
+from .synthetic import encode_image_base64, synthetic_image
+from .tree_arrays import UnsupportedModel, _margins, compile_trees, load_or_compile
+from .uploads import UploadTooLarge, read_image_upload
 
-# Create your tests here.
+
+class _StoreDirMixin:
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        os.makedirs(os.path.join(self.root, 'diabetes'))
+        self.routing_path = os.path.join(self.root, 'diabetes', 'routing.json')
+        self.mtime = 1_000_000_000
+
+    def _write_routing(self, text):
+        with open(self.routing_path, 'w') as f:
+            f.write(text if isinstance(text, str) else json.dumps(text))
+        # Distinct mtimes, however quickly the test rewrites the file
+        self.mtime += 1
+        os.utime(self.routing_path, (self.mtime, self.mtime))
+
+    def _read_routing(self):
+        with open(self.routing_path) as f:
+            return json.load(f)
+
+
+class RoutingTests(_StoreDirMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = ModelStore(self.root, poll_seconds=0)
+
+    def test_defaults_without_a_routing_file(self):
+        routing = self.store.routing('diabetes')
+        self.assertEqual(routing['active'], LEGACY_VERSION)
+        self.assertIsNone(routing['candidate'])
+
+    def test_routing_file_is_reread_when_it_changes(self):
+        self._write_routing({'active': 'v1'})
+        self.assertEqual(self.store.routing('diabetes')['active'], 'v1')
+        self._write_routing({'active': 'v1', 'candidate': 'v2', 'candidate_percent': 10, 'shadow': True})
+        routing = self.store.routing('diabetes')
+        self.assertEqual((routing['candidate'], routing['candidate_percent'], routing['shadow']), ('v2', 10, True))
+
+    def test_bad_routing_keeps_the_last_good_one(self):
+        self._write_routing({'active': 'v1'})
+        self.store.routing('diabetes')
+        for bad in ('{"active": ', '["v2"]', '"v2"', {'active': 3}, {'active': 'v2', 'candidate_percent': 'ten'},
+                    {'active': 'v2', 'candidate_percent': 150}, {'active': 'v2', 'shadow': 'yes'}):
+            self._write_routing(bad)
+            self.assertEqual(self.store.routing('diabetes')['active'], 'v1', bad)
+
+        self._write_routing({'active': 'v2'})
+        self.assertEqual(self.store.routing('diabetes')['active'], 'v2')
+
+    def test_bad_routing_without_a_last_good_one_serves_legacy(self):
+        self._write_routing('[1, 2]')
+        self.assertEqual(self.store.routing('diabetes')['active'], LEGACY_VERSION)
+
+
+class PublishModelTests(_StoreDirMixin, SimpleTestCase):
+    def _publish(self, *args):
+        with override_settings(ML_MODEL_STORE=self.root):
+            call_command('publish_model', 'diabetes', *args, stdout=io.StringIO())
+
+    def _artifacts(self):
+        paths = {}
+        for role in ('scaler', 'pca', 'model'):
+            paths[role] = os.path.join(self.root, f'{role}.pkl')
+            with open(paths[role], 'wb') as f:
+                f.write(b'not used')
+        return [f'--{role}={path}' for role, path in paths.items()]
+
+    def test_publish_and_route(self):
+        self._publish('v2', *self._artifacts(), '--candidate', '--percent', '25', '--shadow')
+        manifest = os.path.join(self.root, 'diabetes', 'v2', 'manifest.json')
+        self.assertTrue(os.path.isfile(manifest))
+        self.assertEqual(
+            self._read_routing(),
+            {'active': LEGACY_VERSION, 'candidate': 'v2', 'candidate_percent': 25.0, 'shadow': True},
+        )
+
+        self._publish('v2', '--activate')
+        self.assertEqual(self._read_routing()['active'], 'v2')
+        self.assertIsNone(self._read_routing()['candidate'])
+
+    def test_unpublished_version(self):
+        with self.assertRaisesMessage(CommandError, 'has not been published'):
+            self._publish('v9', '--activate')
+
+    def test_artifacts_sharing_a_basename_are_kept_apart(self):
+        args = []
+        for role in ('scaler', 'pca', 'model'):
+            os.makedirs(os.path.join(self.root, role))
+            path = os.path.join(self.root, role, 'artifact.pkl')
+            with open(path, 'w') as f:
+                f.write(role)
+            args.append(f'--{role}={path}')
+        self._publish('v2', *args)
+
+        version_dir = os.path.join(self.root, 'diabetes', 'v2')
+        with open(os.path.join(version_dir, 'manifest.json')) as f:
+            files = json.load(f)['files']
+        self.assertEqual(files, {'scaler': 'scaler.pkl', 'pca': 'pca.pkl', 'model': 'model.pkl'})
+        for role, filename in files.items():
+            with open(os.path.join(version_dir, filename)) as f:
+                self.assertEqual(f.read(), role)
+
+    def test_bad_routing_file_is_reported_not_overwritten(self):
+        for bad in ('{"active": ', '["v2"]', '{"candidate_percent": -1}'):
+            self._write_routing(bad)
+            with self.assertRaisesMessage(CommandError, 'fix or remove it first'):
+                self._publish(LEGACY_VERSION, '--activate')
+            with open(self.routing_path) as f:
+                self.assertEqual(f.read(), bad)
+
+
+class TreeArrayParityTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        rng = np.random.default_rng(0)
+        cls.X = rng.normal(size=(600, 6))
+        cls.y = ((cls.X[:, 0] + cls.X[:, 1] * cls.X[:, 2] + rng.normal(scale=0.3, size=600)) > 0).astype(int)
+        # Some missing values, so the default directions are exercised too
+        cls.X[rng.random(cls.X.shape) < 0.05] = np.nan
+        cls.X_test = rng.normal(size=(400, 6))
+        cls.X_test[rng.random(cls.X_test.shape) < 0.05] = np.nan
+
+    def _check_parity(self, model):
+        model.fit(self.X, self.y)
+        ensemble = compile_trees(model)
+        np.testing.assert_allclose(
+            ensemble.decision_function(self.X_test), _margins(model, self.X_test), rtol=1e-5, atol=1e-4,
+        )
+        np.testing.assert_array_equal(ensemble.predict(self.X_test), model.predict(self.X_test))
+
+        # Through the on-disk cache, memory-mapped as the workers load it
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        model_path = os.path.join(root, 'model.pkl')
+        with open(model_path, 'wb') as f:
+            pickle.dump(model, f)
+        cache_dir = os.path.join(root, 'compiled')
+        load_or_compile(model_path, cache_dir, lambda: model)
+        loaded = load_or_compile(model_path, cache_dir, lambda: self.fail("compiled twice"))
+        self.assertIsInstance(loaded.threshold, np.memmap)
+        np.testing.assert_array_equal(loaded.predict(self.X_test), model.predict(self.X_test))
+
+    def test_xgboost(self):
+        self._check_parity(xgboost.XGBClassifier(n_estimators=30, max_depth=4, random_state=0))
+
+    def test_lightgbm(self):
+        self._check_parity(
+            lightgbm.LGBMClassifier(n_estimators=30, num_leaves=15, random_state=0, verbose=-1)
+        )
+
+    def test_multiclass_is_not_converted(self):
+        model = xgboost.XGBClassifier(n_estimators=5, max_depth=2)
+        model.fit(self.X, np.arange(len(self.X)) % 3)
+        with self.assertRaises(UnsupportedModel):
+            compile_trees(model)
+
+    def test_other_models_are_not_converted(self):
+        with self.assertRaises(UnsupportedModel):
+            compile_trees(object())
+
+
+class ModelManagerTests(SimpleTestCase):
+    def _watchers(self):
+        return [thread for thread in threading.enumerate() if thread.name == 'ml-model-watcher']
+
+    def test_no_watcher_in_a_process_that_skips_it(self):
+        manager = ModelManager(poll_seconds=60)
+        manager.skip_watcher_in_this_process()
+        before = len(self._watchers())
+        manager.register('test:skip', [], lambda: 'model')
+        self.assertEqual(manager.get('test:skip'), 'model')
+        self.assertEqual(len(self._watchers()), before)
+
+    def test_unregister_leaves_collection_to_the_watcher(self):
+        manager = ModelManager(poll_seconds=0)
+        manager.register('test:gone', [], lambda: 'model')
+        with mock.patch('gc.collect') as collect:
+            manager.unregister('test:gone')
+        collect.assert_not_called()
+        self.assertNotIn('test:gone', manager)
+        self.assertTrue(manager._collect_pending)
+
+
+class _Body(io.BytesIO):
+    """The bits of a request read_image_upload uses."""
+
+    def __init__(self, body, content_length=True):
+        super().__init__(body)
+        self.META = {'CONTENT_LENGTH': str(len(body))} if content_length else {}
+
+
+class ImageUploadTests(SimpleTestCase):
+    IMAGE = bytes(range(256)) * 40
+
+    def _read(self, body, max_bytes=1024 * 1024, **kwargs):
+        if isinstance(body, dict):
+            body = json.dumps(body)
+        if isinstance(body, str):
+            body = body.encode()
+        return read_image_upload(_Body(body, **kwargs), max_bytes)
+
+    def test_round_trip_at_any_chunk_size(self):
+        encoded = base64.b64encode(self.IMAGE).decode()
+        body = {'tta': True, 'image': encoded, 'meta': {'nested': [1, 'two', None]}, 'user_id': 7}
+        for chunk_size in (1, 3, 7, 100, 64 * 1024):
+            with mock.patch.object(uploads, 'CHUNK_SIZE', chunk_size):
+                image, data = self._read(body)
+            self.assertEqual(image.read(), self.IMAGE, chunk_size)
+            self.assertEqual(data, {'tta': True, 'meta': {'nested': [1, 'two', None]}, 'user_id': 7})
+
+    def test_data_url_escaped_slashes_and_line_breaks(self):
+        encoded = base64.encodebytes(self.IMAGE).decode()  # MIME style, a newline every 76 characters
+        value = 'data:image/jpeg;base64,' + encoded
+        body = json.dumps({'image': value}).replace('/', '\\/')
+        for chunk_size in (1, 5, 64 * 1024):
+            with mock.patch.object(uploads, 'CHUNK_SIZE', chunk_size):
+                image, data = self._read(body)
+            self.assertEqual(image.read(), self.IMAGE, chunk_size)
+            self.assertEqual(data, {})
+
+    def test_missing_empty_or_non_string_image(self):
+        self.assertEqual(self._read('{}'), (None, {}))
+        self.assertEqual(self._read({'tta': 1})[0], None)
+        self.assertEqual(self._read({'image': ''})[0], None)
+        image, data = self._read({'image': 5})
+        self.assertIsNone(image)
+        self.assertEqual(data, {'image': 5})
+
+    def test_malformed_bodies(self):
+        for body in ('', '[]', '{"image": "abc"', '{"image" "abc"}', '{"a": 1 "b": 2}', '{"image": "abc"}',
+                     '{"image": "\\q"}', '{"a": [1, 2}'):
+            with self.assertRaises(ValueError, msg=body):
+                self._read(body)
+
+    def test_size_limits(self):
+        body = json.dumps({'image': base64.b64encode(self.IMAGE).decode()})
+        # Refused up front from Content-Length, or while streaming without one
+        with self.assertRaises(UploadTooLarge):
+            self._read(body, max_bytes=1000)
+        with self.assertRaises(UploadTooLarge):
+            self._read(body, max_bytes=1000, content_length=False)
+        with mock.patch.object(uploads, 'MAX_OTHER_FIELDS_BYTES', 100):
+            with self.assertRaises(UploadTooLarge):
+                self._read({'image': '', 'notes': 'x' * 200})
+
+    @override_settings(ML_FOOD_MAX_UPLOAD_BYTES=1000)
+    def test_endpoint_answers_413(self):
+        body = json.dumps({'image': base64.b64encode(self.IMAGE).decode()})
+        with mock.patch('mlmodels.views.image_model_available', return_value=True):
+            response = self.client.post(reverse('detect_food'), body, content_type='application/json')
+        self.assertEqual(response.status_code, 413)
+
+
+def _quadrants(width, height):
+    """An RGB image with a different solid colour in each quadrant."""
+    image = Image.new('RGB', (width, height))
+    colours = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0)]
+    for index, colour in enumerate(colours):
+        x, y = index % 2 * width // 2, index // 2 * height // 2
+        image.paste(colour, (x, y, x + width // 2, y + height // 2))
+    return image
+
+
+def _jpeg(image, orientation=1):
+    exif = Image.Exif()
+    exif[ExifTags.Base.Orientation] = orientation
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=95, exif=exif)
+    buffer.seek(0)
+    return buffer
+
+
+def _quadrant_colours(image):
+    pixels = np.asarray(image, dtype=float)
+    h, w = pixels.shape[0] // 2, pixels.shape[1] // 2
+    # Centre of each quadrant, clear of the blurred borders
+    return [pixels[y * h + h // 4:y * h + 3 * h // 4, x * w + w // 4:x * w + 3 * w // 4].mean(axis=(0, 1))
+            for y in (0, 1) for x in (0, 1)]
+
+
+class LoadImageTests(SimpleTestCase):
+    def _assert_same_picture(self, got, expected):
+        self.assertEqual(got.size, expected.size)
+        for got_colour, expected_colour in zip(_quadrant_colours(got), _quadrant_colours(expected)):
+            np.testing.assert_allclose(got_colour, expected_colour, atol=12)
+
+    def test_every_exif_orientation_is_turned_upright(self):
+        stored = _quadrants(320, 160)
+        for orientation in range(1, 9):
+            expected = ImageOps.exif_transpose(Image.open(_jpeg(stored, orientation))).resize((64, 48))
+            got = load_image(Image.open(_jpeg(stored, orientation)), (64, 48))
+            self._assert_same_picture(got, expected)
+
+    @override_settings(ML_IMAGE_DECODE_SIZE=64)
+    def test_large_photo_is_decoded_small(self):
+        stored = _quadrants(2400, 1600)
+        image = Image.open(_jpeg(stored, orientation=6))
+        with mock.patch.object(Image.Image, 'reduce', autospec=True, side_effect=Image.Image.reduce) as reduce:
+            got = load_image(image, (32, 32))
+        # draft() decoded at 1/8 scale, then reduce() shrank it by a whole factor
+        self.assertEqual(image.size, (300, 200))
+        self.assertEqual(reduce.call_args.args[1], 3)
+        expected = ImageOps.exif_transpose(Image.open(_jpeg(stored, orientation=6))).resize((32, 32))
+        self._assert_same_picture(got, expected)
+
+    def test_non_jpeg_and_missing_exif(self):
+        buffer = io.BytesIO()
+        _quadrants(100, 80).convert('L').save(buffer, 'PNG')
+        got = load_image(Image.open(buffer), (20, 16))
+        self.assertEqual((got.mode, got.size), ('RGB', (20, 16)))
+
+    @override_settings(ML_IMAGE_MAX_PIXELS=1000)
+    def test_too_many_pixels(self):
+        with self.assertRaises(UploadTooLarge):
+            open_image(_jpeg(_quadrants(100, 100)))
+
+
+def _pixels(image):
+    return np.asarray(image, dtype=np.float32) / 255.0
+
+
+class FundusQualityTests(SimpleTestCase):
+    def setUp(self):
+        self.fundus = synthetic_image(seed=1, fundus=True)
+
+    def test_good_fundus(self):
+        quality = assess_fundus(_pixels(self.fundus))
+        self.assertEqual((quality['ok'], quality['issues']), (True, []))
+        self.assertEqual(quality['metrics']['corner_field_fraction'], 0)
+
+    def test_blurry(self):
+        quality = assess_fundus(_pixels(self.fundus.filter(ImageFilter.GaussianBlur(4))))
+        self.assertEqual((quality['ok'], quality['issues']), (False, ['blurry']))
+
+    def test_dark(self):
+        quality = assess_fundus(_pixels(self.fundus) * 0.25)
+        self.assertEqual(quality['issues'], ['too_dark'])
+
+    def test_overexposed(self):
+        quality = assess_fundus(np.clip(_pixels(self.fundus) * 3, 0, 1))
+        self.assertEqual(quality['issues'], ['overexposed'])
+
+    def test_non_fundus(self):
+        # A photo filling the frame, and a grey disc that isn't a retina
+        self.assertEqual(assess_fundus(_pixels(synthetic_image(seed=1)))['issues'], ['not_fundus'])
+        grey = _pixels(self.fundus.convert('L').convert('RGB'))
+        self.assertEqual(assess_fundus(grey)['issues'], ['not_fundus'])
+
+
+@mock.patch('mlmodels.views.image_model_available', return_value=True)
+class RetinopathyQualityGateTests(SimpleTestCase):
+    PREDICTION = np.array([[0.1, 0.6, 0.2, 0.05, 0.05]], dtype=np.float32)
+
+    def _grade(self, image):
+        body = json.dumps({'image': encode_image_base64(image)})
+        with mock.patch('mlmodels.image_analysis.predict_images', return_value=self.PREDICTION) as predict:
+            response = self.client.post(reverse('dr_severity'), body, content_type='application/json')
+        return response, predict
+
+    @override_settings(ML_DR_QUALITY_GATE='reject')
+    def test_reject_answers_422_without_running_the_model(self, _):
+        response, predict = self._grade(synthetic_image(seed=1))
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json()['quality']['issues'], ['not_fundus'])
+        predict.assert_not_called()
+
+    @override_settings(ML_DR_QUALITY_GATE='flag')
+    def test_flag_grades_and_reports_the_issues(self, _):
+        response, predict = self._grade(synthetic_image(seed=1))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['severity'], SEVERITY_CLASSES[1])
+        self.assertEqual((data['quality']['ok'], data['quality']['issues']), (False, ['not_fundus']))
+        predict.assert_called_once()
+
+    @override_settings(ML_DR_QUALITY_GATE='reject')
+    def test_good_fundus_passes_the_gate(self, _):
+        response, _ = self._grade(synthetic_image(seed=1, fundus=True))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['quality']['ok'])
+
+
+class _HeldExecutor:
+    """Stands in for the job thread pool: holds jobs until the test runs them."""
+
+    def __init__(self):
+        self.held = []
+
+    def submit(self, fn, *args):
+        self.held.append((fn, args))
+
+    def run_all(self):
+        while self.held:
+            fn, args = self.held.pop(0)
+            fn(*args)
+
+
+@override_settings(ML_JOB_WORKERS=1, ML_JOB_QUEUE_DEPTH=1, ML_JOB_TIMEOUT_SECONDS=60)
+@mock.patch('mlmodels.views.image_model_available', return_value=True)
+class AnalysisJobTests(TestCase):
+    def setUp(self):
+        self.analyse = mock.Mock(return_value={'food': 'pizza'})
+        patches = [
+            mock.patch.dict(jobs.ANALYSES, {'food': self.analyse, 'dr': self.analyse}),
+            mock.patch.object(jobs, '_pools', {}),
+            # _run_job closes its thread's connection; here it runs on the test's
+            mock.patch.object(jobs, 'connection'),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.executor = _HeldExecutor()
+        jobs._pool().executor = self.executor
+        self.body = json.dumps({'image': encode_image_base64(synthetic_image(size=64))})
+
+    def _submit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                reverse('submit_analysis_job', args=['food']), self.body, content_type='application/json',
+            )
+
+    def _status(self, job_id, **params):
+        return self.client.get(reverse('analysis_job_status', args=[job_id]), params).json()
+
+    def test_submit_then_poll(self, _):
+        response = self._submit()
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()['job_id']
+        self.assertEqual(self._status(job_id)['status'], 'pending')
+
+        self.executor.run_all()
+        data = self._status(job_id)
+        self.assertEqual((data['status'], data['result']), ('done', {'food': 'pizza'}))
+        self.analyse.assert_called_once()
+
+    def test_full_queue_answers_429(self, _):
+        # One worker plus one queued
+        self.assertEqual(self._submit().status_code, 202)
+        self.assertEqual(self._submit().status_code, 202)
+        response = self._submit()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '5')
+
+        # A finished job frees its slot
+        self.executor.run_all()
+        self.assertEqual(self._submit().status_code, 202)
+
+    def test_long_poll_returns_once_the_job_finishes(self, _):
+        job_id = self._submit().json()['job_id']
+        finished = jobs._pool().finished[AnalysisJob.objects.get().pk]
+        with mock.patch.object(finished, 'wait', side_effect=lambda timeout: self.executor.run_all()) as wait:
+            data = self._status(job_id, wait=10)
+        self.assertEqual(data['status'], 'done')
+        wait.assert_called_once()
+        self.assertLessEqual(wait.call_args.args[0], 10)
+
+    def test_long_poll_gives_up_at_the_deadline(self, _):
+        job_id = self._submit().json()['job_id']
+        finished = jobs._pool().finished[AnalysisJob.objects.get().pk]
+        with override_settings(ML_JOB_MAX_WAIT_SECONDS=0), mock.patch.object(finished, 'wait') as wait:
+            self.assertEqual(self._status(job_id, wait=10)['status'], 'pending')
+        wait.assert_not_called()
+
+    def test_only_a_long_running_job_times_out(self, _):
+        long_ago = timezone.now() - timedelta(minutes=5)
+        queued = AnalysisJob.objects.create(kind='food')
+        running = AnalysisJob.objects.create(kind='food', status='running', started_at=timezone.now())
+        stuck = AnalysisJob.objects.create(kind='food', status='running', started_at=long_ago)
+        AnalysisJob.objects.update(created_at=long_ago)
+
+        self.assertEqual(jobs.get_job(queued.pk).status, 'pending')
+        self.assertEqual(jobs.get_job(running.pk).status, 'running')
+        stuck = jobs.get_job(stuck.pk)
+        self.assertEqual(stuck.status, 'failed')
+        self.assertIn('lost', stuck.error)
+
+    def test_job_reported_lost_keeps_that_answer(self, _):
+        job_id = self._submit().json()['job_id']
+
+        def overrun(image):
+            AnalysisJob.objects.filter(pk=job_id).update(status='failed', error='lost')
+            return {'food': 'pizza'}
+
+        self.analyse.side_effect = overrun
+        self.executor.run_all()
+        data = self._status(job_id)
+        self.assertEqual((data['status'], data['error'], data['result']), ('failed', 'lost', None))
+
+    @override_settings(ML_JOB_RETENTION_SECONDS=3600)
+    def test_old_jobs_are_purged_on_submit(self, _):
+        old = AnalysisJob.objects.create(kind='food', status='done')
+        recent = AnalysisJob.objects.create(kind='food', status='done')
+        AnalysisJob.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(hours=2))
+
+        self._submit()
+        self.assertFalse(AnalysisJob.objects.filter(pk=old.pk).exists())
+        self.assertTrue(AnalysisJob.objects.filter(pk=recent.pk).exists())
+
+        # Not again within the minute
+        AnalysisJob.objects.filter(pk=recent.pk).update(created_at=timezone.now() - timedelta(hours=2))
+        self.executor.run_all()
+        self._submit()
+        self.assertTrue(AnalysisJob.objects.filter(pk=recent.pk).exists())
+
+
+class ModelStoreLoadingTests(SimpleTestCase):
+    NAME = 'storetest'
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.addCleanup(self._unregister)
+        rng = np.random.default_rng(0)
+        features = pd.DataFrame(rng.normal(size=(40, 3)), columns=['a', 'b', 'c'])
+        labels = (features['a'] > 0).astype(int)
+        scaler = StandardScaler().fit(features)
+        pca = PCA(n_components=2).fit(scaler.transform(features))
+        self.artifacts = {
+            'scaler': scaler, 'pca': pca,
+            'model': LogisticRegression().fit(pca.transform(scaler.transform(features)), labels),
+        }
+        self.store = ModelStore(self.root, poll_seconds=0)
+        self.mtime = 1_000_000_000
+
+    def _unregister(self):
+        for key in model_manager.keys(f'{self.NAME}:'):
+            model_manager.unregister(key)
+
+    def _version(self, version, manifest=None):
+        directory = os.path.join(self.root, self.NAME, version)
+        os.makedirs(directory)
+        for role, artifact in self.artifacts.items():
+            with open(os.path.join(directory, f'{role}.pkl'), 'wb') as f:
+                pickle.dump(artifact, f)
+        if manifest is None:
+            manifest = {'files': {role: f'{role}.pkl' for role in self.artifacts}}
+        with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f)
+
+    def _route(self, **routing):
+        path = os.path.join(self.root, self.NAME, 'routing.json')
+        with open(path, 'w') as f:
+            json.dump(routing, f)
+        self.mtime += 1
+        os.utime(path, (self.mtime, self.mtime))
+
+    def test_bad_manifests(self):
+        for version, manifest in (('v1', {}), ('v2', {'files': ['scaler.pkl']}),
+                                  ('v3', {'files': {'scaler': 'scaler.pkl', 'pca': 'pca.pkl'}}),
+                                  ('v4', {'files': {'scaler': '../scaler.pkl', 'pca': 'pca.pkl', 'model': 'm'}}),
+                                  ('v5', [])):
+            self._version(version, manifest)
+            with self.assertRaises(ModelStoreError, msg=version):
+                self.store.load(self.NAME, version)
+
+    def test_new_version_loads_in_the_background(self):
+        self._version('v1')
+        self._version('v2')
+        self._route(active='v1')
+        self.assertEqual(self.store.choose(self.NAME)[0].version, 'v1')
+
+        loader = self.store._loader = _HeldExecutor()
+        self._route(active='v2')
+        # Still served by v1 while v2 loads
+        self.assertEqual(self.store.choose(self.NAME)[0].version, 'v1')
+        self.assertNotIn(f'{self.NAME}:v2', model_manager)
+
+        loader.run_all()
+        self.assertEqual(self.store.choose(self.NAME)[0].version, 'v2')
+        self.assertNotIn(f'{self.NAME}:v1', model_manager)
+
+    def test_candidate_joins_once_loaded(self):
+        self._version('v1')
+        self._version('v2')
+        self._route(active='v1')
+        self.store.choose(self.NAME)
+
+        loader = self.store._loader = _HeldExecutor()
+        self._route(active='v1', candidate='v2', candidate_percent=100)
+        self.assertEqual(self.store.choose(self.NAME)[0].version, 'v1')
+        loader.run_all()
+        self.assertEqual(self.store.choose(self.NAME)[0].version, 'v2')
+
+
+class _FakeCNN:
+    """Per-image channel means, recording the size of every batch it runs."""
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def __call__(self, batch):
+        self.batch_sizes.append(len(batch))
+        return batch.mean(axis=(1, 2))
+
+
+class _Sidecar(InferenceServer):
+    """An InferenceServer on a background thread that can drop its connections."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connections = []
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        deadline = time.monotonic() + 5
+        while not os.path.exists(self.path):
+            if time.monotonic() > deadline:
+                raise AssertionError("sidecar didn't start")
+            time.sleep(0.01)
+
+    def _handle(self, conn):
+        self.connections.append(conn)
+        super()._handle(conn)
+
+    def drop_connections(self):
+        for conn in self.connections:
+            conn.shutdown(socket.SHUT_RDWR)
+
+
+class InferenceSidecarTests(SimpleTestCase):
+    MODEL = 'sidecartest'
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'sidecar.sock')
+        # Client and sidecar share this process, and so its resource tracker:
+        # the sidecar mustn't unregister the segments the client will unlink
+        for patch in (mock.patch('mlmodels.sidecar.resource_tracker'),
+                      mock.patch('mlmodels.sidecar.print', create=True)):
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.cnn = _FakeCNN()
+        model_manager.register(self.MODEL, [], lambda: self.cnn)
+        self.addCleanup(model_manager.unregister, self.MODEL)
+        self.server = self._start_server()
+        self.client = InferenceClient(self.path, timeout=5)
+
+    def _start_server(self):
+        server = _Sidecar(self.path, lambda model, batch: model(batch), batch_wait=0.2)
+        server.start()
+        return server
+
+    def _images(self, count, seed):
+        return np.random.default_rng(seed).random((count, 8, 8, 3), dtype=np.float32)
+
+    def test_predictions_come_back_for_each_request(self):
+        images = self._images(3, seed=0)
+        np.testing.assert_allclose(self.client.predict(self.MODEL, images), images.mean(axis=(1, 2)), rtol=1e-6)
+
+    def test_concurrent_requests_share_a_batch(self):
+        batches = [self._images(count, seed) for seed, count in enumerate((1, 2, 3, 1))]
+        results = [None] * len(batches)
+
+        def predict(index):
+            # Each thread has its own connection and shared memory segment
+            results[index] = self.client.predict(self.MODEL, batches[index])
+
+        threads = [threading.Thread(target=predict, args=(i,)) for i in range(len(batches))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.cnn.batch_sizes, [7])
+        for batch, result in zip(batches, results):
+            np.testing.assert_allclose(result, batch.mean(axis=(1, 2)), rtol=1e-6)
+
+    def test_unknown_model(self):
+        with self.assertRaisesMessage(SidecarError, 'unknown model nothere'):
+            self.client.predict('nothere', self._images(1, seed=0))
+        # The connection is still usable
+        self.assertEqual(self.client.predict(self.MODEL, self._images(1, seed=0)).shape, (1, 3))
+
+    def test_shape_that_does_not_fit_the_segment(self):
+        # Give the client a segment, then claim a batch bigger than it
+        self.client.predict(self.MODEL, self._images(1, seed=0))
+        state = self.client._state()
+        request = {'model': self.MODEL, 'shm': state.segment.shm.name, 'shape': [1000, 224, 224, 3],
+                   'dtype': 'float32'}
+        _send(state.sock, request)
+        self.assertIn("doesn't match", _recv(state.sock)['error'])
+        _send(state.sock, dict(request, shape=[1, 8, 8, 3], dtype='float64'))
+        self.assertIn("doesn't match", _recv(state.sock)['error'])
+        self.assertEqual(self.cnn.batch_sizes, [1])
+
+    def test_client_reconnects_after_a_sidecar_restart(self):
+        images = self._images(2, seed=0)
+        self.client.predict(self.MODEL, images)
+
+        # The old process goes away with its connections; a new one binds the path
+        self.server.drop_connections()
+        os.unlink(self.path)
+        restarted = self._start_server()
+        np.testing.assert_allclose(self.client.predict(self.MODEL, images), images.mean(axis=(1, 2)), rtol=1e-6)
+        self.assertEqual(len(restarted.connections), 1)
+
+
+class TestTimeAugmentationTests(SimpleTestCase):
+    def test_dihedral_views_are_the_eight_symmetries(self):
+        image = np.arange(9 * 2).reshape(3, 3, 2)
+        views = dihedral_views(image)
+        self.assertEqual(views.shape, (8, 3, 3, 2))
+
+        expected = [
+            image, np.rot90(image, 1), np.rot90(image, 2), np.rot90(image, 3),
+            image[:, ::-1], image[::-1], image.transpose(1, 0, 2), image[::-1, ::-1].transpose(1, 0, 2),
+        ]
+        as_bytes = lambda views: sorted(view.tobytes() for view in views)
+        self.assertEqual(as_bytes(views), as_bytes(expected))
+        self.assertEqual(len(set(as_bytes(views))), 8)
+        np.testing.assert_array_equal(views[0], image)
+
+    @override_settings(ML_DR_QUALITY_GATE='off')
+    def test_tta_averages_the_batch(self):
+        # Each view votes for a different class
+        per_view = np.eye(5, dtype=np.float32)[[0, 1, 1, 2, 1, 3, 4, 1]]
+        image = synthetic_image(seed=2, fundus=True)
+        with mock.patch('mlmodels.image_analysis.predict_images', return_value=per_view) as predict:
+            result = grade_retinopathy(image, use_tta=True)
+        self.assertEqual(predict.call_args.args[1].shape, (8, 224, 224, 3))
+        self.assertEqual(result['probabilities'], dict(zip(SEVERITY_CLASSES, [0.125, 0.5, 0.125, 0.125, 0.125])))
+        self.assertEqual((result['severity'], result['confidence'], result['tta']), ('Mild', 0.5, True))
+
+        with mock.patch('mlmodels.image_analysis.predict_images', return_value=per_view[[3]]) as predict:
+            result = grade_retinopathy(image, use_tta=False)
+        self.assertEqual(predict.call_args.args[1].shape, (1, 224, 224, 3))
+        self.assertEqual((result['severity'], result['tta']), ('Moderate', False))
+        self.assertEqual(result['probabilities']['Moderate'], 1.0)
@@ -0,0 +1,250 @@
+"""
+Gradient-boosted tree classifiers as flat NumPy arrays.
+
+The XGBoost and LightGBM models are converted once into a handful of node
+arrays saved as .npy files, which every worker memory-maps read-only. The
+pages are then shared through the OS page cache instead of each worker
+holding its own unpickled booster. Prediction walks all trees at once with
+NumPy indexing.
+
+A conversion is only used if it reproduces the original model's margins
+and classes on generated inputs; anything else (multiclass, categorical
+splits) keeps the original model.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+
+# kZeroThreshold; a float literal in LightGBM, hence the float32 rounding
+LIGHTGBM_ZERO_THRESHOLD = float(np.float32(1e-35))
+ARRAYS = ('feature', 'threshold', 'left', 'right', 'missing_left', 'value', 'roots')
+
+
+class UnsupportedModel(Exception):
+    pass
+
+
+class TreeEnsemble:
+    """Binary classifier over flat node arrays; leaves have feature -1."""
+
+    def __init__(self, arrays, classes, offset, strict, depth):
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self.classes_ = np.asarray(classes)
+        self.offset = offset
+        # XGBoost goes left on x < threshold and compares in float32;
+        # LightGBM goes left on x <= threshold in float64
+        self.strict = strict
+        self.depth = depth
+        self.dtype = self.threshold.dtype
+
+    def decision_function(self, X):
+        X = np.asarray(X, dtype=self.dtype)
+        if not self.strict:
+            # LightGBM reads values within kZeroThreshold of 0 as exactly 0
+            X = np.where(np.abs(X) <= LIGHTGBM_ZERO_THRESHOLD, 0, X)
+        rows = np.arange(len(X))[:, None]
+        node = np.repeat(self.roots[None, :], len(X), axis=0)
+        for _ in range(self.depth):
+            feature = self.feature[node]
+            x = X[rows, np.maximum(feature, 0)]
+            threshold = self.threshold[node]
+            go_left = x < threshold if self.strict else x <= threshold
+            go_left = np.where(np.isnan(x), self.missing_left[node], go_left)
+            node = np.where(feature >= 0, np.where(go_left, self.left[node], self.right[node]), node)
+        return self.value[node].sum(axis=1) + self.offset
+
+    def predict(self, X):
+        return self.classes_[(self.decision_function(X) > 0).astype(int)]
+
+    def save(self, directory):
+        for name in ARRAYS:
+            np.save(os.path.join(directory, f'{name}.npy'), getattr(self, name))
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump({
+                'classes': self.classes_.tolist(), 'offset': self.offset,
+                'strict': self.strict, 'depth': self.depth,
+            }, f)
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r') for name in ARRAYS}
+        return cls(arrays, meta['classes'], meta['offset'], meta['strict'], meta['depth'])
+
+
+class _Builder:
+    def __init__(self):
+        self.nodes = []
+        self.roots = []
+
+    def add(self, feature=-1, threshold=0.0, missing_left=False, value=0.0):
+        self.nodes.append([feature, threshold, -1, -1, missing_left, value])
+        return len(self.nodes) - 1
+
+    def link(self, node, left, right):
+        self.nodes[node][2] = left
+        self.nodes[node][3] = right
+
+    def arrays(self, dtype):
+        columns = list(zip(*self.nodes))
+        arrays = {
+            'feature': np.array(columns[0], dtype=np.int32),
+            'threshold': np.array(columns[1], dtype=dtype),
+            'left': np.array(columns[2], dtype=np.int32),
+            'right': np.array(columns[3], dtype=np.int32),
+            'missing_left': np.array(columns[4], dtype=bool),
+            'value': np.array(columns[5], dtype=np.float64),
+            'roots': np.array(self.roots, dtype=np.int32),
+        }
+        # Leaves point at themselves so the walk can keep indexing them
+        leaves = arrays['feature'] < 0
+        arrays['left'][leaves] = np.flatnonzero(leaves)
+        arrays['right'][leaves] = np.flatnonzero(leaves)
+        return arrays
+
+
+def _from_lightgbm(model):
+    dump = model.booster_.dump_model()
+    if dump['num_tree_per_iteration'] != 1 or dump.get('average_output'):
+        raise UnsupportedModel("only binary, boosted LightGBM models are supported")
+    builder = _Builder()
+    max_depth = 0
+
+    def visit(tree, depth):
+        nonlocal max_depth
+        max_depth = max(max_depth, depth)
+        if 'leaf_value' in tree:
+            return builder.add(value=tree['leaf_value'])
+        if tree['decision_type'] != '<=' or tree['missing_type'] == 'Zero':
+            raise UnsupportedModel(f"unsupported split {tree['decision_type']} / missing {tree['missing_type']}")
+        threshold = tree['threshold']
+        if tree['missing_type'] == 'None':
+            # LightGBM treats a missing value as 0 here
+            missing_left = 0.0 <= threshold
+        else:
+            missing_left = tree['default_left']
+        node = builder.add(tree['split_feature'], threshold, missing_left)
+        builder.link(node, visit(tree['left_child'], depth + 1), visit(tree['right_child'], depth + 1))
+        return node
+
+    for info in dump['tree_info']:
+        builder.roots.append(visit(info['tree_structure'], 0))
+    return builder.arrays(np.float64), False, max_depth
+
+
+def _from_xgboost(model):
+    booster = model.get_booster()
+    if len(model.classes_) != 2:
+        raise UnsupportedModel("only binary XGBoost models are supported")
+    names = booster.feature_names
+    builder = _Builder()
+    max_depth = 0
+
+    def visit(tree, depth):
+        nonlocal max_depth
+        max_depth = max(max_depth, depth)
+        if 'leaf' in tree:
+            return builder.add(value=tree['leaf'])
+        if 'split_condition' not in tree:
+            raise UnsupportedModel("categorical splits are not supported")
+        split = tree['split']
+        feature = names.index(split) if names else int(split[1:])
+        node = builder.add(feature, tree['split_condition'], tree['missing'] == tree['yes'])
+        children = {child['nodeid']: child for child in tree['children']}
+        builder.link(node, visit(children[tree['yes']], depth + 1), visit(children[tree['no']], depth + 1))
+        return node
+
+    for tree_json in booster.get_dump(dump_format='json'):
+        builder.roots.append(visit(json.loads(tree_json), 0))
+    return builder.arrays(np.float32), True, max_depth
+
+
+def _margins(model, X):
+    if hasattr(model, 'booster_'):
+        return model.predict(X, raw_score=True)
+    return model.predict(X, output_margin=True)
+
+
+def _validation_inputs(ensemble, n_features, rows=2000, seed=0):
+    """
+    Inputs that land on, just past and around the split thresholds, so
+    off-by-one comparisons (< vs <=, float32 rounding) show up.
+    """
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(rows, n_features))
+    for feature in range(n_features):
+        thresholds = np.asarray(ensemble.threshold)[np.asarray(ensemble.feature) == feature]
+        if len(thresholds) == 0:
+            continue
+        picked = rng.choice(thresholds, size=rows).astype(np.float64)
+        mode = rng.integers(0, 3, size=rows)
+        X[:, feature] = np.where(
+            mode == 0, picked,
+            np.where(mode == 1, np.nextafter(picked.astype(ensemble.dtype), np.inf).astype(np.float64), X[:, feature]),
+        )
+    return X.astype(ensemble.dtype)
+
+
+def compile_trees(model):
+    """A validated TreeEnsemble for an XGBoost/LightGBM classifier."""
+    if hasattr(model, 'booster_'):
+        arrays, strict, depth = _from_lightgbm(model)
+    elif hasattr(model, 'get_booster'):
+        arrays, strict, depth = _from_xgboost(model)
+    else:
+        raise UnsupportedModel(f"{type(model).__name__} is not a tree booster")
+    if len(model.classes_) != 2:
+        raise UnsupportedModel("only binary classifiers are supported")
+
+    ensemble = TreeEnsemble(arrays, model.classes_, 0.0, strict, depth)
+    X = _validation_inputs(ensemble, model.n_features_in_)
+    expected = _margins(model, X)
+    # The base score isn't part of the trees; recover it from the model
+    offsets = expected - ensemble.decision_function(X)
+    ensemble.offset = float(np.median(offsets))
+    if not np.allclose(ensemble.decision_function(X), expected, rtol=1e-5, atol=1e-4):
+        raise UnsupportedModel("converted trees don't reproduce the model's margins")
+    if not np.array_equal(ensemble.predict(X), model.predict(X)):
+        raise UnsupportedModel("converted trees don't reproduce the model's classes")
+    return ensemble
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_or_compile(model_path, cache_dir, load_model):
+    """
+    Memory-mapped trees for the model pickled at `model_path`, converted on
+    first use and cached under `cache_dir` by file checksum. `load_model()`
+    unpickles the original; raises UnsupportedModel if it can't be converted.
+    """
+    directory = os.path.join(cache_dir, file_digest(model_path)[:16])
+    if not os.path.isfile(os.path.join(directory, 'meta.json')):
+        ensemble = compile_trees(load_model())
+        os.makedirs(cache_dir, exist_ok=True)
+        # Build in a temporary directory and rename it into place, so workers
+        # converting at the same time never see a partial set of arrays
+        tmp_dir = tempfile.mkdtemp(dir=cache_dir, prefix='.tmp-')
+        try:
+            ensemble.save(tmp_dir)
+            os.rename(tmp_dir, directory)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not os.path.isfile(os.path.join(directory, 'meta.json')):
+                raise
+        # Conversions of earlier versions of the file; workers still mapping
+        # them keep their pages until they reload
+        for entry in os.listdir(cache_dir):
+            if entry != os.path.basename(directory) and not entry.startswith('.tmp-'):
+                shutil.rmtree(os.path.join(cache_dir, entry), ignore_errors=True)
+    return TreeEnsemble.load(directory)
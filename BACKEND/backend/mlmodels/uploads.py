@@ -0,0 +1,221 @@
+"""
+Streaming reader for JSON uploads that carry a base64 "image" field.
+
+json.loads(request.body) holds the whole body, the base64 string and the
+decoded image at once. read_image_upload instead reads the body in chunks
+and base64-decodes the image field as it goes, so a request only ever holds
+one chunk of the body plus the decoded image. The other fields are small
+and parsed with json as usual.
+"""
+import binascii
+import io
+import json
+
+CHUNK_SIZE = 64 * 1024
+# Everything in the body except the image; "tta" and the like are tiny
+MAX_OTHER_FIELDS_BYTES = 64 * 1024
+# How far into the image string a data URL prefix ("data:...;base64,") can end
+MAX_PREFIX_BYTES = 256
+
+_WHITESPACE = b' \t\r\n'
+_BASE64_CHARS = b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/='
+# Every byte that isn't base64, for bytes.translate(None, ...) to drop
+_NOT_BASE64 = bytes(set(range(256)) - set(_BASE64_CHARS))
+_ESCAPES = {ord('/'): b'/', ord('"'): b'"', ord('\\'): b'\\', ord('b'): b'\b',
+            ord('f'): b'\f', ord('n'): b'\n', ord('r'): b'\r', ord('t'): b'\t'}
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class _Base64Sink:
+    """Decodes base64 fed in pieces of any length into a file."""
+
+    def __init__(self):
+        self.file = io.BytesIO()
+        self.head = bytearray()
+        self.carry = b''
+        self.started = False
+
+    def feed(self, data):
+        if not self.started:
+            # Hold back the start until any data URL prefix can be stripped
+            self.head += data
+            if len(self.head) < MAX_PREFIX_BYTES:
+                return
+            data = self._strip_prefix()
+        data = self.carry + data.translate(None, _NOT_BASE64)
+        usable = len(data) - len(data) % 4
+        self.file.write(binascii.a2b_base64(data[:usable]))
+        self.carry = data[usable:]
+
+    def _strip_prefix(self):
+        self.started = True
+        head = bytes(self.head)
+        self.head = None
+        comma = head.find(b',')
+        return head[comma + 1:] if comma >= 0 else head
+
+    def finish(self):
+        if not self.started:
+            data = self._strip_prefix()
+            self.feed(data)
+        if self.carry:
+            # Same as base64.b64decode: missing padding is an error
+            self.file.write(binascii.a2b_base64(self.carry))
+        self.file.seek(0)
+        return self.file
+
+
+class _Parser:
+    def __init__(self, request, limit):
+        self.request = request
+        self.limit = limit
+        self.received = 0
+        self.buffer = b''
+        self.pos = 0
+
+    def _fill(self):
+        chunk = self.request.read(CHUNK_SIZE)
+        if not chunk:
+            raise ValueError("Unexpected end of JSON body")
+        self.received += len(chunk)
+        if self.received > self.limit:
+            raise UploadTooLarge(f"Upload is larger than {self.limit} bytes")
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def _next(self):
+        if self.pos >= len(self.buffer):
+            self._fill()
+        byte = self.buffer[self.pos]
+        self.pos += 1
+        return byte
+
+    def _next_token(self):
+        while True:
+            byte = self._next()
+            if byte not in _WHITESPACE:
+                return byte
+
+    def _expect(self, char):
+        if self._next_token() != ord(char):
+            raise ValueError(f"Invalid JSON body: expected '{char}'")
+
+    def _raw_string(self):
+        """The bytes of a JSON string, quotes included; the opening quote is already read."""
+        raw = bytearray(b'"')
+        while True:
+            byte = self._next()
+            raw.append(byte)
+            if byte == ord('\\'):
+                raw.append(self._next())
+            elif byte == ord('"'):
+                return bytes(raw)
+            if len(raw) > MAX_OTHER_FIELDS_BYTES:
+                raise UploadTooLarge("Fields other than the image are too large")
+
+    def _raw_value(self, first):
+        """The bytes of any JSON value starting with `first`, for json.loads."""
+        if first == ord('"'):
+            return self._raw_string()
+        raw = bytearray([first])
+        depth = 1 if first in b'[{' else 0
+        while True:
+            if depth == 0:
+                # A scalar ends at the next delimiter, which the caller reads
+                if self.pos >= len(self.buffer):
+                    self._fill()
+                if self.buffer[self.pos] in b',}]' or self.buffer[self.pos] in _WHITESPACE:
+                    return bytes(raw)
+            byte = self._next()
+            if byte == ord('"'):
+                raw += self._raw_string()
+            else:
+                raw.append(byte)
+                if byte in b'[{':
+                    depth += 1
+                elif byte in b']}':
+                    depth -= 1
+                    if depth == 0:
+                        return bytes(raw)
+            if len(raw) > MAX_OTHER_FIELDS_BYTES:
+                raise UploadTooLarge("Fields other than the image are too large")
+
+    def _image_string(self, sink):
+        """Stream a JSON string into `sink`; the opening quote is already read."""
+        while True:
+            if self.pos >= len(self.buffer):
+                self._fill()
+            quote = self.buffer.find(b'"', self.pos)
+            backslash = self.buffer.find(b'\\', self.pos)
+            end = min(i for i in (quote, backslash, len(self.buffer)) if i >= 0)
+            if end > self.pos:
+                sink.feed(self.buffer[self.pos:end])
+            self.pos = end
+            if end == quote:
+                self.pos += 1
+                return
+            if end == backslash:
+                self.pos += 1
+                escape = self._next()
+                if escape == ord('u'):
+                    code = bytes(self._next() for _ in range(4))
+                    sink.feed(chr(int(code, 16)).encode())
+                elif escape in _ESCAPES:
+                    sink.feed(_ESCAPES[escape])
+                else:
+                    raise ValueError("Invalid JSON body: bad escape in image")
+
+    def parse(self, image_field):
+        image = None
+        fields = []
+        self._expect('{')
+        token = self._next_token()
+        if token == ord('}'):
+            return None, {}
+        while True:
+            if token != ord('"'):
+                raise ValueError("Invalid JSON body: expected a field name")
+            key = json.loads(self._raw_string())
+            self._expect(':')
+            token = self._next_token()
+            if key == image_field and token == ord('"'):
+                sink = _Base64Sink()
+                self._image_string(sink)
+                image = sink.finish()
+            else:
+                fields.append(f'{json.dumps(key)}:{self._raw_value(token).decode()}')
+            token = self._next_token()
+            if token == ord('}'):
+                break
+            if token != ord(','):
+                raise ValueError("Invalid JSON body: expected ',' or '}'")
+            token = self._next_token()
+
+        data = json.loads('{' + ','.join(fields) + '}')
+        if image_field in data:
+            # Not a string; let the caller treat it as it would any bad value
+            image = None
+        if image is not None and not image.getbuffer().nbytes:
+            image = None
+        return image, data
+
+
+def read_image_upload(request, max_bytes, image_field='image'):
+    """
+    Read a JSON body of at most `max_bytes` without holding it in memory.
+
+    Returns (image, data): the base64-decoded image field as a file (None if
+    it's missing or empty) and the remaining fields as a dict. Raises
+    UploadTooLarge past the limit and ValueError for a malformed body or
+    invalid base64.
+    """
+    length = request.META.get('CONTENT_LENGTH')
+    if length and int(length) > max_bytes:
+        raise UploadTooLarge(f"Upload is larger than {max_bytes} bytes")
+    try:
+        return _Parser(request, max_bytes).parse(image_field)
+    except binascii.Error as e:
+        raise ValueError(f"Invalid base64 image: {e}")
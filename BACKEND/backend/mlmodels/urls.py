@@ -6,5 +6,7 @@ urlpatterns = [
     path('predict/diabetes/', views.predict_diabetes, name='predict_diabetes'),
     path('predict/hypertension/', views.predict_hypertension, name='predict_hypertension'),
     path('food/', views.detect_food, name='detect_food'),
-    path('dr/',views.predict_retinopathy_severity, name='dr_severity')
+    path('dr/',views.predict_retinopathy_severity, name='dr_severity'),
+    path('jobs/<uuid:job_id>/', views.analysis_job_status, name='analysis_job_status'),
+    path('jobs/<str:kind>/', views.submit_analysis_job, name='submit_analysis_job'),
 ]
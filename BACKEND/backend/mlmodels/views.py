@@ -1,47 +1,38 @@
 from django.shortcuts import render
+from django.conf import settings
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from .models import DiabetesPredictionLog, HypertensionPredictionLog
-from userManagement.models import User
+from userManagement.authentication import token_user_error
+from userManagement.services import user_exists
+from backend.metrics import ml_phase
+from .keras_models import ImageModelUnavailable, image_model_available, load_keras_models
+from .model_store import ModelStoreError, model_store
+from .image_analysis import ImageRejected, classify_food, grade_retinopathy, open_image, wants_tta
+from .uploads import UploadTooLarge, read_image_upload
+from .jobs import ANALYSES, JobQueueFull, get_job, submit_job
 import json
 import numpy as np
-import pickle
 import os
 import pandas as pd
-import base64
-from PIL import Image
-import io
-import tensorflow as tf
 
 # Load the ML models
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 MODEL_DIR = os.path.join(BASE_DIR, 'mlmodel')
 
-# Load scaler and PCA
+# Diabetes and hypertension models are served from the versioned store
 try:
-    with open(os.path.join(MODEL_DIR, 'DiabetesScaler_SMOTE.pkl'), 'rb') as f:
-        scaler = pickle.load(f)
-    
-    with open(os.path.join(MODEL_DIR, 'DiabetesPca_SMOTE.pkl'), 'rb') as f:
-        pca = pickle.load(f)
-        
-    # You should also load your prediction model (assuming there's a model file)
-    # Replace 'DiabetesModel.pkl' with your actual model filename
-    with open(os.path.join(MODEL_DIR, 'Diabetes_model_SMOTE.pkl'), 'rb') as f:
-        model = pickle.load(f)
-    
+    model_store.active('diabetes')
     MODELS_LOADED = True
-except Exception as e:
+except ModelStoreError as e:
     print(f"Error loading ML models: {e}")
     MODELS_LOADED = False
 
-# Load food detection model
-try:
-    food_model = tf.keras.models.load_model(os.path.join(MODEL_DIR, 'FOOD101_FINAL_MODEL_MOBILENETV2.h5'))
-    FOOD_MODEL_LOADED = True
-except Exception as e:
-    print(f"Error loading food detection model: {e}")
-    FOOD_MODEL_LOADED = False
+
+# In preload mode gunicorn.conf.py loads the CNNs in each worker after the
+# fork; with the inference sidecar they aren't loaded in workers at all
+if not settings.ML_PRELOAD_MODELS and not settings.ML_SIDECAR_SOCKET:
+    load_keras_models()
 
 # Create your views here.
 @csrf_exempt
@@ -51,7 +42,14 @@ def predict_diabetes(request):
             if not MODELS_LOADED:
                 return JsonResponse({"error": "ML models failed to load"}, status=500)
                 
-            data = json.loads(request.body)
+            with ml_phase('diabetes', 'parse'):
+                data = json.loads(request.body)
+
+            # Predictions are only logged against the access token's own user
+            if data.get('user_id') and str(data['user_id']).strip():
+                error = token_user_error(request, data['user_id'])
+                if error:
+                    return error
 
             # Map inputs to numbers
             gender_map = {'male': 1, 'female': 0}
@@ -101,25 +99,18 @@ def predict_diabetes(request):
 
             # Apply preprocessing and make prediction
             try:
-                columns = ['gender', 'age', 'hypertension', 'heart_disease', 
-                           'smoking_history', 'bmi', 'HbA1c_level', 'blood_glucose_level']
-                features_df = pd.DataFrame(features, columns=columns)
-                features_scaled = scaler.transform(features_df)
-                features_pca = pca.transform(features_scaled)
+                with ml_phase('diabetes', 'preprocess'):
+                    columns = ['gender', 'age', 'hypertension', 'heart_disease', 
+                               'smoking_history', 'bmi', 'HbA1c_level', 'blood_glucose_level']
+                    features_df = pd.DataFrame(features, columns=columns)
                 
-                # Get prediction probabilities
-                if hasattr(model, 'predict_proba'):
-                    probabilities = model.predict_proba(features_pca)[0]
-                    print("Prediction probabilities:", probabilities)
-                
-                prediction = int(model.predict(features_pca)[0])
+                # Scaling and PCA belong to the model version, so they run here
+                with ml_phase('diabetes', 'inference'):
+                    prediction, model_version = model_store.predict('diabetes', features_df)
 
                 # Add debug logging
                 print("Input features:", features.tolist())
-                print("Scaled features:", features_scaled.tolist())
-                print("PCA transformed features:", features_pca.tolist())
-                print("Raw prediction:", model.predict(features_pca))
-                print("Final prediction:", prediction)
+                print(f"Final prediction: {prediction} (model {model_version})")
             except Exception as e:
                 import traceback
                 print(f"Prediction error: {e}")
@@ -133,26 +124,24 @@ def predict_diabetes(request):
                     print(f"User ID from request: '{user_id}', type: {type(user_id)}")
                     
                     try:
-                        user = User.objects.get(UserID=user_id)
-                        print(f"Found user: {user.UserFirstName} {user.UserLastName}")
-                        
-                        # Create the log
-                        log = DiabetesPredictionLog.objects.create(
-                            user=user,
-                            gender=data.get('gender', ''),
-                            age=age,
-                            hypertension=data.get('hypertension', ''),
-                            heart_disease=data.get('heart_disease', ''),
-                            smoking_history=data.get('smoking_history', ''),
-                            bmi=bmi,
-                            HbA1c_level=hba1c,
-                            blood_glucose_level=glucose,
-                            prediction=bool(prediction)
-                        )
-                        print(f"Successfully created log with ID: {log.id}")
-                        
-                    except User.DoesNotExist:
-                        print(f"ERROR: User with ID {user_id} not found")
+                        if user_exists(user_id):
+                            # Create the log against the id; the row itself isn't needed
+                            with ml_phase('diabetes', 'log_write'):
+                                log = DiabetesPredictionLog.objects.create(
+                                    user_id=user_id,
+                                    gender=data.get('gender', ''),
+                                    age=age,
+                                    hypertension=data.get('hypertension', ''),
+                                    heart_disease=data.get('heart_disease', ''),
+                                    smoking_history=data.get('smoking_history', ''),
+                                    bmi=bmi,
+                                    HbA1c_level=hba1c,
+                                    blood_glucose_level=glucose,
+                                    prediction=bool(prediction)
+                                )
+                            print(f"Successfully created log with ID: {log.id}")
+                        else:
+                            print(f"ERROR: User with ID {user_id} not found")
                     except Exception as create_error:
                         print(f"ERROR creating log: {create_error}")
                         import traceback
@@ -169,6 +158,7 @@ def predict_diabetes(request):
             return JsonResponse({
                 "prediction": prediction,
                 "result": "Positive" if prediction == 1 else "Negative",
+                "model_version": model_version,
                 "message": "Based on the provided information, you may have diabetes. Please consult with a healthcare professional for a proper diagnosis and treatment plan." 
                            if prediction == 1 else 
                            "Based on the provided information, you likely don't have diabetes. However, maintaining a healthy lifestyle is still important for prevention."
@@ -182,17 +172,9 @@ def predict_diabetes(request):
 
 
 try:
-    with open(os.path.join(MODEL_DIR, 'HP_LGBM_SCALER.pkl'), 'rb') as f:
-        hypertension_scaler = pickle.load(f)
-
-    with open(os.path.join(MODEL_DIR, 'HP_LGBM_PCA.pkl'), 'rb') as f:
-        hypertension_pca = pickle.load(f)
-
-    with open(os.path.join(MODEL_DIR, 'HP_LGBM_MODEL.pkl'), 'rb') as f:
-        hypertension_model = pickle.load(f)
-    
+    model_store.active('hypertension')
     HYPERTENSION_MODELS_LOADED = True
-except Exception as e:
+except ModelStoreError as e:
     print(f"Error loading Hypertension models: {e}")
     HYPERTENSION_MODELS_LOADED = False
 
@@ -207,7 +189,14 @@ def predict_hypertension(request):
             if not HYPERTENSION_MODELS_LOADED:
                 return JsonResponse({"error": "Hypertension ML models failed to load"}, status=500)
                 
-            data = json.loads(request.body)
+            with ml_phase('hypertension', 'parse'):
+                data = json.loads(request.body)
+
+            # Predictions are only logged against the access token's own user
+            if data.get('user_id') and str(data['user_id']).strip():
+                error = token_user_error(request, data['user_id'])
+                if error:
+                    return error
 
             # Process input fields
             try:
@@ -222,48 +211,33 @@ def predict_hypertension(request):
             except ValueError as e:
                 return JsonResponse({"error": f"Invalid numeric value: {str(e)}"}, status=400)
 
-            # Create a DataFrame with the input values (similar to how the model was trained)
-            input_data = {
-                'gender': [gender],
-                'age': [age],
-                'heart_disease': [heart_disease],
-                'smoking_history': [smoking_history],
-                'bmi': [bmi],
-                'HbA1c_level': [hba1c],
-                'blood_glucose_level': [glucose],
-                'diabetes': [diabetes]
-            }
-            
-            # Create DataFrame and one-hot encode categorical columns just like in training
-            features_df = pd.DataFrame(input_data)
-            features_df = pd.get_dummies(features_df, columns=['gender', 'smoking_history'], drop_first=True)
+            with ml_phase('hypertension', 'preprocess'):
+                # Create a DataFrame with the input values (similar to how the model was trained)
+                input_data = {
+                    'gender': [gender],
+                    'age': [age],
+                    'heart_disease': [heart_disease],
+                    'smoking_history': [smoking_history],
+                    'bmi': [bmi],
+                    'HbA1c_level': [hba1c],
+                    'blood_glucose_level': [glucose],
+                    'diabetes': [diabetes]
+                }
             
-            # Debug: Print current columns
-            print("Features after encoding:", features_df.columns.tolist())
-            print("Scaler expects:", hypertension_scaler.feature_names_in_.tolist())
+                # Create DataFrame and one-hot encode categorical columns just like in training
+                features_df = pd.DataFrame(input_data)
+                features_df = pd.get_dummies(features_df, columns=['gender', 'smoking_history'], drop_first=True)
             
-            # Ensure all columns used during training are present
-            missing_cols = set(hypertension_scaler.feature_names_in_) - set(features_df.columns)
-            for col in missing_cols:
-                features_df[col] = 0
-                
-            # Remove any extra columns not used in training
-            extra_cols = set(features_df.columns) - set(hypertension_scaler.feature_names_in_)
-            if extra_cols:
-                features_df = features_df.drop(columns=extra_cols)
-            
-            # Ensure columns are in the same order as during training
-            features_df = features_df[hypertension_scaler.feature_names_in_]
-            
-            # Apply preprocessing and make prediction
+                # Debug: Print current columns
+                print("Features after encoding:", features_df.columns.tolist())
+
+            # Make prediction; the served version aligns the columns to the
+            # ones its scaler was trained on before scaling and PCA
             try:
-                features_scaled = hypertension_scaler.transform(features_df)
-                features_pca = hypertension_pca.transform(features_scaled)
-                prediction = int(hypertension_model.predict(features_pca)[0])
+                with ml_phase('hypertension', 'inference'):
+                    prediction, model_version = model_store.predict('hypertension', features_df)
                 print("Input features:", features_df)
-                if hasattr(hypertension_model, 'predict_proba'):
-                    print("Prediction probabilities:", hypertension_model.predict_proba(features_pca)[0])
-                print("Raw prediction:", hypertension_model.predict(features_pca))
+                print(f"Raw prediction: {prediction} (model {model_version})")
             except Exception as e:
                 import traceback
                 print(f"Prediction error: {e}")
@@ -277,26 +251,24 @@ def predict_hypertension(request):
                     print(f"User ID from request: '{user_id}', type: {type(user_id)}")
                     
                     try:
-                        user = User.objects.get(UserID=user_id)
-                        print(f"Found user: {user.UserFirstName} {user.UserLastName}")
-                        
-                        # Create the log
-                        log = HypertensionPredictionLog.objects.create(
-                            user=user,
-                            gender=data.get('gender', ''),
-                            age=age,
-                            heart_disease=data.get('heart_disease', ''),
-                            smoking_history=data.get('smoking_history', ''),
-                            bmi=bmi,
-                            HbA1c_level=hba1c,
-                            blood_glucose_level=glucose,
-                            diabetes=data.get('diabetes', ''),
-                            prediction=bool(prediction)
-                        )
-                        print(f"Successfully created log with ID: {log.id}")
-                        
-                    except User.DoesNotExist:
-                        print(f"ERROR: User with ID {user_id} not found")
+                        if user_exists(user_id):
+                            # Create the log against the id; the row itself isn't needed
+                            with ml_phase('hypertension', 'log_write'):
+                                log = HypertensionPredictionLog.objects.create(
+                                    user_id=user_id,
+                                    gender=data.get('gender', ''),
+                                    age=age,
+                                    heart_disease=data.get('heart_disease', ''),
+                                    smoking_history=data.get('smoking_history', ''),
+                                    bmi=bmi,
+                                    HbA1c_level=hba1c,
+                                    blood_glucose_level=glucose,
+                                    diabetes=data.get('diabetes', ''),
+                                    prediction=bool(prediction)
+                                )
+                            print(f"Successfully created log with ID: {log.id}")
+                        else:
+                            print(f"ERROR: User with ID {user_id} not found")
                     except Exception as create_error:
                         print(f"ERROR creating log: {create_error}")
                         import traceback
@@ -313,6 +285,7 @@ def predict_hypertension(request):
             return JsonResponse({
                 "prediction": prediction,
                 "result": "Positive" if prediction == 1 else "Negative",
+                "model_version": model_version,
                 "message": "You may have hypertension. Please consult a healthcare provider."
                            if prediction == 1 else
                            "You likely do not have hypertension. Continue regular health monitoring."
@@ -330,130 +303,125 @@ def predict_hypertension(request):
 def detect_food(request):
     if request.method == 'POST':
         try:
-            if not FOOD_MODEL_LOADED:
+            if not image_model_available('food'):
                 return JsonResponse({"error": "Food detection model failed to load"}, status=500)
 
-            # Get the image data from the request
-            data = json.loads(request.body)
-            image_data = data.get('image')
+            # Get the image data from the request; the base64 image is
+            # decoded as the body streams in, never held whole
+            with ml_phase('food', 'parse'):
+                image_file, data = read_image_upload(request, settings.ML_FOOD_MAX_UPLOAD_BYTES)
             
-            if not image_data:
+            if image_file is None:
                 return JsonResponse({"error": "No image data provided"}, status=400)
 
-            # Decode base64 image
+            # Open the decoded image
             try:
-                # Remove the data URL prefix if present
-                if ',' in image_data:
-                    image_data = image_data.split(',')[1]
-                
-                image_bytes = base64.b64decode(image_data)
-                image = Image.open(io.BytesIO(image_bytes))
-                
-                # Resize image to match model input size (adjust size as needed)
-                image = image.resize((224, 224))
-                
-                # Convert to numpy array and preprocess
-                img_array = np.array(image)
-                img_array = img_array / 255.0  # Normalize
-                img_array = np.expand_dims(img_array, axis=0)
-                
-                # Make prediction
-                predictions = food_model.predict(img_array)
-                
-                # Get the top prediction
-                predicted_class = np.argmax(predictions[0])
-                confidence = float(predictions[0][predicted_class])
-                
-                # Map class index to food name (adjust according to your model's classes)
-                food_classes = [
-                    'apple pie', 'baby back ribs', 'baklava', 'beef carpaccio', 'beef tartare',
-                    'beet salad', 'beignets', 'bibimbap', 'bread_pudding', 'breakfast_burrito',
-                    'bruschetta', 'caesar salad', 'cannoli', 'caprese salad', 'carrot cake',
-                    'ceviche', 'cheesecake', 'cheese plate', 'chicken curry', 'chicken quesadilla',
-                    'chicken wings', 'chocolate cake', 'chocolate mousse', 'churros', 'clam chowder',
-                    'club sandwich', 'crab cakes', 'creme brulee', 'croque madame', 'cup cakes',
-                    'deviled eggs', 'donuts', 'dumplings', 'edamame', 'eggs benedict',
-                    'escargots', 'falafel', 'filet mignon', 'fish and chips', 'foie gras',
-                    'french fries', 'french onion soup', 'french toast', 'fried calamari', 'fried rice',
-                    'frozen yogurt', 'garlic bread', 'gnocchi', 'greek salad', 'grilled cheese sandwich',
-                    'grilled salmon', 'guacamole', 'gyoza', 'hamburger', 'hot and sour soup',
-                    'hot dog', 'huevos rancheros', 'hummus', 'ice cream', 'lasagna',
-                    'lobster bisque', 'lobster roll sandwich', 'macaroni and cheese', 'macarons', 'miso soup',
-                    'mussels', 'nachos', 'omelette', 'onion rings', 'oysters',
-                    'pad thai', 'paella', 'pancakes', 'panna cotta', 'peking duck',
-                    'pho', 'pizza', 'pork chop', 'poutine', 'prime rib',
-                    'pulled pork sandwich', 'ramen', 'ravioli', 'red velvet cake', 'risotto',
-                    'samosa', 'sashimi', 'scallops', 'seaweed salad', 'shrimp and grits',
-                    'spaghetti bolognese', 'spaghetti carbonara', 'spring rolls', 'steak', 'strawberry shortcake',
-                    'sushi', 'tacos', 'takoyaki', 'tiramisu', 'tuna tartare',
-                    'waffles'
-                ]
-                predicted_food = food_classes[predicted_class]
-                
-                return JsonResponse({
-                    "food": predicted_food,
-                    "confidence": confidence,
-                    "message": f"Detected {predicted_food} with {confidence:.2%} confidence"
-                })
+                with ml_phase('food', 'decode'):
+                    image = open_image(image_file)
+
+                return JsonResponse(classify_food(image))
                 
+            except UploadTooLarge as e:
+                return JsonResponse({"error": str(e)}, status=413)
+            except ImageModelUnavailable as e:
+                return JsonResponse({"error": str(e)}, status=503)
             except Exception as e:
                 return JsonResponse({"error": f"Error processing image: {str(e)}"}, status=400)
                 
+        except UploadTooLarge as e:
+            return JsonResponse({"error": str(e)}, status=413)
         except Exception as e:
             return JsonResponse({"error": f"Request processing failed: {str(e)}"}, status=400)
             
     return JsonResponse({"message": "Only POST requests are accepted"}, status=405)
 
-DR_MODEL_PATH = os.path.join(BASE_DIR, 'mlmodel', 'dr_model_final_DR.keras')
-try:
-    dr_model = tf.keras.models.load_model(DR_MODEL_PATH)
-    DR_MODEL_LOADED = True
-except Exception as e:
-    print("❌ Failed to load diabetic retinopathy model:", e)
-    DR_MODEL_LOADED = False
-
-# Class labels (index to severity mapping)
-SEVERITY_CLASSES = ['No DR', 'Mild', 'Moderate', 'Severe', 'Proliferative DR']
 
 @csrf_exempt
 def predict_retinopathy_severity(request):
     if request.method == 'POST':
-        if not DR_MODEL_LOADED:
+        if not image_model_available('retinopathy'):
             return JsonResponse({"error": "Model failed to load"}, status=500)
 
         try:
-            data = json.loads(request.body)
-            image_data = data.get('image')
+            with ml_phase('retinopathy', 'parse'):
+                image_file, data = read_image_upload(request, settings.ML_DR_MAX_UPLOAD_BYTES)
 
-            if not image_data:
+            if image_file is None:
                 return JsonResponse({"error": "No image data provided"}, status=400)
 
-            # Strip base64 prefix if present
-            if ',' in image_data:
-                image_data = image_data.split(',')[1]
-
-            # Decode and load image
-            image_bytes = base64.b64decode(image_data)
-            image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-            image = image.resize((224, 224))
-
-            # Convert to numpy array
-            img_array = np.array(image) / 255.0  # Normalize
-            img_array = np.expand_dims(img_array, axis=0)  # Add batch dimension
+            # Pixels are decoded, already downscaled, by grade_retinopathy
+            with ml_phase('retinopathy', 'decode'):
+                image = open_image(image_file)
 
-            # Predict
-            predictions = dr_model.predict(img_array)
-            predicted_class_index = int(np.argmax(predictions[0]))
-            confidence_score = float(predictions[0][predicted_class_index])
-            severity = SEVERITY_CLASSES[predicted_class_index]
-
-            return JsonResponse({
-                "severity": severity,
-                "confidence": confidence_score,
-                "message": f"Predicted severity: {severity} ({confidence_score:.2%})"
-            })
+            return JsonResponse(grade_retinopathy(image, wants_tta(data.get('tta'))))
 
+        except UploadTooLarge as e:
+            return JsonResponse({"error": str(e)}, status=413)
+        except ImageRejected as e:
+            return JsonResponse({"error": str(e), "quality": e.quality}, status=422)
+        except ImageModelUnavailable as e:
+            return JsonResponse({"error": str(e)}, status=503)
         except Exception as e:
             return JsonResponse({"error": f"Prediction error: {str(e)}"}, status=400)
 
     return JsonResponse({"message": "Only POST requests are accepted"}, status=405)
+
+
+def _job_response(job):
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "result": job.result,
+        "error": job.error or None,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    }
+
+
+# Queue an image for the food or retinopathy model and return a job id
+# straight away; poll analysis_job_status for the result
+@csrf_exempt
+def submit_analysis_job(request, kind):
+    if request.method != 'POST':
+        return JsonResponse({"message": "Only POST requests are accepted"}, status=405)
+    if kind not in ANALYSES:
+        return JsonResponse({"error": f"Unknown analysis {kind}"}, status=404)
+    model = 'retinopathy' if kind == 'dr' else kind
+    if not image_model_available(model):
+        return JsonResponse({"error": "Model failed to load"}, status=500)
+
+    try:
+        limit = settings.ML_DR_MAX_UPLOAD_BYTES if kind == 'dr' else settings.ML_FOOD_MAX_UPLOAD_BYTES
+        with ml_phase(model, 'parse'):
+            image_file, data = read_image_upload(request, limit)
+        if image_file is None:
+            return JsonResponse({"error": "No image data provided"}, status=400)
+        # Only the header is read here, so a bad upload fails now rather
+        # than in the job; the pixels are decoded by the job
+        with ml_phase(model, 'decode'):
+            image = open_image(image_file)
+    except UploadTooLarge as e:
+        return JsonResponse({"error": str(e)}, status=413)
+    except Exception as e:
+        return JsonResponse({"error": f"Invalid image: {str(e)}"}, status=400)
+
+    options = {'use_tta': wants_tta(data.get('tta'))} if kind == 'dr' else {}
+    try:
+        job = submit_job(kind, image, **options)
+    except JobQueueFull as e:
+        return JsonResponse({"error": str(e)}, status=429, headers={"Retry-After": "5"})
+    return JsonResponse(_job_response(job), status=202)
+
+
+# Status and result of an analysis job. ?wait=N holds the request for up to
+# N seconds (capped by ML_JOB_MAX_WAIT_SECONDS) until the job finishes
+def analysis_job_status(request, job_id):
+    try:
+        wait = max(0.0, float(request.GET.get('wait', 0)))
+    except ValueError:
+        return JsonResponse({"error": "wait must be a number of seconds"}, status=400)
+    job = get_job(job_id, wait=wait)
+    if job is None:
+        return JsonResponse({"error": "Job not found"}, status=404)
+    return JsonResponse(_job_response(job))
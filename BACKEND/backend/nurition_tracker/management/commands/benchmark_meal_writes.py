@@ -0,0 +1,141 @@
+import json
+import os
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.utils import timezone
+from userManagement.deletion import run_deletion_job
+from userManagement.models import User, UserDeletionJob
+
+BENCHMARK_MEAL = {
+    'name': 'Benchmark meal',
+    'category': 'Lunch',
+    'calories': 520,
+    'serving_size': 350,
+    'protein_g': 32,
+    'carbohydrates_total_g': 48,
+    'fat_saturated': 6,
+    'fat_total_g': 18,
+    'sugar_g': 9,
+    'fiber_g': 7,
+    'potassium_mg': 640,
+    'sodium_g': 1.2,
+    'cholesterol_mg': 85,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure log_meal write throughput under parallel requests against the "
+        "configured database. Run it once per backend to compare, e.g. against "
+        "a throwaway PostgreSQL started with "
+        "`docker run --rm -e POSTGRES_PASSWORD=bench -p 5432:5432 postgres:16` and "
+        "DB_ENGINE=postgres DB_PASSWORD=bench (migrate first). With --read-ratio "
+        "some requests are get_meals_by_date reads instead, to compare SQLite "
+        "pragmas (e.g. SQLITE_JOURNAL_MODE=DELETE SQLITE_SYNCHRONOUS=FULL)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=400, help="log_meal calls per run")
+        parser.add_argument(
+            '--concurrency', default=f"1,4,{max(os.cpu_count() or 1, 8)}",
+            help="Comma separated thread counts to try"
+        )
+        parser.add_argument(
+            '--read-ratio', type=float, default=0.0,
+            help="Fraction of requests that read today's meals instead of logging one"
+        )
+        parser.add_argument('--json', dest='json_path', default=None, help="Also write results to this file")
+
+    def handle(self, *args, **options):
+        thread_counts = sorted({int(c) for c in options['concurrency'].split(',')})
+        total = options['requests']
+        read_ratio = options['read_ratio']
+        database = settings.DATABASES['default']
+
+        user = User.objects.create(
+            UserFirstName='Benchmark',
+            UserLastName='User',
+            UserEmail=f"benchmark-{uuid.uuid4().hex}@example.com",
+            UserPassword='!',
+        )
+        payload = dict(BENCHMARK_MEAL, user_id=user.UserID)
+        read_params = {'user_id': user.UserID, 'date': timezone.now().date().isoformat()}
+
+        def worker(count):
+            client = Client(SERVER_NAME='localhost')
+            rng = random.Random(count)
+            latencies, reads, failures = [], 0, 0
+            try:
+                for _ in range(count):
+                    is_read = rng.random() < read_ratio
+                    start = time.perf_counter()
+                    try:
+                        if is_read:
+                            response = client.get('/meals/getData/date/', read_params)
+                            ok = response.status_code == 200
+                        else:
+                            response = client.post('/meals/log/', payload, content_type='application/json')
+                            ok = response.status_code == 201
+                    except Exception:
+                        # e.g. "database is locked" once SQLite's busy timeout runs out
+                        ok = False
+                    latencies.append(time.perf_counter() - start)
+                    reads += is_read and ok
+                    failures += not ok
+            finally:
+                # Each thread opened its own connection
+                connection.close()
+            return latencies, reads, failures
+
+        results = []
+        try:
+            for threads in thread_counts:
+                shares = [total // threads + (i < total % threads) for i in range(threads)]
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=threads) as pool:
+                    outcomes = list(pool.map(worker, shares))
+                elapsed = time.perf_counter() - start
+
+                latencies = sorted(l for lat, _, _ in outcomes for l in lat)
+                reads = sum(r for _, r, _ in outcomes)
+                failures = sum(f for _, _, f in outcomes)
+                results.append({
+                    'engine': database['ENGINE'].rsplit('.', 1)[-1],
+                    'options': database.get('OPTIONS', {}),
+                    'threads': threads,
+                    'requests': total,
+                    'read_ratio': read_ratio,
+                    'failed': failures,
+                    'seconds': round(elapsed, 4),
+                    'reads_per_second': round(reads / elapsed, 2),
+                    'writes_per_second': round((total - reads - failures) / elapsed, 2),
+                    'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+                    'p95_ms': round(latencies[int(len(latencies) * 0.95)] * 1000, 2),
+                })
+        finally:
+            # Batched cleanup of the benchmark user's meals, same path as delete_user
+            job = UserDeletionJob.objects.create(user_id=user.UserID)
+            run_deletion_job(job.pk)
+            job.delete()
+
+        self.stdout.write(
+            f"{'engine':<12} {'threads':>7} {'reads/s':>10} {'writes/s':>10} "
+            f"{'p50 ms':>8} {'p95 ms':>8} {'failed':>7}"
+        )
+        for row in results:
+            self.stdout.write(
+                f"{row['engine']:<12} {row['threads']:>7} {row['reads_per_second']:>10} "
+                f"{row['writes_per_second']:>10} "
+                f"{row['p50_ms']:>8} {row['p95_ms']:>8} {row['failed']:>7}"
+            )
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Results written to {options['json_path']}")
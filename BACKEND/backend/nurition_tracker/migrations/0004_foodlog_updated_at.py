@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-19 18:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nurition_tracker', '0003_alter_foodlog_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='foodlog',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -27,6 +27,7 @@ class FoodLog(models.Model):
     sodium_g = models.FloatField()
     cholesterol_mg = models.FloatField()
     meal_log_time = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)  # Sync high-water mark
     
 
     class Meta:
@@ -6,7 +6,10 @@ from .models import FoodLog
 from .serializers import FoodLogSerializer, FoodLogCreateSerializer, FoodLogSummarySerializer
 from django.utils import timezone
 from django.db.models import Sum
+from userManagement.authentication import token_user_error
 from userManagement.models import User
+from userManagement.services import get_user, user_exists
+from backend.replicas import replica_reads
 
 # Create your views here.
 
@@ -21,9 +24,14 @@ def log_meal(request):
             {'error': 'user_id is required'}, 
             status=status.HTTP_400_BAD_REQUEST
         )
+
+    error = token_user_error(request, user_id)
+    if error:
+        return error
     
     try:
-        user = User.objects.get(UserID=user_id)
+        # Cached lookup; the object is also reused for the response below
+        user = get_user(user_id)
     except User.DoesNotExist:
         return Response(
             {'error': f'User with id {user_id} does not exist'}, 
@@ -82,6 +90,7 @@ def log_meal(request):
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 @api_view(['GET'])
+@replica_reads
 def get_meals(request):
     """
     Get all meals for a specific user
@@ -93,20 +102,24 @@ def get_meals(request):
             {'error': 'user_id query parameter is required'}, 
             status=status.HTTP_400_BAD_REQUEST
         )
+
+    error = token_user_error(request, user_id)
+    if error:
+        return error
     
-    try:
-        # Verify the user exists
-        user = User.objects.get(UserID=user_id)
-        meals = FoodLog.objects.filter(user=user)
-        serializer = FoodLogSummarySerializer(meals, many=True)
-        return Response(serializer.data)
-    except User.DoesNotExist:
+    # Verify the user exists
+    if not user_exists(user_id):
         return Response(
             {'error': f'User with id {user_id} does not exist'}, 
             status=status.HTTP_404_NOT_FOUND
         )
 
+    meals = FoodLog.objects.filter(user_id=user_id)
+    serializer = FoodLogSummarySerializer(meals, many=True)
+    return Response(serializer.data)
+
 @api_view(['GET'])
+@replica_reads
 def get_meals_by_date(request):
     """
     Get meals filtered by date for a specific user
@@ -119,11 +132,19 @@ def get_meals_by_date(request):
             {'error': 'user_id query parameter is required'}, 
             status=status.HTTP_400_BAD_REQUEST
         )
+
+    error = token_user_error(request, user_id)
+    if error:
+        return error
     
+    # Verify the user exists
+    if not user_exists(user_id):
+        return Response(
+            {'error': f'User with id {user_id} does not exist'}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+
     try:
-        # Verify the user exists
-        user = User.objects.get(UserID=user_id)
-        
         if date_str:
             # Parse the date from string
             date = timezone.datetime.strptime(date_str, '%Y-%m-%d').date()
@@ -133,7 +154,7 @@ def get_meals_by_date(request):
         
         # Filter meals by user and date
         meals = FoodLog.objects.filter(
-            user=user,
+            user_id=user_id,
             meal_log_time__date=date
         )
         
@@ -155,29 +176,24 @@ def get_meals_by_date(request):
         # After checking if meals exist for the requested date, if none found:
         if not result['Breakfast'] and not result['Lunch'] and not result['Dinner']:
             # Find the most recent date with meals
-            most_recent_meal = FoodLog.objects.filter(user=user).order_by('-meal_log_time__date').first()
+            most_recent_meal = FoodLog.objects.filter(user_id=user_id).order_by('-meal_log_time__date').first()
             if most_recent_meal:
                 # Use that date instead
                 formatted_date = most_recent_meal.meal_log_time.date()
                 # Re-query with this date
                 result['Breakfast'] = FoodLogSummarySerializer(
-                    FoodLog.objects.filter(user=user, meal_log_time__date=formatted_date, category='Breakfast'), many=True
+                    FoodLog.objects.filter(user_id=user_id, meal_log_time__date=formatted_date, category='Breakfast'), many=True
                 ).data
                 result['Lunch'] = FoodLogSummarySerializer(
-                    FoodLog.objects.filter(user=user, meal_log_time__date=formatted_date, category='Lunch'), many=True
+                    FoodLog.objects.filter(user_id=user_id, meal_log_time__date=formatted_date, category='Lunch'), many=True
                 ).data
                 result['Dinner'] = FoodLogSummarySerializer(
-                    FoodLog.objects.filter(user=user, meal_log_time__date=formatted_date, category='Dinner'), many=True
+                    FoodLog.objects.filter(user_id=user_id, meal_log_time__date=formatted_date, category='Dinner'), many=True
                 ).data
-                result['total_calories'] = FoodLog.objects.filter(user=user, meal_log_time__date=formatted_date).aggregate(total=Sum('calories'))['total'] or 0
+                result['total_calories'] = FoodLog.objects.filter(user_id=user_id, meal_log_time__date=formatted_date).aggregate(total=Sum('calories'))['total'] or 0
         
         return Response(result)
         
-    except User.DoesNotExist:
-        return Response(
-            {'error': f'User with id {user_id} does not exist'}, 
-            status=status.HTTP_404_NOT_FOUND
-        )
     except Exception as e:
         return Response(
             {'error': f'Error retrieving meals: {str(e)}'},
@@ -0,0 +1,151 @@
+import numpy as np
+from django.utils import timezone
+from .models import SleepLog
+
+SECONDS_PER_DAY = 86400
+MINUTES_PER_DAY = 1440
+
+# Logs shorter than this are treated as naps: they count towards daily totals
+# but not towards bedtime/wake-time regularity or social jetlag
+MAIN_SLEEP_MIN_HOURS = 3
+
+# Nights starting on Friday or Saturday (Monday == 0) are "free" nights
+FREE_NIGHT_WEEKDAYS = (4, 5)
+
+
+def load_sleep_series(user_id, start_date=None):
+    """
+    Read only the columns the analytics need for a user's sleep history and
+    return them as NumPy arrays: dates (datetime64[D]) and start/end times
+    (float seconds since the epoch). Duration is derived from start/end.
+    """
+    queryset = SleepLog.objects.filter(user__UserID=user_id)
+    if start_date is not None:
+        queryset = queryset.filter(date__gte=start_date)
+    rows = list(queryset.order_by('date', 'sleep_start').values_list('date', 'sleep_start', 'sleep_end'))
+
+    count = len(rows)
+    dates = np.array([row[0] for row in rows], dtype='datetime64[D]')
+    starts = np.fromiter((row[1].timestamp() for row in rows), dtype=np.float64, count=count)
+    ends = np.fromiter((row[2].timestamp() for row in rows), dtype=np.float64, count=count)
+    return dates, starts, ends
+
+
+def _clock_minutes_from_noon(timestamps, utc_offset):
+    # Minutes since the preceding local noon, so 23:30 and 00:30 are 60 apart
+    # instead of wrapping around midnight
+    minutes = ((timestamps + utc_offset) % SECONDS_PER_DAY) / 60
+    return (minutes - MINUTES_PER_DAY / 2) % MINUTES_PER_DAY
+
+
+def _format_clock(minutes_from_noon):
+    if minutes_from_noon is None:
+        return None
+    minutes = int(round(minutes_from_noon + MINUTES_PER_DAY / 2)) % MINUTES_PER_DAY
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def _rolling_mean(totals, has_data, window):
+    # Mean over the nights that have data in each trailing window, using
+    # cumulative sums so the cost is O(days) regardless of window size
+    sums = np.concatenate(([0.0], np.cumsum(totals)))
+    counts = np.concatenate(([0], np.cumsum(has_data)))
+    upper = np.arange(1, len(totals) + 1)
+    lower = np.maximum(upper - window, 0)
+    window_sums = sums[upper] - sums[lower]
+    window_counts = counts[upper] - counts[lower]
+    return np.divide(
+        window_sums, window_counts,
+        out=np.full(len(totals), np.nan), where=window_counts > 0
+    )
+
+
+def _round_or_none(value, digits=2):
+    if value is None or np.isnan(value):
+        return None
+    return round(float(value), digits)
+
+
+def compute_sleep_analytics(dates, starts, ends, target_hours=8.0, windows=(7, 30), utc_offset=None, as_of=None):
+    """
+    Compute rolling averages, bedtime/wake-time regularity, sleep debt and
+    social jetlag from the arrays returned by load_sleep_series. The headline
+    rolling averages cover the windows ending on `as_of` (default today).
+    """
+    if utc_offset is None:
+        offset = timezone.localtime().utcoffset()
+        utc_offset = offset.total_seconds() if offset else 0.0
+    if as_of is None:
+        as_of = timezone.localdate()
+
+    if len(dates) == 0:
+        return {
+            'nights_logged': 0,
+            'as_of': as_of.isoformat(),
+            'daily': [],
+            'rolling': {str(window): None for window in windows},
+            'bedtime': {'mean': None, 'std_minutes': None},
+            'wake_time': {'mean': None, 'std_minutes': None},
+            'sleep_debt_hours': 0.0,
+            'social_jetlag_hours': None,
+        }
+
+    hours = (ends - starts) / 3600
+
+    # Per-calendar-day totals over the whole span, including empty days, up
+    # to as_of so nights not logged lately count against the rolling averages
+    first_day = dates.min()
+    day_index = (dates - first_day).astype(np.int64)
+    as_of_index = int((np.datetime64(as_of, 'D') - first_day).astype(np.int64))
+    span = max(int(day_index.max()), as_of_index) + 1
+    totals = np.bincount(day_index, weights=hours, minlength=span)
+    has_data = np.bincount(day_index, minlength=span) > 0
+
+    rolling = {window: _rolling_mean(totals, has_data, window) for window in windows}
+
+    calendar = first_day + np.arange(span)
+    daily = []
+    for i in np.flatnonzero(has_data):
+        entry = {'date': str(calendar[i]), 'hours': round(float(totals[i]), 2)}
+        for window in windows:
+            entry[f'avg_{window}d'] = _round_or_none(rolling[window][i])
+        daily.append(entry)
+
+    # Sleep debt only counts nights that were actually logged
+    debt = np.clip(target_hours - totals[has_data], 0, None).sum()
+
+    main = hours >= MAIN_SLEEP_MIN_HOURS
+    bedtimes = _clock_minutes_from_noon(starts[main], utc_offset)
+    wake_times = _clock_minutes_from_noon(ends[main], utc_offset)
+    midpoints = _clock_minutes_from_noon((starts[main] + ends[main]) / 2, utc_offset)
+
+    # Anchor each night to the local day it started on, counting starts after
+    # midnight as the previous evening. 1970-01-01 was a Thursday (weekday 3)
+    local_day = np.floor(
+        (starts[main] + utc_offset - SECONDS_PER_DAY / 2) / SECONDS_PER_DAY
+    ).astype(np.int64)
+    free = np.isin((local_day + 3) % 7, FREE_NIGHT_WEEKDAYS)
+    social_jetlag = None
+    if free.any() and (~free).any():
+        social_jetlag = abs(midpoints[free].mean() - midpoints[~free].mean()) / 60
+
+    has_main = bool(main.any())
+    return {
+        'nights_logged': int(has_data.sum()),
+        'as_of': as_of.isoformat(),
+        'daily': daily,
+        'rolling': {
+            str(window): _round_or_none(rolling[window][as_of_index]) if as_of_index >= 0 else None
+            for window in windows
+        },
+        'bedtime': {
+            'mean': _format_clock(bedtimes.mean() if has_main else None),
+            'std_minutes': _round_or_none(bedtimes.std()) if has_main else None,
+        },
+        'wake_time': {
+            'mean': _format_clock(wake_times.mean() if has_main else None),
+            'std_minutes': _round_or_none(wake_times.std()) if has_main else None,
+        },
+        'sleep_debt_hours': round(float(debt), 2),
+        'social_jetlag_hours': _round_or_none(social_jetlag),
+    }
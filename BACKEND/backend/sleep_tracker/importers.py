@@ -0,0 +1,194 @@
+import csv
+import io
+import json
+import re
+import numpy as np
+from datetime import timezone as dt_timezone
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import SleepLog
+
+IMPORT_CHUNK_SIZE = 1000
+READ_BLOCK_SIZE = 64 * 1024
+MAX_REPORTED_ERRORS = 50
+# Longest single JSON object an import may contain, in characters
+MAX_OBJECT_SIZE = 64 * 1024
+_JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+# Column names used by common wearable exports, mapped onto SleepLog fields
+FIELD_ALIASES = {
+    'sleep_start': 'sleep_start', 'start': 'sleep_start', 'start_time': 'sleep_start',
+    'startdate': 'sleep_start', 'bedtime': 'sleep_start',
+    'sleep_end': 'sleep_end', 'end': 'sleep_end', 'end_time': 'sleep_end',
+    'enddate': 'sleep_end', 'wake_time': 'sleep_end',
+    'date': 'date', 'night': 'date',
+}
+
+
+class SleepImportError(Exception):
+    pass
+
+
+def iter_csv_rows(stream):
+    """Yield one dict per CSV line without reading the whole file."""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        yield from csv.DictReader(text)
+    except (csv.Error, UnicodeDecodeError) as e:
+        raise SleepImportError(f'Malformed CSV in import file: {e}')
+    finally:
+        # Don't let the wrapper close the underlying upload
+        text.detach()
+
+
+def iter_json_rows(stream):
+    """
+    Yield objects from a JSON array or from newline-delimited JSON, decoding
+    one object at a time from fixed-size blocks of the stream.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig')
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+    in_array = False
+    try:
+        while True:
+            # Walk the block by index; slicing it after every object would
+            # copy the rest of the block each time
+            pos = _JSON_WHITESPACE.match(buffer, pos).end()
+            char = buffer[pos:pos + 1]
+            if char == '[' and not in_array:
+                in_array = True
+                pos += 1
+                continue
+            if char == ',':
+                pos += 1
+                continue
+            if char == ']':
+                return
+            if char:
+                try:
+                    obj, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    # Most likely an object split across two blocks. One that
+                    # still doesn't parse with MAX_OBJECT_SIZE characters in
+                    # hand is malformed, so stop before buffering any more
+                    if eof or len(buffer) - pos > MAX_OBJECT_SIZE:
+                        raise SleepImportError('Malformed JSON in import file')
+                else:
+                    # A number at the end of a block may continue in the next
+                    if end < len(buffer) or eof:
+                        pos = end
+                        yield obj
+                        continue
+            elif eof:
+                if in_array:
+                    raise SleepImportError('Malformed JSON in import file')
+                return
+            try:
+                block = text.read(READ_BLOCK_SIZE)
+            except UnicodeDecodeError as e:
+                raise SleepImportError(f'Import file is not valid UTF-8: {e}')
+            if not block:
+                eof = True
+            buffer = buffer[pos:] + block
+            pos = 0
+    finally:
+        text.detach()
+
+
+def _parse_timestamp(value):
+    try:
+        dt = parse_datetime(str(value).strip()) if value not in (None, '') else None
+    except ValueError:
+        return None
+    if dt is None:
+        return None
+    if timezone.is_naive(dt):
+        dt = timezone.make_aware(dt)
+    return dt
+
+
+def iter_valid_rows(rows, report):
+    """
+    Normalise column names and validate each row, yielding
+    (date, sleep_start, sleep_end) tuples. Rejected rows are counted in
+    `report` along with the first few error messages.
+    """
+    for line, raw in enumerate(rows, start=1):
+        error = None
+        if isinstance(raw, dict):
+            row = {}
+            for key, value in raw.items():
+                field = FIELD_ALIASES.get(str(key).strip().lower())
+                if field:
+                    row[field] = value
+
+            sleep_start = _parse_timestamp(row.get('sleep_start'))
+            sleep_end = _parse_timestamp(row.get('sleep_end'))
+            if sleep_start is None or sleep_end is None:
+                error = 'sleep_start and sleep_end must be ISO 8601 timestamps'
+            elif sleep_end <= sleep_start:
+                error = 'sleep_end must be after sleep_start'
+        else:
+            error = 'Row is not an object'
+
+        if error:
+            report['rejected'] += 1
+            if len(report['errors']) < MAX_REPORTED_ERRORS:
+                report['errors'].append({'row': line, 'error': error})
+            continue
+
+        try:
+            date = parse_date(str(row['date']).strip()) if row.get('date') else None
+        except ValueError:
+            date = None
+        if date is None:
+            date = timezone.localtime(sleep_start).date()
+        yield date, sleep_start, sleep_end
+
+
+def _to_datetime64(values):
+    # Naive UTC so NumPy doesn't have to deal with tzinfo
+    return np.array(
+        [value.astimezone(dt_timezone.utc).replace(tzinfo=None) for value in values],
+        dtype='datetime64[us]'
+    )
+
+
+def _insert_chunk(user_id, chunk):
+    dates, starts, ends = zip(*chunk)
+    durations = (_to_datetime64(ends) - _to_datetime64(starts)).tolist()
+    SleepLog.objects.bulk_create(
+        [
+            SleepLog(user_id=user_id, date=date, sleep_start=start, sleep_end=end, duration=duration)
+            for date, start, end, duration in zip(dates, starts, ends, durations)
+        ],
+        # Re-importing the same export skips nights that already exist
+        ignore_conflicts=True,
+    )
+
+
+def import_sleep_logs(user_id, rows, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Insert validated rows in chunks of `chunk_size`. Only one chunk is held
+    in memory at a time, so memory use doesn't depend on the file size.
+    """
+    report = {'accepted': 0, 'rejected': 0, 'errors': []}
+    existing = SleepLog.objects.filter(user_id=user_id).count()
+
+    chunk = []
+    for entry in iter_valid_rows(rows, report):
+        chunk.append(entry)
+        if len(chunk) >= chunk_size:
+            _insert_chunk(user_id, chunk)
+            report['accepted'] += len(chunk)
+            chunk = []
+    if chunk:
+        _insert_chunk(user_id, chunk)
+        report['accepted'] += len(chunk)
+
+    report['inserted'] = SleepLog.objects.filter(user_id=user_id).count() - existing
+    report['duplicates'] = report['accepted'] - report['inserted']
+    return report
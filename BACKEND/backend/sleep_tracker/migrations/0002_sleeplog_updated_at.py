@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-19 18:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sleep_tracker', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sleeplog',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
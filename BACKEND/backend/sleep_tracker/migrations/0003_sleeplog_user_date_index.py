@@ -0,0 +1,37 @@
+# Generated by Django 5.1.7 on 2026-10-19 18:30
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def remove_duplicate_sleep_logs(apps, schema_editor):
+    # Keep the earliest row for each (user, sleep_start) so the unique
+    # constraint below can be created on existing data
+    SleepLog = apps.get_model('sleep_tracker', 'SleepLog')
+    keep_ids = (
+        SleepLog.objects.order_by()
+        .values('user_id', 'sleep_start')
+        .annotate(keep_id=Min('id'))
+        .values('keep_id')
+    )
+    SleepLog.objects.exclude(id__in=keep_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sleep_tracker', '0002_sleeplog_updated_at'),
+        ('userManagement', '0005_user_usergender_user_userheight_user_userweight_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_sleep_logs, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='sleeplog',
+            index=models.Index(fields=['user', 'date'], name='sleeplog_user_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='sleeplog',
+            constraint=models.UniqueConstraint(fields=('user', 'sleep_start'), name='sleeplog_unique_user_start'),
+        ),
+    ]
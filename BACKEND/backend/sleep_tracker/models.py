@@ -9,6 +9,17 @@ class SleepLog(models.Model):
     sleep_start = models.DateTimeField()
     sleep_end = models.DateTimeField()
     duration = models.DurationField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)  # Sync high-water mark
+
+    class Meta:
+        indexes = [
+            # Every sleep endpoint filters by user and a date range, ordered by date
+            models.Index(fields=['user', 'date'], name='sleeplog_user_date_idx'),
+        ]
+        constraints = [
+            # The same night can only be logged once per user
+            models.UniqueConstraint(fields=['user', 'sleep_start'], name='sleeplog_unique_user_start'),
+        ]
 
     def save(self, *args, **kwargs):
         if self.sleep_start and self.sleep_end:
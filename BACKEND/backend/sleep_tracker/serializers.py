@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from userManagement.models import User
+from userManagement.services import user_exists
 from .models import SleepLog   
 
 
@@ -47,8 +47,12 @@ class SleepLogSerializer(serializers.ModelSerializer):
 
 
       
+    def validate_UserID(self, value):
+        if not user_exists(value):
+            raise serializers.ValidationError(f"User with id {value} does not exist")
+        return value
+
     def create(self, validated_data):
-        from sleep_tracker.models import User
+        # Existence was checked in validate_UserID, so insert by id directly
         user_id = validated_data.pop('UserID')
-        user = User.objects.get(UserID=user_id)
-        return SleepLog.objects.create(user=user, **validated_data)
\ No newline at end of file
+        return SleepLog.objects.create(user_id=user_id, **validated_data)
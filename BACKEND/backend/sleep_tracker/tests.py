@@ -1,3 +1,328 @@
+import io
+import json
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+import numpy as np
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from userManagement.models import User
+from userManagement.services import invalidate_user, user_exists
+from userManagement.tokens import issue_tokens
+from . import importers
+from .analytics import compute_sleep_analytics
+from .importers import SleepImportError, iter_csv_rows, iter_json_rows
+from .models import SleepLog
 
-# Create your tests here.
+ROWS = [
+    {'sleep_start': f'2024-01-{day:02d}T23:00:00Z', 'sleep_end': f'2024-01-{day + 1:02d}T07:00:00Z'}
+    for day in range(1, 21)
+]
+
+
+class CreateSleepLogTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            UserFirstName='Sleep', UserLastName='Test', UserEmail='sleep@example.com', UserPassword='x',
+        )
+        self.client.defaults['HTTP_AUTHORIZATION'] = f"Bearer {issue_tokens(self.user.UserID)['access_token']}"
+
+    def _add(self, token=None, **overrides):
+        data = {
+            'UserID': self.user.UserID,
+            'date': '2024-01-01',
+            'sleep_start': '2024-01-01T23:00:00Z',
+            'sleep_end': '2024-01-02T07:00:00Z',
+        }
+        data.update(overrides)
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'} if token else {}
+        return self.client.post(reverse('add-sleep-log'), data, content_type='application/json', **headers)
+
+    def test_creates_log(self):
+        response = self._add()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['data']['duration_hours'], 8)
+
+    def test_same_start_twice_is_a_conflict(self):
+        self.assertEqual(self._add().status_code, 201)
+        response = self._add(sleep_end='2024-01-02T06:00:00Z')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(SleepLog.objects.filter(user=self.user).count(), 1)
+
+    def test_same_start_for_another_user_is_allowed(self):
+        other = User.objects.create(
+            UserFirstName='Other', UserLastName='Test', UserEmail='other@example.com', UserPassword='x',
+        )
+        self.assertEqual(self._add().status_code, 201)
+        token = issue_tokens(other.UserID)['access_token']
+        self.assertEqual(self._add(UserID=other.UserID, token=token).status_code, 201)
+
+    def test_token_user_must_match(self):
+        self.assertEqual(self._add(UserID=999999).status_code, 403)
+        self.assertEqual(self._add(token='not-a-token').status_code, 401)
+        self.assertFalse(SleepLog.objects.exists())
+
+    def test_deleted_user_with_a_valid_token_is_rejected(self):
+        token = issue_tokens(self.user.UserID)['access_token']
+        user_id = self.user.UserID
+        self.assertTrue(user_exists(user_id))
+        self.user.delete()
+        invalidate_user(user_id)
+        response = self.client.post(
+            reverse('add-sleep-log'),
+            {'UserID': user_id, 'date': '2024-01-01', 'sleep_start': '2024-01-01T23:00:00Z', 'sleep_end': '2024-01-02T07:00:00Z'},
+            content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {token}',
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class _CountingStream(io.BytesIO):
+    """Records how many bytes were read from it."""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def read1(self, size=-1):
+        data = super().read1(size)
+        self.bytes_read += len(data)
+        return data
+
+    def readinto(self, buffer):
+        count = super().readinto(buffer)
+        self.bytes_read += count
+        return count
+
+
+class JsonRowsTests(TestCase):
+    def _rows(self, data):
+        return list(iter_json_rows(io.BytesIO(data)))
+
+    def test_array_and_ndjson(self):
+        self.assertEqual(self._rows(json.dumps(ROWS).encode()), ROWS)
+        self.assertEqual(self._rows('\n'.join(json.dumps(row) for row in ROWS).encode()), ROWS)
+        self.assertEqual(self._rows(b'  [ ]  '), [])
+        self.assertEqual(self._rows(b''), [])
+        self.assertEqual(self._rows(b'[123, 4]'), [123, 4])
+
+    def test_objects_split_across_blocks(self):
+        data = json.dumps(ROWS, indent=2).encode()
+        for block_size in (1, 7, 64):
+            with mock.patch.object(importers, 'READ_BLOCK_SIZE', block_size):
+                self.assertEqual(self._rows(data), ROWS)
+                self.assertEqual(self._rows(b'[123, 4]'), [123, 4])
+
+    def test_malformed_json(self):
+        for data in (b'[{"sleep_start": }]', b'{"a": 1', b'[1, 2'):
+            with self.assertRaises(SleepImportError):
+                self._rows(data)
+
+    def test_malformed_object_fails_without_reading_the_rest(self):
+        rest = json.dumps(ROWS * 200).encode()[1:]
+        stream = _CountingStream(b'[{"sleep_start": ,},' + rest)
+        with mock.patch.object(importers, 'READ_BLOCK_SIZE', 1024), \
+                mock.patch.object(importers, 'MAX_OBJECT_SIZE', 4096):
+            with self.assertRaises(SleepImportError):
+                list(iter_json_rows(stream))
+        self.assertLess(stream.bytes_read, 64 * 1024)
+
+    def test_bad_utf8(self):
+        with self.assertRaises(SleepImportError):
+            self._rows(b'[{"a": "\xff"}]')
+
+
+class ImportSleepLogsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            UserFirstName='Import', UserLastName='Test', UserEmail='import@example.com', UserPassword='x',
+        )
+        self.url = reverse('import-sleep-logs', args=[self.user.UserID])
+        self.client.defaults['HTTP_AUTHORIZATION'] = f"Bearer {issue_tokens(self.user.UserID)['access_token']}"
+
+    def _upload(self, name, content, content_type):
+        return self.client.post(self.url, {'file': SimpleUploadedFile(name, content, content_type=content_type)})
+
+    def test_csv_import_counts_rejects_and_duplicates(self):
+        lines = ['start,end,night'] + [f"{row['sleep_start']},{row['sleep_end']}," for row in ROWS[:5]]
+        lines += ['not a date,2024-02-01T07:00:00Z,', '2024-02-02T07:00:00Z,2024-02-01T23:00:00Z,']
+        content = '\n'.join(lines).encode()
+
+        response = self._upload('export.csv', content, 'text/csv')
+        self.assertEqual(response.status_code, 201)
+        report = response.json()['data']
+        self.assertEqual((report['accepted'], report['rejected'], report['inserted']), (5, 2, 5))
+        self.assertEqual([error['row'] for error in report['errors']], [6, 7])
+
+        # The same export again only finds duplicates
+        report = self._upload('export.csv', content, 'text/csv').json()['data']
+        self.assertEqual((report['inserted'], report['duplicates']), (0, 5))
+        self.assertEqual(SleepLog.objects.filter(user=self.user).count(), 5)
+
+    def test_json_import(self):
+        response = self._upload('export.json', json.dumps(ROWS).encode(), 'application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['data']['inserted'], len(ROWS))
+        log = SleepLog.objects.filter(user=self.user).order_by('sleep_start').first()
+        self.assertEqual(log.duration.total_seconds(), 8 * 3600)
+
+    def test_malformed_json_imports_nothing(self):
+        content = json.dumps(ROWS).encode()[:-10]
+        response = self._upload('export.json', content, 'application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(SleepLog.objects.filter(user=self.user).exists())
+
+    def test_csv_rows_stream(self):
+        rows = list(iter_csv_rows(io.BytesIO(b'\xef\xbb\xbfsleep_start,sleep_end\na,b\n')))
+        self.assertEqual(rows, [{'sleep_start': 'a', 'sleep_end': 'b'}])
+
+
+def _series(nights):
+    """load_sleep_series-style arrays from (date, start, end) ISO strings in UTC."""
+    def seconds(value):
+        return datetime.fromisoformat(value).replace(tzinfo=dt_timezone.utc).timestamp()
+    return (
+        np.array([night[0] for night in nights], dtype='datetime64[D]'),
+        np.array([seconds(night[1]) for night in nights]),
+        np.array([seconds(night[2]) for night in nights]),
+    )
+
+
+class SleepAnalyticsTests(TestCase):
+    # Mon 8h, Tue 7h, nothing on Wed, Thu 8h, then a 1h nap and a 9h night
+    # on Friday's date; the 00:30 start makes it a free (Friday) night
+    NIGHTS = [
+        ('2024-01-01', '2024-01-01T23:00', '2024-01-02T07:00'),
+        ('2024-01-02', '2024-01-02T23:30', '2024-01-03T06:30'),
+        ('2024-01-04', '2024-01-04T22:00', '2024-01-05T06:00'),
+        ('2024-01-05', '2024-01-05T14:00', '2024-01-05T15:00'),
+        ('2024-01-05', '2024-01-06T00:30', '2024-01-06T09:30'),
+    ]
+
+    def _analytics(self, as_of, nights=None):
+        return compute_sleep_analytics(*_series(self.NIGHTS if nights is None else nights), utc_offset=0, as_of=as_of)
+
+    def test_daily_totals_and_regularity(self):
+        data = self._analytics(date(2024, 1, 5))
+        self.assertEqual(data['nights_logged'], 4)
+        self.assertEqual(data['as_of'], '2024-01-05')
+        # The gap on the 3rd has no entry but doesn't reset the averages
+        self.assertEqual(data['daily'], [
+            {'date': '2024-01-01', 'hours': 8.0, 'avg_7d': 8.0, 'avg_30d': 8.0},
+            {'date': '2024-01-02', 'hours': 7.0, 'avg_7d': 7.5, 'avg_30d': 7.5},
+            {'date': '2024-01-04', 'hours': 8.0, 'avg_7d': 7.67, 'avg_30d': 7.67},
+            {'date': '2024-01-05', 'hours': 10.0, 'avg_7d': 8.25, 'avg_30d': 8.25},
+        ])
+        self.assertEqual(data['rolling'], {'7': 8.25, '30': 8.25})
+        # Only Tuesday is short of 8 hours
+        self.assertEqual(data['sleep_debt_hours'], 1.0)
+        # The nap is left out: bedtimes 23:00, 23:30, 22:00, 00:30
+        self.assertEqual(data['bedtime'], {'mean': '23:15', 'std_minutes': 54.08})
+        self.assertEqual(data['wake_time'], {'mean': '07:15', 'std_minutes': 80.78})
+        # Midpoint 05:00 on the free night against 02:40 on average otherwise
+        self.assertEqual(data['social_jetlag_hours'], 2.33)
+
+    def test_rolling_is_anchored_at_as_of(self):
+        # 4th-10th only holds Thursday and Friday
+        self.assertEqual(self._analytics(date(2024, 1, 10))['rolling'], {'7': 9.0, '30': 8.25})
+        # Nothing logged in the last week
+        self.assertEqual(self._analytics(date(2024, 1, 15))['rolling'], {'7': None, '30': 8.25})
+        self.assertEqual(self._analytics(date(2024, 3, 1))['rolling'], {'7': None, '30': None})
+        # Logs after as_of don't count towards it
+        self.assertEqual(self._analytics(date(2024, 1, 2))['rolling'], {'7': 7.5, '30': 7.5})
+        self.assertEqual(self._analytics(date(2023, 12, 1))['rolling'], {'7': None, '30': None})
+
+    def test_empty_history(self):
+        data = self._analytics(date(2024, 1, 5), nights=[])
+        self.assertEqual(data, {
+            'nights_logged': 0,
+            'as_of': '2024-01-05',
+            'daily': [],
+            'rolling': {'7': None, '30': None},
+            'bedtime': {'mean': None, 'std_minutes': None},
+            'wake_time': {'mean': None, 'std_minutes': None},
+            'sleep_debt_hours': 0.0,
+            'social_jetlag_hours': None,
+        })
+
+    def test_no_free_nights_means_no_social_jetlag(self):
+        self.assertIsNone(self._analytics(date(2024, 1, 5), nights=self.NIGHTS[:3])['social_jetlag_hours'])
+
+    def test_endpoint_averages_up_to_today(self):
+        user = User.objects.create(
+            UserFirstName='Trend', UserLastName='Test', UserEmail='trend@example.com', UserPassword='x',
+        )
+        now = timezone.now()
+        for days_ago, hours in ((1, 8), (10, 6)):
+            start = now - timedelta(days=days_ago)
+            SleepLog.objects.create(
+                user=user, date=timezone.localdate(start), sleep_start=start, sleep_end=start + timedelta(hours=hours),
+            )
+        url = reverse('get-sleep-analytics', args=[user.UserID])
+        auth = {'HTTP_AUTHORIZATION': f"Bearer {issue_tokens(user.UserID)['access_token']}"}
+
+        data = self.client.get(url, **auth).json()['data']
+        self.assertEqual(data['as_of'], timezone.localdate().isoformat())
+        self.assertEqual(data['rolling'], {'7': 8.0, '30': 7.0})
+        self.assertEqual(data['target_hours'], 8.0)
+
+        data = self.client.get(url, {'days': 5, 'target_hours': 9}, **auth).json()['data']
+        self.assertEqual((data['nights_logged'], data['sleep_debt_hours']), (1, 1.0))
+        self.assertEqual(self.client.get(url, {'days': 0}, **auth).status_code, 400)
+
+
+class SleepLineChartTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            UserFirstName='Chart', UserLastName='Test', UserEmail='chart@example.com', UserPassword='x',
+        )
+        self.url = reverse('get-sleep-line-chart', args=[self.user.UserID])
+        self.client.defaults['HTTP_AUTHORIZATION'] = f"Bearer {issue_tokens(self.user.UserID)['access_token']}"
+        self.today = timezone.localdate()
+        now = timezone.now()
+        # A night and a nap yesterday, a night 5 days ago and one 20 days ago
+        for days_ago, start_hours, hours in ((1, 0, 7), (1, 10, 1.5), (5, 0, 6), (20, 0, 9)):
+            start = now - timedelta(days=days_ago, hours=start_hours)
+            SleepLog.objects.create(
+                user=self.user, date=self.today - timedelta(days=days_ago),
+                sleep_start=start, sleep_end=start + timedelta(hours=hours),
+            )
+
+    def _chart(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['data']
+
+    def test_default_week_is_zero_filled(self):
+        data = self._chart()
+        days = data['daily_data']
+        self.assertEqual([day['date'] for day in days],
+                         [(self.today - timedelta(days=6 - i)).isoformat() for i in range(7)])
+        self.assertEqual([day['hours'] for day in days], [0.0, 6.0, 0.0, 0.0, 0.0, 8.5, 0.0])
+        self.assertEqual(days[-1]['day'], self.today.strftime('%A'))
+        # Averaged over the two days with sleep
+        self.assertEqual((data['avg_sleep'], data['total_sleep_time']), (7.25, 14.5))
+
+    def test_days_sets_the_window(self):
+        data = self._chart(days=1)
+        self.assertEqual(data['daily_data'], [
+            {'day': self.today.strftime('%A'), 'date': self.today.isoformat(), 'hours': 0.0},
+        ])
+        self.assertEqual((data['avg_sleep'], data['total_sleep_time']), (0, 0))
+
+        data = self._chart(days=30)
+        self.assertEqual(len(data['daily_data']), 30)
+        self.assertEqual(data['daily_data'][0]['date'], (self.today - timedelta(days=29)).isoformat())
+        self.assertEqual((data['avg_sleep'], data['total_sleep_time']), (7.83, 23.5))
+
+        self.assertEqual(len(self._chart(days=366)['daily_data']), 366)
+
+    def test_days_out_of_range(self):
+        for days in (0, -1, 367, 'week'):
+            response = self.client.get(self.url, {'days': days})
+            self.assertEqual(response.status_code, 400, days)
@@ -1,10 +1,12 @@
 # urls.py
 
 from django.urls import path
-from .views import CreateSleepLogView, GetSleepLogsByUser, GetSleepLineChartData
+from .views import CreateSleepLogView, GetSleepLogsByUser, GetSleepLineChartData, GetSleepAnalytics, ImportSleepLogsView
 
 urlpatterns = [
     path('sleepadd/', CreateSleepLogView.as_view(), name='add-sleep-log'),
+    path('sleepImport/<int:user_id>/', ImportSleepLogsView.as_view(), name='import-sleep-logs'),
     path('sleepGetByUser/<int:user_id>/', GetSleepLogsByUser.as_view(), name='get-sleep-logs'),
     path('sleepLineChart/<int:user_id>/', GetSleepLineChartData.as_view(), name='get-sleep-line-chart'),
+    path('sleepAnalytics/<int:user_id>/', GetSleepAnalytics.as_view(), name='get-sleep-analytics'),
 ]
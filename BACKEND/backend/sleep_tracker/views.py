@@ -4,99 +4,190 @@ from django.utils import timezone
 from .models import SleepLog
 from django.http import JsonResponse
 from .serializers import SleepLogSerializer
+from .analytics import load_sleep_series, compute_sleep_analytics
+from .importers import SleepImportError, iter_csv_rows, iter_json_rows, import_sleep_logs
+from userManagement.authentication import token_user_error
+from userManagement.models import User
+from userManagement.services import invalidate_user, user_exists
 from rest_framework.views import APIView 
 from datetime import datetime, timedelta
-from django.db.models import Avg, Sum
-from django.db.models.functions import TruncDate
+from django.db import IntegrityError, transaction
+from django.db.models import Sum
+from django.utils.decorators import method_decorator
+from backend.replicas import mark_user_write, replica_reads
 
 # Create your views here.
 class CreateSleepLogView(APIView):
     def post(self, request):
-        serializer = SleepLogSerializer(data=request.data)
+        error = token_user_error(request, request.data.get('UserID'))
+        if error:
+            return error
+        serializer = SleepLogSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
-            serializer.save()
+            try:
+                with transaction.atomic():
+                    serializer.save()
+            except IntegrityError:
+                # Another worker may still have had a since-deleted user
+                # cached, in which case it's the foreign key that failed
+                user_id = serializer.validated_data['UserID']
+                if not User.objects.filter(UserID=user_id).exists():
+                    invalidate_user(user_id)
+                    return JsonResponse(
+                        {"success": False, "errors": {"UserID": [f"User with id {user_id} does not exist"]}},
+                        status=400
+                    )
+                return JsonResponse(
+                    {"success": False, "error": "A sleep log with this start time already exists"}, status=409
+                )
             return JsonResponse({"success": True, "data": serializer.data}, status=201)
         return JsonResponse({"success": False, "errors": serializer.errors}, status=400)
 
+class ImportSleepLogsView(APIView):
+    """
+    Bulk import of a wearable export uploaded as multipart field `file`.
+    CSV needs sleep_start/sleep_end columns (date is optional); JSON may be
+    an array of objects or newline-delimited objects with the same keys.
+    """
+    def post(self, request, user_id):
+        error = token_user_error(request, user_id)
+        if error:
+            return error
+        upload = request.FILES.get('file')
+        if upload is None:
+            return JsonResponse({"success": False, "error": "file upload required"}, status=400)
+
+        # Resolve the user once; rows are inserted by user_id afterwards
+        if not user_exists(user_id):
+            return JsonResponse({"success": False, "error": f"User with id {user_id} does not exist"}, status=404)
+
+        name = (upload.name or '').lower()
+        if name.endswith('.csv') or upload.content_type == 'text/csv':
+            rows = iter_csv_rows(upload.file)
+        elif name.endswith(('.json', '.jsonl', '.ndjson')) or 'json' in (upload.content_type or ''):
+            rows = iter_json_rows(upload.file)
+        else:
+            return JsonResponse({"success": False, "error": "file must be CSV or JSON"}, status=400)
+
+        try:
+            with transaction.atomic():
+                report = import_sleep_logs(user_id, rows)
+        except SleepImportError as e:
+            return JsonResponse({"success": False, "error": str(e)}, status=400)
+
+        # bulk_create skips the post_save signal that normally does this
+        mark_user_write(user_id)
+        return JsonResponse({"success": True, "data": report}, status=201)
+
 class GetSleepLogsByUser(APIView):
+    @method_decorator(replica_reads)
     def get(self, request, user_id):
         if not user_id:
             return JsonResponse({"success": False, "error": "UserID required"}, status=400)
+        error = token_user_error(request, user_id)
+        if error:
+            return error
         
         sleep_logs = SleepLog.objects.filter(user__UserID=user_id).order_by('-date')
         serializer = SleepLogSerializer(sleep_logs, many=True)
         return JsonResponse({"success": True, "data": serializer.data}, status=200)
 
 class GetSleepLineChartData(APIView):
+    MAX_DAYS = 366
+
+    @method_decorator(replica_reads)
     def get(self, request, user_id):
         if not user_id:
             return JsonResponse({"success": False, "error": "UserID required"}, status=400)
-        
-        # Get the last 7 days of sleep data
-        end_date = timezone.now()
-        start_date = end_date - timedelta(days=6)  # Changed to 6 to get exactly 7 days
-        
-        print(f"Fetching sleep data for UserID: {user_id}")
-        print(f"Date range: {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}")
-        
-        # Get sleep logs for the last 7 days
-        sleep_logs = SleepLog.objects.filter(
-            user__UserID=user_id,
-            date__range=[start_date, end_date]
-        ).order_by('date')
-        
-        print(f"Found {sleep_logs.count()} sleep logs in the date range.")
-        for log in sleep_logs:
-            print(f"  Log Date: {log.date}, Duration: {log.duration}")
-        
-        # Initialize daily data with zeros for all 7 days
+        error = token_user_error(request, user_id)
+        if error:
+            return error
+
+        # Window length in days, e.g. ?days=30 (defaults to the last 7 days)
+        try:
+            days = int(request.GET.get('days', 7))
+        except ValueError:
+            return JsonResponse({"success": False, "error": "days must be an integer"}, status=400)
+        if not 1 <= days <= self.MAX_DAYS:
+            return JsonResponse(
+                {"success": False, "error": f"days must be between 1 and {self.MAX_DAYS}"}, status=400
+            )
+
+        end_date = timezone.localdate()
+        start_date = end_date - timedelta(days=days - 1)
+
+        # One grouped query: total duration per date, so naps and split nights
+        # on the same date are added together instead of overwriting each other
+        totals_by_date = dict(
+            SleepLog.objects.filter(
+                user__UserID=user_id,
+                date__range=[start_date, end_date]
+            ).order_by().values_list('date').annotate(total=Sum('duration'))
+        )
+
         daily_data = []
         total_sleep_time = 0
         total_days = 0
-        
-        # Create a dictionary of existing sleep logs by date
-        sleep_by_date = {
-            log.date.strftime('%Y-%m-%d'): log 
-            for log in sleep_logs
-        }
-        
-        # Generate data for all 7 days
-        for i in range(7):
+
+        # Merge with the calendar so days without logs still show up as 0
+        for i in range(days):
             current_date = start_date + timedelta(days=i)
-            date_str = current_date.strftime('%Y-%m-%d')
-            day_name = current_date.strftime('%A')
-            
-            if date_str in sleep_by_date:
-                log = sleep_by_date[date_str]
-                if log.duration:
-                    hours = log.duration.total_seconds() / 3600
-                    total_sleep_time += hours
-                    total_days += 1
-                    daily_data.append({
-                        'day': day_name,
-                        'date': date_str,
-                        'hours': round(hours, 2)
-                    })
-                else:
-                    daily_data.append({
-                        'day': day_name,
-                        'date': date_str,
-                        'hours': 0.0
-                    })
-            else:
-                daily_data.append({
-                    'day': day_name,
-                    'date': date_str,
-                    'hours': 0.0
-                })
-        
-        # Calculate average sleep time
+            duration = totals_by_date.get(current_date)
+            hours = duration.total_seconds() / 3600 if duration else 0.0
+            if duration:
+                total_sleep_time += hours
+                total_days += 1
+            daily_data.append({
+                'day': current_date.strftime('%A'),
+                'date': current_date.isoformat(),
+                'hours': round(hours, 2)
+            })
+
+        # Average over the days that actually have sleep recorded
         avg_sleep = round(total_sleep_time / total_days, 2) if total_days > 0 else 0
-        
+
         response_data = {
             'daily_data': daily_data,
             'avg_sleep': avg_sleep,
             'total_sleep_time': round(total_sleep_time, 2)
         }
-        
-        return JsonResponse({"success": True, "data": response_data}, status=200)
\ No newline at end of file
+
+        return JsonResponse({"success": True, "data": response_data}, status=200)
+
+
+class GetSleepAnalytics(APIView):
+    MAX_DAYS = 3660
+
+    @method_decorator(replica_reads)
+    def get(self, request, user_id):
+        if not user_id:
+            return JsonResponse({"success": False, "error": "UserID required"}, status=400)
+        error = token_user_error(request, user_id)
+        if error:
+            return error
+
+        # Optional ?days= limits the history analysed; default is all of it
+        start_date = None
+        if 'days' in request.GET:
+            try:
+                days = int(request.GET['days'])
+            except ValueError:
+                return JsonResponse({"success": False, "error": "days must be an integer"}, status=400)
+            if not 1 <= days <= self.MAX_DAYS:
+                return JsonResponse(
+                    {"success": False, "error": f"days must be between 1 and {self.MAX_DAYS}"}, status=400
+                )
+            start_date = timezone.localdate() - timedelta(days=days - 1)
+
+        try:
+            target_hours = float(request.GET.get('target_hours', 8))
+        except ValueError:
+            return JsonResponse({"success": False, "error": "target_hours must be a number"}, status=400)
+        if not 0 < target_hours <= 24:
+            return JsonResponse({"success": False, "error": "target_hours must be between 0 and 24"}, status=400)
+
+        dates, starts, ends = load_sleep_series(user_id, start_date)
+        analytics = compute_sleep_analytics(dates, starts, ends, target_hours=target_hours)
+        analytics['target_hours'] = target_hours
+
+        return JsonResponse({"success": True, "data": analytics}, status=200)
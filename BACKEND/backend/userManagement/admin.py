@@ -1,7 +1,9 @@
 from django.contrib import admin
-from .models import User    
+from .models import RefreshToken, User, UserDeletionJob
 
 
 # Register your models here.
 
-admin.site.register(User)
\ No newline at end of file
+admin.site.register(User)
+admin.site.register(UserDeletionJob)
+admin.site.register(RefreshToken)
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class UsermanagementConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'userManagement'
+
+    def ready(self):
+        # Keep users reading their own writes when a read replica is used
+        from backend.replicas import connect_write_receivers
+        connect_write_receivers()
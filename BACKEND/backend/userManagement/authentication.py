@@ -0,0 +1,36 @@
+from django.http import JsonResponse
+from rest_framework.authentication import BaseAuthentication
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """
+    DRF side of token_authentication_middleware: reuses the token the
+    middleware already verified, so DRF views don't fall back to a session
+    lookup.
+    """
+    def authenticate(self, request):
+        django_request = request._request
+        if getattr(django_request, 'user_id', None) is None:
+            return None
+        return django_request.app_user, django_request.user_id
+
+    def authenticate_header(self, request):
+        return 'Bearer'
+
+
+def token_user_error(request, user_id=None):
+    """
+    None if the request carries a valid access token, for `user_id` if one is
+    given. Otherwise the response to return instead: 401 without a valid
+    token, 403 when it belongs to a different user. Views that act on a
+    user's data take the user from here rather than trusting the id sent.
+    """
+    token_user_id = getattr(request, 'user_id', None)
+    if token_user_id is None:
+        return JsonResponse(
+            {"success": False, "error": "A valid access token is required"},
+            status=401, headers={'WWW-Authenticate': 'Bearer'},
+        )
+    if user_id is not None and str(user_id).strip() != str(token_user_id):
+        return JsonResponse({"success": False, "error": "Access token is for a different user"}, status=403)
+    return None
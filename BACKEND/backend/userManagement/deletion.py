@@ -0,0 +1,130 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, connection, models, transaction
+from django.utils import timezone
+from .models import User, UserDeletionJob
+from .services import invalidate_user
+
+# One background thread is enough: jobs are I/O bound and running them one
+# after another keeps the write load from bulk deletes predictable
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='user-deletion')
+
+ACTIVE_STATUSES = ['pending', 'running']
+
+
+class _JobLost(Exception):
+    """The job was marked failed by fail_if_lost while this worker ran it."""
+
+
+def _child_tables():
+    """
+    (table, pk column, user fk column) for every model that cascades from
+    User, found from the model graph so new child tables are picked up.
+    """
+    tables = []
+    for relation in User._meta.related_objects:
+        if relation.on_delete is not models.CASCADE or relation.many_to_many:
+            continue
+        model = relation.related_model
+        tables.append((model._meta.db_table, model._meta.pk.column, relation.field.column))
+    return tables
+
+
+def _delete_in_batches(table, pk_column, fk_column, user_id, batch_size, job):
+    quote = connection.ops.quote_name
+    sql = (
+        f"DELETE FROM {quote(table)} WHERE {quote(pk_column)} IN ("
+        f"SELECT {quote(pk_column)} FROM {quote(table)} WHERE {quote(fk_column)} = %s LIMIT %s)"
+    )
+    while True:
+        # Each batch commits on its own so locks are held only briefly
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [user_id, batch_size])
+                deleted = cursor.rowcount
+            # Progress doubles as the heartbeat fail_if_lost checks. If the
+            # job is no longer running it was given up on, so this batch is
+            # rolled back and the worker stops
+            if not UserDeletionJob.objects.filter(pk=job.pk, status='running').update(
+                deleted_rows=models.F('deleted_rows') + deleted, updated_at=timezone.now()
+            ):
+                raise _JobLost
+        if deleted < batch_size:
+            return
+
+
+def run_deletion_job(job_id):
+    """
+    Delete a user's child rows in bounded batches, then the user row. Does
+    nothing unless the job is still pending, so a job is only ever run once.
+    """
+    job = UserDeletionJob.objects.get(pk=job_id)
+    batch_size = settings.USER_DELETION_BATCH_SIZE
+    if not UserDeletionJob.objects.filter(pk=job.pk, status='pending').update(
+        status='running', updated_at=timezone.now()
+    ):
+        return
+    running = UserDeletionJob.objects.filter(pk=job.pk, status='running')
+    try:
+        for table, pk_column, fk_column in _child_tables():
+            if not running.update(current_table=table, updated_at=timezone.now()):
+                raise _JobLost
+            _delete_in_batches(table, pk_column, fk_column, job.user_id, batch_size, job)
+
+        # Children are gone, so this no longer makes the collector load anything
+        User.objects.filter(UserID=job.user_id).delete()
+        invalidate_user(job.user_id)
+        running.update(status='done', current_table='', finished_at=timezone.now())
+    except _JobLost:
+        print(f"Deletion job {job.pk} for user {job.user_id} was marked lost; stopping")
+    except Exception as e:
+        print(f"ERROR deleting user {job.user_id}: {e}")
+        running.update(status='failed', error=str(e), finished_at=timezone.now())
+    finally:
+        if settings.USER_DELETION_IN_BACKGROUND:
+            # The worker thread's connection isn't closed by the request cycle
+            connection.close()
+
+
+def fail_if_lost(job):
+    """
+    Mark an unfinished job failed once it has made no progress for
+    USER_DELETION_TIMEOUT_SECONDS: the process running it was restarted and
+    it will never finish. Returns True if it was marked.
+    """
+    if job.status not in ACTIVE_STATUSES:
+        return False
+    if job.updated_at >= timezone.now() - timedelta(seconds=settings.USER_DELETION_TIMEOUT_SECONDS):
+        return False
+    UserDeletionJob.objects.filter(pk=job.pk, status__in=ACTIVE_STATUSES).update(
+        status='failed', error="Job was lost; delete the user again", finished_at=timezone.now(),
+    )
+    job.refresh_from_db()
+    return True
+
+
+def schedule_user_deletion(user_id):
+    """
+    Record a deletion job and hand it to the background worker once the
+    current transaction commits. Returns the job (an existing one if a
+    deletion for this user is already queued or running, unless that one
+    was lost and is replaced).
+    """
+    job = UserDeletionJob.objects.filter(user_id=user_id, status__in=ACTIVE_STATUSES).first()
+    if job is not None and not fail_if_lost(job):
+        return job
+
+    try:
+        with transaction.atomic():
+            job = UserDeletionJob.objects.create(user_id=user_id)
+    except IntegrityError:
+        # A concurrent request queued one first (one_active_deletion_per_user)
+        return UserDeletionJob.objects.filter(user_id=user_id).latest('pk')
+    invalidate_user(user_id)
+    if settings.USER_DELETION_IN_BACKGROUND:
+        transaction.on_commit(lambda: _executor.submit(run_deletion_job, job.pk))
+    else:
+        run_deletion_job(job.pk)
+        job.refresh_from_db()
+    return job
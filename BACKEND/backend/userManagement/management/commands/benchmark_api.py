@@ -0,0 +1,413 @@
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import subprocess
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import URLResolver, get_resolver, resolve
+from django.utils import timezone
+from backend.metrics import render_metrics
+from mlmodels.models import DiabetesPredictionLog, HypertensionPredictionLog
+from mlmodels.synthetic import encode_image_base64, synthetic_image, synthetic_tabular_rows
+from nurition_tracker.management.commands.benchmark_meal_writes import BENCHMARK_MEAL
+from nurition_tracker.models import FoodLog
+from sleep_tracker.models import SleepLog
+from userManagement.models import User, UserDeletionJob
+from userManagement.tokens import issue_tokens
+
+SEED_PASSWORD = 'benchmark-password'
+_PLACEHOLDER = re.compile(r'<(?:\w+:)?(\w+)>')
+
+
+def _seed(users, meals, nights, predictions, seed, disposable):
+    """Fill the database with reproducible synthetic users and logs."""
+    rng = random.Random(seed)
+    now = timezone.now().replace(microsecond=0)
+    password = make_password(SEED_PASSWORD)
+    run = uuid.uuid4().hex[:8]
+
+    def make_users(count, label):
+        return User.objects.bulk_create([
+            User(
+                UserFirstName=f"{label}{i}",
+                UserLastName='Benchmark',
+                UserEmail=f"{label}-{run}-{i}@example.com",
+                UserPassword=password,
+                UserWeight=round(rng.uniform(50, 110), 1),
+                UserHeight=round(rng.uniform(150, 200), 1),
+            )
+            for i in range(count)
+        ])
+
+    make_users(users, 'user')
+    # bulk_create doesn't return primary keys on every backend
+    user_ids = list(User.objects.filter(UserEmail__startswith='user-', UserEmail__contains=run)
+                    .order_by('UserID').values_list('UserID', flat=True))
+    make_users(disposable, 'spare')
+    spare_ids = list(User.objects.filter(UserEmail__startswith='spare-', UserEmail__contains=run)
+                     .order_by('UserID').values_list('UserID', flat=True))
+
+    food, sleep, diabetes, hypertension = [], [], [], []
+    rows = synthetic_tabular_rows(predictions, seed=seed)
+    for user_id in user_ids:
+        for i in range(meals):
+            food.append(FoodLog(
+                user_id=user_id,
+                name=f"Meal {i}",
+                category=rng.choice(['Breakfast', 'Lunch', 'Dinner']),
+                meal_log_time=now - timedelta(days=i % 30, minutes=rng.randint(0, 600)),
+                **{k: v for k, v in BENCHMARK_MEAL.items() if k not in ('name', 'category')},
+            ))
+        for i in range(nights):
+            start = now - timedelta(days=i + 1, hours=rng.uniform(0, 3))
+            end = start + timedelta(hours=rng.uniform(5, 9))
+            sleep.append(SleepLog(user_id=user_id, date=start.date(), sleep_start=start, sleep_end=end, duration=end - start))
+        for row in rows:
+            common = dict(
+                user_id=user_id, gender=row['gender'], age=row['age'], heart_disease=row['heart_disease'],
+                smoking_history=row['smoking_history'], bmi=row['bmi'], HbA1c_level=row['HbA1c_level'],
+                blood_glucose_level=row['blood_glucose_level'], prediction=rng.random() < 0.3,
+            )
+            diabetes.append(DiabetesPredictionLog(hypertension=row['hypertension'], **common))
+            hypertension.append(HypertensionPredictionLog(diabetes=row['diabetes'], **common))
+
+    FoodLog.objects.bulk_create(food, batch_size=1000)
+    SleepLog.objects.bulk_create(sleep, batch_size=1000)
+    DiabetesPredictionLog.objects.bulk_create(diabetes, batch_size=1000)
+    HypertensionPredictionLog.objects.bulk_create(hypertension, batch_size=1000)
+
+    emails = dict(User.objects.filter(UserID__in=user_ids).values_list('UserID', 'UserEmail'))
+    return {
+        'run': run,
+        'users': user_ids,
+        'spare_users': spare_ids,
+        'emails': emails,
+        'refresh_token': issue_tokens(user_ids[0])['refresh_token'],
+        'deletion_job': UserDeletionJob.objects.create(user_id=spare_ids[0] if spare_ids else 0, status='done').pk,
+        'tabular_rows': rows or synthetic_tabular_rows(1, seed=seed),
+        'food_image': encode_image_base64(synthetic_image(seed=seed)),
+        'fundus_image': encode_image_base64(synthetic_image(seed=seed, fundus=True)),
+        'now': now,
+    }
+
+
+def _sleep_csv(ctx, i):
+    start = ctx['now'] + timedelta(days=3650 + i)
+    lines = ['sleep_start,sleep_end']
+    for night in range(7):
+        begin = start + timedelta(days=night)
+        lines.append(f"{begin.isoformat()},{(begin + timedelta(hours=7)).isoformat()}")
+    return '\n'.join(lines).encode()
+
+
+def _user(ctx, i):
+    return ctx['users'][i % len(ctx['users'])]
+
+
+# Request to send for each view, by resolved view name. Each builder gets the
+# seed context and the request index and returns the pieces of one request.
+SCENARIOS = {
+    'list_users': lambda ctx, i: {'query': {'limit': 50}},
+    'user_detail': lambda ctx, i: {'kwargs': {'user_id': _user(ctx, i)}},
+    'create_user': lambda ctx, i: {'method': 'POST', 'form': {
+        'UserFirstName': 'New', 'UserLastName': 'User', 'UserPassword': SEED_PASSWORD,
+        'UserEmail': f"new-{ctx['run']}-{i}@example.com",
+    }},
+    'update_user': lambda ctx, i: {'method': 'POST', 'kwargs': {'user_id': _user(ctx, i)},
+                                   'form': {'UserWeight': 60 + i % 40}},
+    'delete_user': lambda ctx, i: {'kwargs': {'user_id': ctx['spare_users'][i]}},
+    'deletion_status': lambda ctx, i: {'kwargs': {'job_id': ctx['deletion_job']}},
+    'login_user': lambda ctx, i: {'method': 'POST', 'form': {
+        'UserEmail': ctx['emails'][_user(ctx, i)], 'UserPassword': SEED_PASSWORD,
+    }},
+    'refresh_token': lambda ctx, i: {'method': 'POST', 'form': {'refresh_token': ctx['refresh_token']}},
+    'add-sleep-log': lambda ctx, i: {'method': 'POST', 'json': {
+        'UserID': _user(ctx, i),
+        'date': (ctx['now'] + timedelta(days=1)).date().isoformat(),
+        'sleep_start': (ctx['now'] + timedelta(days=1, seconds=i)).isoformat(),
+        'sleep_end': (ctx['now'] + timedelta(days=1, hours=8, seconds=i)).isoformat(),
+    }},
+    'import-sleep-logs': lambda ctx, i: {'method': 'POST', 'kwargs': {'user_id': _user(ctx, i)},
+                                         'files': {'file': ('sleep.csv', _sleep_csv(ctx, i), 'text/csv')}},
+    'get-sleep-logs': lambda ctx, i: {'kwargs': {'user_id': _user(ctx, i)}},
+    'get-sleep-line-chart': lambda ctx, i: {'kwargs': {'user_id': _user(ctx, i)}, 'query': {'days': 30}},
+    'get-sleep-analytics': lambda ctx, i: {'kwargs': {'user_id': _user(ctx, i)}, 'query': {'days': 90}},
+    'nutrition_tracker:log_meal': lambda ctx, i: {'method': 'POST', 'json': dict(BENCHMARK_MEAL, user_id=_user(ctx, i))},
+    'nutrition_tracker:get_meals': lambda ctx, i: {'query': {'user_id': _user(ctx, i)}},
+    'nutrition_tracker:get_meals_by_date': lambda ctx, i: {'query': {
+        'user_id': _user(ctx, i), 'date': ctx['now'].date().isoformat(),
+    }},
+    'sync_changes': lambda ctx, i: {'query': {'user_id': _user(ctx, i)}},
+    'metrics': lambda ctx, i: {},
+    'predict_diabetes': lambda ctx, i: {'method': 'POST', 'json': dict(
+        ctx['tabular_rows'][i % len(ctx['tabular_rows'])], user_id=_user(ctx, i))},
+    'predict_hypertension': lambda ctx, i: {'method': 'POST', 'json': dict(
+        ctx['tabular_rows'][i % len(ctx['tabular_rows'])], user_id=_user(ctx, i))},
+    'detect_food': lambda ctx, i: {'method': 'POST', 'json': {'image': ctx['food_image']}},
+    'dr_severity': lambda ctx, i: {'method': 'POST', 'json': {'image': ctx['fundus_image']}},
+}
+
+
+def _routes(patterns=None, prefix=''):
+    """Every route in the URLconf except the admin site, as '/path/<arg>/'."""
+    if patterns is None:
+        patterns = get_resolver().url_patterns
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            if pattern.app_name == 'admin':
+                continue
+            yield from _routes(pattern.url_patterns, prefix + str(pattern.pattern))
+        else:
+            yield '/' + prefix + str(pattern.pattern)
+
+
+class _ClientTransport:
+    def __init__(self):
+        self.client = Client(SERVER_NAME='localhost')
+
+    def send(self, method, path, query=None, json_body=None, form=None, files=None):
+        if method == 'GET':
+            return self.client.get(path, query or {}).status_code
+        if json_body is not None:
+            return self.client.post(path, json_body, content_type='application/json').status_code
+        data = dict(form or {})
+        for name, (filename, content, content_type) in (files or {}).items():
+            data[name] = SimpleUploadedFile(filename, content, content_type=content_type)
+        return self.client.post(path, data).status_code
+
+
+class _HTTPTransport:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def send(self, method, path, query=None, json_body=None, form=None, files=None):
+        url = self.base_url + path
+        if query:
+            url += '?' + urllib.parse.urlencode(query)
+        headers, body = {}, None
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif files:
+            boundary = uuid.uuid4().hex
+            parts = []
+            for name, value in (form or {}).items():
+                parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+            for name, (filename, content, content_type) in files.items():
+                parts.append(
+                    f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                    f'Content-Type: {content_type}\r\n\r\n'.encode() + content + b'\r\n'
+                )
+            body = b''.join(parts) + f'--{boundary}--\r\n'.encode()
+            headers['Content-Type'] = f'multipart/form-data; boundary={boundary}'
+        elif method == 'POST':
+            body = urllib.parse.urlencode(form or {}).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        request = urllib.request.Request(url, data=body, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def metrics_text(self):
+        try:
+            with urllib.request.urlopen(self.base_url + '/metrics', timeout=10) as response:
+                return response.read().decode()
+        except urllib.error.URLError:
+            return ''
+
+
+def _query_totals(text):
+    # {view: [sum, count]} from the db_queries_per_request histogram
+    totals = {}
+    for match in re.finditer(r'^db_queries_per_request_(sum|count)\{view="([^"]*)"\} (\S+)$', text, re.M):
+        kind, view, value = match.groups()
+        totals.setdefault(view, [0.0, 0.0])[0 if kind == 'sum' else 1] = float(value)
+    return totals
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a synthetic database and drive every URL in the URLconf, reporting "
+        "latency percentiles, throughput and queries per request. By default it "
+        "runs in-process against a throwaway database. With --base-url it sends "
+        "real HTTP requests to a running server and seeds the database configured "
+        "here, which must be the one that server uses (use a scratch copy)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--meals', type=int, default=60, help="Meals per user")
+        parser.add_argument('--nights', type=int, default=90, help="Sleep logs per user")
+        parser.add_argument('--predictions', type=int, default=10, help="Prediction logs of each kind per user")
+        parser.add_argument('--requests', type=int, default=100, help="Measured requests per endpoint")
+        parser.add_argument('--warmup', type=int, default=5, help="Unmeasured requests per endpoint first")
+        parser.add_argument('--concurrency', type=int, default=1)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--only', default=None, help="Comma separated substrings; run matching routes only")
+        parser.add_argument('--base-url', default=None, help="e.g. http://127.0.0.1:8000")
+        parser.add_argument('--json', dest='json_path', default=None, help="Also write results to this file")
+
+    def handle(self, *args, **options):
+        base_url = options['base_url']
+        if base_url is None and 'replica' in settings.DATABASES:
+            raise CommandError("Unset DB_REPLICA_HOST/DB_REPLICA_NAME; the throwaway database has no replica")
+
+        routes = list(_routes())
+        if options['only']:
+            wanted = options['only'].split(',')
+            routes = [route for route in routes if any(w in route for w in wanted)]
+
+        old_name = None
+        if base_url is None:
+            if connection.vendor == 'sqlite':
+                # A file rather than shared memory, so worker threads can write concurrently
+                connection.settings_dict['TEST']['NAME'] = os.path.join(
+                    tempfile.gettempdir(), f"benchmark_{os.getpid()}.sqlite3"
+                )
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+
+        try:
+            # Several views print debug output on every request
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = self._run(routes, options, base_url)
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write(
+            f"{'route':<42} {'method':<6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+            f"{'req/s':>8} {'queries':>8}  status"
+        )
+        for row in results:
+            if row.get('skipped'):
+                self.stdout.write(f"{row['route']:<42} skipped: {row['skipped']}")
+                continue
+            queries = '-' if row['queries_per_request'] is None else row['queries_per_request']
+            self.stdout.write(
+                f"{row['route']:<42} {row['method']:<6} {row['p50_ms']:>8} {row['p95_ms']:>8} "
+                f"{row['p99_ms']:>8} {row['requests_per_second']:>8} {queries:>8}  {row['status_codes']}"
+            )
+
+        if options['json_path']:
+            report = {
+                'revision': _git_revision(),
+                'timestamp': timezone.now().isoformat(),
+                'mode': 'http' if base_url else 'client',
+                'database': settings.DATABASES['default']['ENGINE'],
+                'options': {key: options[key] for key in (
+                    'users', 'meals', 'nights', 'predictions', 'requests', 'warmup', 'concurrency', 'seed',
+                )},
+                'results': results,
+            }
+            with open(options['json_path'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Results written to {options['json_path']}")
+
+    def _run(self, routes, options, base_url):
+        total = options['requests']
+        warmup = options['warmup']
+        threads = options['concurrency']
+        ctx = _seed(
+            options['users'], options['meals'], options['nights'], options['predictions'],
+            options['seed'], disposable=total + warmup + 1,
+        )
+
+        def new_transport():
+            return _HTTPTransport(base_url) if base_url else _ClientTransport()
+
+        def metrics_text():
+            return new_transport().metrics_text() if base_url else render_metrics()
+
+        def build(route, i):
+            # Resolve with dummy arguments to find the view, then fill in real ones
+            view_name = resolve(_PLACEHOLDER.sub('1', route)).view_name
+            spec = SCENARIOS[view_name](ctx, i)
+            kwargs = spec.get('kwargs', {})
+            path = _PLACEHOLDER.sub(lambda m: str(kwargs[m.group(1)]), route)
+            return view_name, spec.get('method', 'GET'), path, spec
+
+        results = []
+        for route in routes:
+            view_name = resolve(_PLACEHOLDER.sub('1', route)).view_name
+            if view_name not in SCENARIOS:
+                results.append({'route': route, 'view': view_name, 'skipped': 'no scenario'})
+                continue
+
+            transport = new_transport()
+            for i in range(warmup):
+                _, method, path, spec = build(route, total + i)
+                transport.send(method, path, spec.get('query'), spec.get('json'), spec.get('form'), spec.get('files'))
+
+            before = _query_totals(metrics_text()).get(view_name, [0.0, 0.0])
+
+            def worker(indexes):
+                local = new_transport()
+                timings = []
+                for i in indexes:
+                    _, method, path, spec = build(route, i)
+                    start = time.perf_counter()
+                    status = local.send(method, path, spec.get('query'), spec.get('json'), spec.get('form'), spec.get('files'))
+                    timings.append((time.perf_counter() - start, status))
+                if base_url is None:
+                    connection.close()
+                return timings
+
+            shares = [range(t, total, threads) for t in range(threads)]
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                timings = [t for share in pool.map(worker, shares) for t in share]
+            elapsed = time.perf_counter() - start
+
+            after = _query_totals(metrics_text()).get(view_name)
+            queries = None
+            if after is not None and after[1] > before[1]:
+                queries = round((after[0] - before[0]) / (after[1] - before[1]), 2)
+
+            latencies = np.array([t for t, _ in timings]) * 1000
+            statuses = {}
+            for _, status in timings:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+            results.append({
+                'route': route,
+                'view': view_name,
+                'method': build(route, 0)[1],
+                'requests': total,
+                'concurrency': threads,
+                'p50_ms': round(float(np.percentile(latencies, 50)), 2),
+                'p95_ms': round(float(np.percentile(latencies, 95)), 2),
+                'p99_ms': round(float(np.percentile(latencies, 99)), 2),
+                'requests_per_second': round(total / elapsed, 2),
+                'queries_per_request': queries,
+                'status_codes': statuses,
+            })
+        return results
@@ -0,0 +1,92 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from userManagement.hashers import (
+    TunedArgon2PasswordHasher,
+    TunedBCryptSHA256PasswordHasher,
+    TunedPBKDF2PasswordHasher,
+)
+
+HASHERS = {
+    'pbkdf2': TunedPBKDF2PasswordHasher,
+    'argon2': TunedArgon2PasswordHasher,
+    'bcrypt': TunedBCryptSHA256PasswordHasher,
+}
+
+BENCHMARK_PASSWORD = 'correct horse battery staple'
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure password verification throughput for the configured hashers "
+        "at several thread counts, to size login workers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hashers', default=None,
+            help="Comma separated hasher names (pbkdf2,argon2,bcrypt). Defaults to PASSWORD_HASHER."
+        )
+        parser.add_argument('--logins', type=int, default=40, help="Verifications per run")
+        parser.add_argument(
+            '--concurrency', default=f"1,{os.cpu_count() or 1}",
+            help="Comma separated thread counts to try"
+        )
+        parser.add_argument('--json', dest='json_path', default=None, help="Also write results to this file")
+
+    def handle(self, *args, **options):
+        names = (options['hashers'] or settings.PASSWORD_HASHER).split(',')
+        thread_counts = sorted({int(c) for c in options['concurrency'].split(',')})
+        logins = options['logins']
+
+        results = []
+        for name in names:
+            if name not in HASHERS:
+                raise CommandError(f"Unknown hasher {name!r}, expected one of {', '.join(HASHERS)}")
+            hasher = HASHERS[name]()
+            try:
+                encoded = hasher.encode(BENCHMARK_PASSWORD, hasher.salt())
+            except ValueError as e:
+                # Raised when the optional argon2/bcrypt library is missing
+                raise CommandError(f"{name}: {e}")
+            params = {
+                key: value for key, value in hasher.safe_summary(encoded).items()
+                if key not in ('salt', 'hash', 'checksum')
+            }
+
+            def verify(_):
+                return hasher.verify(BENCHMARK_PASSWORD, encoded)
+
+            for threads in thread_counts:
+                with ThreadPoolExecutor(max_workers=threads) as pool:
+                    list(pool.map(verify, range(threads)))  # warm up
+                    start = time.perf_counter()
+                    verified = list(pool.map(verify, range(logins)))
+                    elapsed = time.perf_counter() - start
+                if not all(verified):
+                    raise CommandError(f"{name}: verification failed during benchmark")
+                results.append({
+                    'hasher': name,
+                    'params': params,
+                    'threads': threads,
+                    'logins': logins,
+                    'seconds': round(elapsed, 4),
+                    'logins_per_second': round(logins / elapsed, 2),
+                    # Wall time a single login waits for its hash at this concurrency
+                    'ms_per_login': round(elapsed / logins * threads * 1000, 2),
+                })
+
+        self.stdout.write(f"{'hasher':<8} {'threads':>7} {'logins/s':>10} {'ms/login':>10}  params")
+        for row in results:
+            self.stdout.write(
+                f"{row['hasher']:<8} {row['threads']:>7} {row['logins_per_second']:>10} "
+                f"{row['ms_per_login']:>10}  {row['params']}"
+            )
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(results, f, indent=2, default=str)
+            self.stdout.write(f"Results written to {options['json_path']}")
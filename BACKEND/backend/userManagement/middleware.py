@@ -0,0 +1,44 @@
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+from django.utils.functional import SimpleLazyObject
+from .services import get_user
+from .tokens import InvalidToken, verify_token
+
+
+def _authenticate(request):
+    """
+    Read a bearer access token, if any, and attach `request.user_id`.
+    `request.app_user` loads the User row at most once per request, and only
+    if a view actually needs more than the id.
+
+    A missing, expired or malformed token leaves both unset rather than
+    failing the request: login and token refresh must still work for a
+    client holding a stale token, so each view decides whether it needs one (see token_user_error).
+    """
+    request.user_id = None
+    request.app_user = None
+
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if not header.startswith('Bearer '):
+        return
+    try:
+        payload = verify_token(header[len('Bearer '):].strip(), 'access')
+    except InvalidToken:
+        return
+
+    user_id = payload['uid']
+    request.user_id = user_id
+    request.app_user = SimpleLazyObject(lambda: get_user(user_id))
+
+
+@sync_and_async_middleware
+def token_authentication_middleware(get_response):
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            _authenticate(request)
+            return await get_response(request)
+    else:
+        def middleware(request):
+            _authenticate(request)
+            return get_response(request)
+    return middleware
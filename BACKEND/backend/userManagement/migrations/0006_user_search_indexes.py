@@ -0,0 +1,41 @@
+from django.db import migrations
+
+# list_users' ?q= uses istartswith, which PostgreSQL runs as
+# UPPER(column::text) LIKE UPPER('prefix%'). Under any collation but "C" a
+# B-tree index only serves LIKE with the text_pattern_ops operator class.
+# SQLite's LIKE can't use an ordinary index either way, so these are
+# PostgreSQL only.
+SEARCH_INDEXES = [
+    ('user_email_upper_idx', 'UserEmail'),
+    ('user_first_name_upper_idx', 'UserFirstName'),
+    ('user_last_name_upper_idx', 'UserLastName'),
+]
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    quote = schema_editor.quote_name
+    table = apps.get_model('userManagement', 'User')._meta.db_table
+    for name, column in SEARCH_INDEXES:
+        schema_editor.execute(
+            f"CREATE INDEX {quote(name)} ON {quote(table)} (UPPER({quote(column)}::text) text_pattern_ops)"
+        )
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in SEARCH_INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {schema_editor.quote_name(name)}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userManagement', '0005_user_usergender_user_userheight_user_userweight_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
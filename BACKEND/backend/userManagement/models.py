@@ -13,5 +13,56 @@ class User(models.Model):
     last_login = models.DateTimeField(default=timezone.now)
     created_at = models.DateTimeField(auto_now_add=True)  # Timestamp when user is created
 
+    # The prefix search in list_users is served on PostgreSQL by indexes
+    # created in migration 0006; they need text_pattern_ops, so they aren't
+    # declared here where every backend would try to build them
+
     def __str__(self):
         return f"{self.UserFirstName} {self.UserLastName}"
+
+
+class UserDeletionJob(models.Model):
+    STATUSES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    # Plain integer: the user row is gone by the time the job finishes
+    user_id = models.IntegerField(db_index=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default='pending')
+    deleted_rows = models.BigIntegerField(default=0)
+    current_table = models.CharField(max_length=100, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Heartbeat: bumped by every batch, so a job that stops moving is lost
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # At most one queued or running deletion per user
+            models.UniqueConstraint(
+                fields=['user_id'], condition=models.Q(status__in=['pending', 'running']),
+                name='one_active_deletion_per_user',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Deletion of user {self.user_id} ({self.status})"
+
+
+class RefreshToken(models.Model):
+    """
+    One issued refresh token. Each is good for a single refresh: using it
+    marks it used and hands out a new one, and presenting a used one again
+    revokes every refresh token the user holds.
+    """
+    jti = models.CharField(max_length=32, primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='refresh_tokens')
+    created_at = models.DateTimeField(auto_now_add=True)
+    used_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Refresh token {self.jti} for user {self.user_id}"
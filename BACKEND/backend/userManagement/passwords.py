@@ -0,0 +1,28 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth.hashers import check_password, get_hasher, identify_hasher, make_password
+
+
+def password_needs_rehash(encoded):
+    """
+    True if `encoded` was made with a different algorithm or different cost
+    parameters than the current preferred hasher.
+    """
+    try:
+        hasher = identify_hasher(encoded)
+    except ValueError:
+        return False
+    preferred = get_hasher('default')
+    return hasher.algorithm != preferred.algorithm or preferred.must_update(encoded)
+
+
+# Hashing is CPU bound and the hash libraries release the GIL, so these run
+# in the shared executor (thread_sensitive=False) rather than on the single
+# thread Django otherwise uses for sync code under ASGI. That keeps the event
+# loop free and lets several logins hash in parallel.
+
+async def ahash_password(password):
+    return await sync_to_async(make_password, thread_sensitive=False)(password)
+
+
+async def averify_password(password, encoded):
+    return await sync_to_async(check_password, thread_sensitive=False)(password, encoded)
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.cache import caches
+from .models import User
+
+# Short-lived, per-process cache of User rows so the many endpoints that take
+# a user_id don't each query the user table. update_user/delete_user
+# invalidate entries in this process; other workers see changes once the
+# TTL (USER_CACHE_TTL seconds) runs out. The password hash is deferred, so
+# it is never cached; reading it from a cached user loads it from the table.
+cache = caches['users']
+
+
+def _cache_key(user_id):
+    return f"userManagement:user:{user_id}"
+
+
+def get_user(user_id):
+    """Return the User for `user_id`, raising User.DoesNotExist if missing."""
+    key = _cache_key(user_id)
+    user = cache.get(key)
+    if user is None:
+        # Unknown ids are not cached so a freshly created user is visible at once
+        user = User.objects.defer('UserPassword').get(UserID=user_id)
+        cache.set(key, user, settings.USER_CACHE_TTL)
+    return user
+
+
+def user_exists(user_id):
+    """
+    True if `user_id` names an existing user. A valid token doesn't prove
+    this, since the user may have been deleted after it was issued.
+    """
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return False
+    try:
+        get_user(user_id)
+    except User.DoesNotExist:
+        return False
+    return True
+
+
+def invalidate_user(user_id):
+    cache.delete(_cache_key(user_id))
@@ -1,3 +1,320 @@
-from django.test import TestCase
+import time
+from datetime import timedelta
+from unittest import mock
+from django.contrib.auth.hashers import make_password
+from django.core.cache.backends.db import DatabaseCache
+from django.db import IntegrityError, transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from backend import replicas
+from sleep_tracker.models import SleepLog
+from .deletion import run_deletion_job
+from .models import User, UserDeletionJob
+from .services import get_user, invalidate_user
+from .tokens import InvalidToken, issue_tokens, refresh_access_token, verify_token
 
-# Create your tests here.
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class TokenTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            UserFirstName='Token', UserLastName='Test', UserEmail='token@example.com',
+            UserPassword=make_password('secret'), UserWeight=70, UserHeight=170,
+        )
+        self.tokens = issue_tokens(self.user.UserID)
+
+    def _later(self, seconds):
+        return mock.patch('time.time', return_value=time.time() + seconds)
+
+    def test_verify(self):
+        self.assertEqual(verify_token(self.tokens['access_token'], 'access')['uid'], self.user.UserID)
+        self.assertEqual(verify_token(self.tokens['refresh_token'], 'refresh')['uid'], self.user.UserID)
+
+    def test_wrong_type_and_tampered_tokens_are_rejected(self):
+        with self.assertRaisesMessage(InvalidToken, 'Invalid token type'):
+            verify_token(self.tokens['refresh_token'], 'access')
+        with self.assertRaisesMessage(InvalidToken, 'Invalid token'):
+            verify_token(self.tokens['access_token'] + 'x', 'access')
+
+    @override_settings(ACCESS_TOKEN_LIFETIME=60, REFRESH_TOKEN_LIFETIME=3600)
+    def test_expiry(self):
+        with self._later(120):
+            with self.assertRaisesMessage(InvalidToken, 'Token has expired'):
+                verify_token(self.tokens['access_token'], 'access')
+            # The refresh token outlives the access token and issues a new one
+            access = refresh_access_token(self.tokens['refresh_token'])['access_token']
+            self.assertEqual(verify_token(access, 'access')['uid'], self.user.UserID)
+        fresh = issue_tokens(self.user.UserID)
+        with self._later(7200):
+            with self.assertRaisesMessage(InvalidToken, 'Token has expired'):
+                refresh_access_token(fresh['refresh_token'])
+
+    def test_refresh_endpoint(self):
+        url = reverse('refresh_token')
+        response = self.client.post(url, {'refresh_token': self.tokens['refresh_token']})
+        self.assertEqual(response.status_code, 200)
+        access = response.json()['tokens']['access_token']
+        self.assertEqual(verify_token(access, 'access')['uid'], self.user.UserID)
+
+        response = self.client.post(url, {'refresh_token': self.tokens['access_token']})
+        self.assertEqual(response.status_code, 401)
+
+    def test_refresh_rotates_the_refresh_token(self):
+        first = refresh_access_token(self.tokens['refresh_token'])
+        second = refresh_access_token(first['refresh_token'])
+        self.assertEqual(verify_token(second['access_token'], 'access')['uid'], self.user.UserID)
+        with self.assertRaisesMessage(InvalidToken, 'Refresh token has been revoked'):
+            refresh_access_token(first['refresh_token'])
+
+    def test_reused_refresh_token_revokes_the_users_tokens(self):
+        other_device = issue_tokens(self.user.UserID)
+        rotated = refresh_access_token(self.tokens['refresh_token'])
+        with self.assertRaises(InvalidToken):
+            refresh_access_token(self.tokens['refresh_token'])
+        for tokens in (rotated, other_device):
+            with self.assertRaisesMessage(InvalidToken, 'Refresh token has been revoked'):
+                refresh_access_token(tokens['refresh_token'])
+
+    def test_protected_views_take_the_user_from_the_token(self):
+        other = User.objects.create(
+            UserFirstName='Other', UserLastName='Test', UserEmail='other@example.com', UserPassword='x',
+        )
+        auth = {'HTTP_AUTHORIZATION': f"Bearer {self.tokens['access_token']}"}
+        url = reverse('user_detail', args=[self.user.UserID])
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.assertEqual(self.client.get(url, **auth).status_code, 200)
+
+        response = self.client.get(reverse('user_detail', args=[other.UserID]), **auth)
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post(reverse('update_user', args=[other.UserID]), {'UserFirstName': 'X'}, **auth)
+        self.assertEqual(response.status_code, 403)
+        other.refresh_from_db()
+        self.assertEqual(other.UserFirstName, 'Other')
+
+    @override_settings(ACCESS_TOKEN_LIFETIME=60)
+    def test_stale_token_does_not_block_login_or_refresh(self):
+        with self._later(120):
+            stale = {'HTTP_AUTHORIZATION': f"Bearer {self.tokens['access_token']}"}
+            response = self.client.post(
+                reverse('login_user'), {'UserEmail': 'token@example.com', 'UserPassword': 'secret'}, **stale,
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('access_token', response.json()['tokens'])
+
+            response = self.client.post(
+                reverse('refresh_token'), {'refresh_token': self.tokens['refresh_token']}, **stale,
+            )
+            self.assertEqual(response.status_code, 200)
+
+    def test_malformed_token_is_unauthorized(self):
+        response = self.client.get(
+            reverse('user_detail', args=[self.user.UserID]), HTTP_AUTHORIZATION='Bearer not-a-token',
+        )
+        self.assertEqual(response.status_code, 401)
+
+
+class UserCacheTests(TestCase):
+    def test_password_hash_is_not_cached(self):
+        user = User.objects.create(
+            UserFirstName='Cache', UserLastName='Test', UserEmail='cache@example.com',
+            UserPassword=make_password('secret'),
+        )
+        invalidate_user(user.UserID)
+        get_user(user.UserID)
+        cached = get_user(user.UserID)
+        self.assertIn('UserPassword', cached.get_deferred_fields())
+        self.assertEqual(cached.UserEmail, 'cache@example.com')
+
+
+class ListUsersTests(TestCase):
+    def setUp(self):
+        names = [('Ali', 'Khan'), ('alina', 'Shah'), ('Bilal', 'Ahmed'), ('Sara', 'Alvi'), ('Émile', 'Zola')]
+        self.users = [
+            User.objects.create(
+                UserFirstName=first, UserLastName=last, UserEmail=f'{first.lower()}@example.com', UserPassword='x',
+            )
+            for first, last in names
+        ]
+        self.client.defaults['HTTP_AUTHORIZATION'] = f"Bearer {issue_tokens(self.users[0].UserID)['access_token']}"
+
+    def _list(self, **params):
+        response = self.client.get(reverse('list_users'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def _ids(self, users):
+        return [user['UserID'] for user in users]
+
+    def test_without_paging_params_the_first_page_is_returned(self):
+        data = self._list()
+        self.assertEqual(self._ids(data['users']), [user.UserID for user in self.users])
+        self.assertIsNone(data['next_after'])
+        self.assertNotIn('UserPassword', data['users'][0])
+
+        with mock.patch('userManagement.views.USER_LIST_MAX_LIMIT', 2):
+            data = self._list()
+        self.assertEqual(self._ids(data['users']), [user.UserID for user in self.users[:2]])
+        self.assertEqual(data['next_after'], self.users[1].UserID)
+
+    def test_keyset_pages(self):
+        ids, params = [], {'limit': 2}
+        while True:
+            data = self._list(**params)
+            self.assertLessEqual(len(data['users']), 2)
+            ids += self._ids(data['users'])
+            if data['next_after'] is None:
+                break
+            params['after'] = data['next_after']
+        self.assertEqual(ids, [user.UserID for user in self.users])
+
+    def test_prefix_search_is_case_insensitive(self):
+        # Ali and alina; Alvi only matches the shorter prefix
+        data = self._list(q='ALI')
+        self.assertEqual(self._ids(data['users']), [self.users[0].UserID, self.users[1].UserID])
+        self.assertEqual(self._ids(self._list(q='al')['users']), [u.UserID for u in self.users[:2] + self.users[3:4]])
+        self.assertEqual(self._ids(self._list(q='bilal@')['users']), [self.users[2].UserID])
+        self.assertEqual(self._ids(self._list(q='Émi')['users']), [self.users[4].UserID])
+
+    def test_search_wildcards_are_literal(self):
+        self.assertEqual(self._list(q='%')['users'], [])
+        self.assertEqual(self._list(q='_li')['users'], [])
+
+    def test_search_and_paging_combine(self):
+        data = self._list(q='al', limit=1)
+        self.assertEqual(self._ids(data['users']), [self.users[0].UserID])
+        data = self._list(q='al', limit=1, after=data['next_after'])
+        self.assertEqual(self._ids(data['users']), [self.users[1].UserID])
+
+    def test_bad_params(self):
+        response = self.client.get(reverse('list_users'), {'limit': 'lots'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(USER_DELETION_IN_BACKGROUND=False, USER_DELETION_BATCH_SIZE=3)
+class UserDeletionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            UserFirstName='Gone', UserLastName='Soon', UserEmail='gone@example.com', UserPassword='x',
+        )
+        start = timezone.now()
+        SleepLog.objects.bulk_create([
+            SleepLog(user=self.user, date=start.date(), sleep_start=start + timedelta(days=day),
+                     sleep_end=start + timedelta(days=day, hours=8), duration=timedelta(hours=8))
+            for day in range(7)
+        ])
+        self.client.defaults['HTTP_AUTHORIZATION'] = f"Bearer {issue_tokens(self.user.UserID)['access_token']}"
+
+    def _delete(self):
+        response = self.client.post(reverse('delete_user', args=[self.user.UserID]))
+        self.assertEqual(response.status_code, 202)
+        return response.json()
+
+    def _status(self, job_id):
+        return self.client.get(reverse('deletion_status', args=[job_id])).json()
+
+    def test_deletes_children_in_batches_then_the_user(self):
+        job = self._status(self._delete()['job_id'])
+        self.assertEqual(job['status'], 'done')
+        # The sleep logs and the refresh token issued in setUp
+        self.assertEqual(job['deleted_rows'], 8)
+        self.assertFalse(User.objects.filter(UserID=self.user.UserID).exists())
+        self.assertFalse(SleepLog.objects.exists())
+
+    def test_another_user_is_forbidden(self):
+        response = self.client.post(reverse('delete_user', args=[999999]))
+        self.assertEqual(response.status_code, 403)
+
+    def test_running_job_is_reused(self):
+        job = UserDeletionJob.objects.create(user_id=self.user.UserID, status='running')
+        self.assertEqual(self._delete()['job_id'], job.pk)
+        self.assertTrue(User.objects.filter(UserID=self.user.UserID).exists())
+
+    @override_settings(USER_DELETION_TIMEOUT_SECONDS=60)
+    def test_lost_job_is_failed_and_replaced(self):
+        lost = UserDeletionJob.objects.create(user_id=self.user.UserID, status='running')
+        UserDeletionJob.objects.filter(pk=lost.pk).update(updated_at=timezone.now() - timedelta(minutes=5))
+
+        data = self._delete()
+        self.assertNotEqual(data['job_id'], lost.pk)
+        self.assertEqual(data['job_status'], 'done')
+        self.assertFalse(User.objects.filter(UserID=self.user.UserID).exists())
+        lost = self._status(lost.pk)
+        self.assertEqual(lost['status'], 'failed')
+        self.assertIn('lost', lost['error'])
+
+    @override_settings(USER_DELETION_TIMEOUT_SECONDS=60)
+    def test_old_job_with_a_recent_heartbeat_is_not_lost(self):
+        job = UserDeletionJob.objects.create(user_id=self.user.UserID, status='running')
+        UserDeletionJob.objects.filter(pk=job.pk).update(created_at=timezone.now() - timedelta(hours=5))
+        self.assertEqual(self._delete()['job_id'], job.pk)
+        self.assertEqual(self._status(job.pk)['status'], 'running')
+
+    def test_batches_bump_the_heartbeat(self):
+        job = UserDeletionJob.objects.create(user_id=self.user.UserID)
+        UserDeletionJob.objects.filter(pk=job.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+        run_deletion_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertGreater(job.updated_at, timezone.now() - timedelta(minutes=1))
+
+    def test_only_a_pending_job_is_run(self):
+        job = UserDeletionJob.objects.create(user_id=self.user.UserID, status='failed')
+        run_deletion_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.deleted_rows), ('failed', 0))
+        self.assertEqual(SleepLog.objects.count(), 7)
+
+    def test_job_marked_lost_midway_stops_and_keeps_its_status(self):
+        job = UserDeletionJob.objects.create(user_id=self.user.UserID)
+        real_atomic = transaction.atomic
+
+        def atomic(*args, **kwargs):
+            # Another process gives up on the job after its first sleep batch
+            if SleepLog.objects.count() < 7:
+                UserDeletionJob.objects.filter(pk=job.pk).update(status='failed', error='lost')
+            return real_atomic(*args, **kwargs)
+
+        with mock.patch('userManagement.deletion.transaction.atomic', atomic):
+            run_deletion_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), ('failed', 'lost'))
+        self.assertEqual(SleepLog.objects.count(), 4)
+        self.assertTrue(User.objects.filter(UserID=self.user.UserID).exists())
+
+    def test_one_active_job_per_user(self):
+        UserDeletionJob.objects.create(user_id=self.user.UserID, status='running')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            UserDeletionJob.objects.create(user_id=self.user.UserID)
+        UserDeletionJob.objects.create(user_id=self.user.UserID, status='failed')
+
+
+class ReplicaWriteTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            UserFirstName='Replica', UserLastName='Test', UserEmail='replica@example.com', UserPassword='x',
+        )
+
+    def test_writes_to_user_owned_rows_pin_the_user(self):
+        start = timezone.now()
+        with mock.patch.object(replicas, 'mark_user_write') as mark:
+            log = SleepLog.objects.create(user=self.user, date=start.date(), sleep_start=start,
+                                          sleep_end=start + timedelta(hours=8))
+            log.delete()
+            self.user.save()
+        self.assertEqual([c.args for c in mark.call_args_list], [(self.user.UserID,)] * 3)
+
+    def test_other_writes_are_ignored(self):
+        with mock.patch.object(replicas, 'mark_user_write') as mark:
+            UserDeletionJob.objects.create(user_id=self.user.UserID, status='done')
+        mark.assert_not_called()
+
+    def test_marker_cache_is_read_from_the_primary(self):
+        router = replicas.ReplicaRouter()
+        cache_model = DatabaseCache('replica_write_markers', {}).cache_model_class
+        token = replicas._use_replica.set(True)
+        try:
+            self.assertEqual(router.db_for_read(SleepLog), replicas.REPLICA_ALIAS)
+            self.assertIsNone(router.db_for_read(cache_model))
+        finally:
+            replicas._use_replica.reset(token)
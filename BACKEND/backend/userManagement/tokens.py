@@ -0,0 +1,73 @@
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+from .models import RefreshToken
+
+TOKEN_SALT = 'userManagement.tokens'
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def _make_token(user_id, token_type, **claims):
+    return signing.dumps({'uid': user_id, 'typ': token_type, **claims}, salt=TOKEN_SALT)
+
+
+def _make_refresh_token(user_id):
+    jti = uuid.uuid4().hex
+    RefreshToken.objects.create(jti=jti, user_id=user_id)
+    # Tokens too old to verify are of no further use
+    RefreshToken.objects.filter(
+        user_id=user_id, created_at__lt=timezone.now() - timedelta(seconds=settings.REFRESH_TOKEN_LIFETIME)
+    ).delete()
+    return _make_token(user_id, 'refresh', jti=jti)
+
+
+def issue_tokens(user_id):
+    """Signed access and refresh tokens for a user who just logged in."""
+    return {
+        'access_token': _make_token(user_id, 'access'),
+        'refresh_token': _make_refresh_token(user_id),
+        'expires_in': settings.ACCESS_TOKEN_LIFETIME,
+    }
+
+
+def refresh_access_token(refresh_token):
+    """
+    A new access token and a new refresh token in exchange for a refresh
+    token, which can't be used again. A token that was already used has
+    most likely leaked, so every refresh token of its user is revoked.
+    """
+    payload = verify_token(refresh_token, 'refresh')
+    jti = payload.get('jti')
+    now = timezone.now()
+    if not RefreshToken.objects.filter(jti=jti, used_at__isnull=True).update(used_at=now):
+        if jti and RefreshToken.objects.filter(jti=jti).exists():
+            RefreshToken.objects.filter(user_id=payload['uid'], used_at__isnull=True).update(used_at=now)
+        raise InvalidToken('Refresh token has been revoked')
+    return {
+        'access_token': _make_token(payload['uid'], 'access'),
+        'refresh_token': _make_refresh_token(payload['uid']),
+        'expires_in': settings.ACCESS_TOKEN_LIFETIME,
+    }
+
+
+def verify_token(token, token_type='access'):
+    """
+    Check the signature and age of a token and return its payload. This is
+    pure HMAC work; it never touches the database, so a refresh token is
+    only checked against the issued ones in refresh_access_token.
+    """
+    max_age = settings.ACCESS_TOKEN_LIFETIME if token_type == 'access' else settings.REFRESH_TOKEN_LIFETIME
+    try:
+        payload = signing.loads(token, salt=TOKEN_SALT, max_age=max_age)
+    except signing.SignatureExpired:
+        raise InvalidToken('Token has expired')
+    except signing.BadSignature:
+        raise InvalidToken('Invalid token')
+    if payload.get('typ') != token_type:
+        raise InvalidToken('Invalid token type')
+    return payload
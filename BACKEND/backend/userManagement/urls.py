@@ -7,5 +7,7 @@ urlpatterns = [
     path("create/", views.create_user, name="create_user"),
     path("<int:user_id>/update/", views.update_user, name="update_user"),
     path("<int:user_id>/delete/", views.delete_user, name="delete_user"),
-    path('login/', views.login_user, name='login_user')
+    path("deletions/<int:job_id>/", views.deletion_status, name="deletion_status"),
+    path('login/', views.login_user, name='login_user'),
+    path('token/refresh/', views.refresh_token, name='refresh_token'),
 ]
@@ -1,27 +1,62 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, get_object_or_404
 from django.http import JsonResponse 
-from django.contrib.auth.hashers import make_password, check_password
-from django.contrib.auth import  login
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
-from .models import User
+from django.db.models import Q
+from .models import User, UserDeletionJob
+from .authentication import token_user_error
+from .deletion import fail_if_lost, schedule_user_deletion
+from .passwords import ahash_password, averify_password, password_needs_rehash
+from .services import invalidate_user
+from .tokens import InvalidToken, issue_tokens, refresh_access_token
 
-# List all users
+# Columns searched by list_users' ?q= prefix. On PostgreSQL each has an
+# UPPER(column) text_pattern_ops index (migration 0006) that serves istartswith
+USER_SEARCH_FIELDS = ['UserEmail', 'UserFirstName', 'UserLastName']
+USER_LIST_MAX_LIMIT = 200
+
+
+# List users a page at a time (?limit=, at most USER_LIST_MAX_LIMIT);
+# next_after is the ?after= for the following page
 def list_users(request):
+    error = token_user_error(request)
+    if error:
+        return error
+    try:
+        limit = int(request.GET.get("limit", USER_LIST_MAX_LIMIT))
+        after = int(request.GET.get("after", 0))
+    except ValueError:
+        return JsonResponse({"status": "error", "message": "limit and after must be integers"}, status=400)
+    limit = max(1, min(limit, USER_LIST_MAX_LIMIT))
+
+    # Keyset pagination: continue after the last UserID of the previous page
     users = User.objects.all()
-    user_list = [
-        {
-            "UserID": u.UserID,
-            "UserFirstName": u.UserFirstName,
-            "UserLastName": u.UserLastName,
-            "UserEmail": u.UserEmail,
-        }
-        for u in users
-    ]
-    return JsonResponse({"users": user_list})
+    if after:
+        users = users.filter(UserID__gt=after)
+
+    query = request.GET.get("q", "").strip()
+    if query:
+        match = Q()
+        for field in USER_SEARCH_FIELDS:
+            match |= Q(**{f"{field}__istartswith": query})
+        users = users.filter(match)
+
+    user_list = list(
+        users.order_by("UserID").values("UserID", "UserFirstName", "UserLastName", "UserEmail")[:limit + 1]
+    )
+    next_after = None
+    if len(user_list) > limit:
+        user_list = user_list[:limit]
+        next_after = user_list[-1]["UserID"]
+
+    return JsonResponse({"users": user_list, "next_after": next_after})
 
 # Get details of a specific user
 def user_detail(request, user_id):
+    error = token_user_error(request, user_id)
+    if error:
+        return error
     user_obj = get_object_or_404(User, UserID=user_id)
     user_data = {
         "UserID": user_obj.UserID,
@@ -33,7 +68,7 @@ def user_detail(request, user_id):
 
 # Create a new user with hashed password
 @csrf_exempt
-def create_user(request):
+async def create_user(request):
     if request.method == "POST":
         # Retrieve data from the POST request
         first_name = request.POST.get("UserFirstName")
@@ -45,14 +80,13 @@ def create_user(request):
         height = request.POST.get("UserHeight")  # User's height
         created_at = timezone.now()  # Automatically set to the current time
 
-        print(f"Received parameters: firstName: {first_name}, lastName: {last_name}, email: {email}, password: {password}, gender: {gender}, weight: {weight}, height: {height}")
+        print(f"Received parameters: firstName: {first_name}, lastName: {last_name}, email: {email}, gender: {gender}, weight: {weight}, height: {height}")
 
-        # Hash the password before saving to the database
-        hashed_password = make_password(password)
-        print(f"Hashed password: {hashed_password}")
+        # Hash the password before saving to the database (off the event loop)
+        hashed_password = await ahash_password(password)
 
         # Save the new user to the database
-        user_obj = User.objects.create(
+        user_obj = await User.objects.acreate(
             UserFirstName=first_name,
             UserLastName=last_name,
             UserEmail=email,
@@ -68,6 +102,9 @@ def create_user(request):
     return JsonResponse({"status": "error", "message": "Invalid request method"}, status=405)
 # Update an existing user's details (excluding password updates here)
 def update_user(request, user_id):
+    error = token_user_error(request, user_id)
+    if error:
+        return error
     user_obj = get_object_or_404(User, UserID=user_id)
     if request.method == "POST":
         user_obj.UserFirstName = request.POST.get("UserFirstName", user_obj.UserFirstName)
@@ -76,30 +113,67 @@ def update_user(request, user_id):
         user_obj.UserWeight = request.POST.get("UserWeight", user_obj.UserWeight)
         user_obj.UserHeight = request.POST.get("UserHeight", user_obj.UserHeight)
         user_obj.save()
+        invalidate_user(user_id)
         return JsonResponse({"status": "success", "message": "User updated successfully"})
     return JsonResponse({"status": "error", "message": "Invalid request method"}, status=405)
 
-# Delete a user
-def delete_user(request, user_id):  
-    user_obj = get_object_or_404(User, UserID=user_id)
-    user_obj.delete()
-    return JsonResponse({"status": "success", "message": "User deleted successfully"})
+# Delete a user. Their logs are removed by a background job, so this returns
+# straight away with a job id that can be polled for progress
+def delete_user(request, user_id):
+    error = token_user_error(request, user_id)
+    if error:
+        return error
+    if not User.objects.filter(UserID=user_id).exists():
+        return JsonResponse({"status": "error", "message": "User not found"}, status=404)
+    job = schedule_user_deletion(user_id)
+    return JsonResponse({
+        "status": "success",
+        "message": "User deletion started",
+        "job_id": job.id,
+        "job_status": job.status,
+    }, status=202)
+
+
+# Progress of a user deletion job
+def deletion_status(request, job_id):
+    job = get_object_or_404(UserDeletionJob, id=job_id)
+    error = token_user_error(request, job.user_id)
+    if error:
+        return error
+    fail_if_lost(job)
+    return JsonResponse({
+        "job_id": job.id,
+        "UserID": job.user_id,
+        "status": job.status,
+        "deleted_rows": job.deleted_rows,
+        "current_table": job.current_table or None,
+        "error": job.error or None,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    })
 
 
 @csrf_exempt
-def login_user(request):
+async def login_user(request):
     if request.method == "POST":
         email = request.POST.get("UserEmail")
         password = request.POST.get("UserPassword")
-        print(f"Received email: {email}, password: {password}")
+        print(f"Received login request for email: {email}")
         try:
             # Find the user by email
-            user_obj = User.objects.get(UserEmail=email)
+            user_obj = await User.objects.aget(UserEmail=email)
             
             # Check if the password is correct
-            if check_password(password, user_obj.UserPassword):
-                # User is authenticated, log them in
-                login(request, user_obj)
+            if await averify_password(password, user_obj.UserPassword):
+                updates = {"last_login": timezone.now()}
+                # Upgrade hashes made with an older algorithm or cost settings
+                if password_needs_rehash(user_obj.UserPassword):
+                    updates["UserPassword"] = await ahash_password(password)
+                await User.objects.filter(UserID=user_obj.UserID).aupdate(**updates)
+                invalidate_user(user_obj.UserID)
+
+                # User is authenticated; hand out stateless tokens instead of
+                # creating a database-backed session
                 return JsonResponse({
                     "success": True,
                     "data": {
@@ -111,6 +185,7 @@ def login_user(request):
                         "UserWeight": str(user_obj.UserWeight), 
                         "UserHeight": str(user_obj.UserHeight)
                     },
+                    "tokens": await sync_to_async(issue_tokens)(user_obj.UserID),
                     "code": 200,
                 })
             else:
@@ -127,4 +202,19 @@ def login_user(request):
     return JsonResponse({
         "success": False,
         "error": "Only POST requests are allowed"
-    }, status=405)
\ No newline at end of file
+    }, status=405)
+
+
+@csrf_exempt
+def refresh_token(request):
+    if request.method == "POST":
+        try:
+            tokens = refresh_access_token(request.POST.get("refresh_token", ""))
+        except InvalidToken as e:
+            return JsonResponse({"success": False, "error": str(e)}, status=401)
+        return JsonResponse({"success": True, "tokens": tokens})
+
+    return JsonResponse({
+        "success": False,
+        "error": "Only POST requests are allowed"
+    }, status=405)
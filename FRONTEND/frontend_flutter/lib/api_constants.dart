@@ -17,6 +17,7 @@ class ApiConstants {
   static const String updateUser = '$baseUrl/user/update/';
   static const String deleteUser = '$baseUrl/user/delete/';
   static const String getUserDetails = '$baseUrl/user/details/';
+  static const String refreshToken = '$baseUrl/user/token/refresh/';
 
   static final String createUser2 = '$baseUrlDevice/user/create/';
   static final String loginUser2 = '$baseUrlDevice/user/login/';
@@ -0,0 +1,64 @@
+import 'dart:convert';
+
+import 'package:http/http.dart' as http;
+
+import '../api_constants.dart';
+
+// Tokens handed out at login. Calls for the signed-in user's data go through
+// get/post here so they carry the access token; on a 401 the token is
+// refreshed once and the call repeated.
+class AuthSession {
+  static String? _accessToken;
+  static String? _refreshToken;
+
+  static void save(Map<String, dynamic>? tokens) {
+    _accessToken = tokens?['access_token'];
+    _refreshToken = tokens?['refresh_token'];
+  }
+
+  static void clear() {
+    _accessToken = null;
+    _refreshToken = null;
+  }
+
+  static Map<String, String> headers([Map<String, String>? extra]) {
+    return {
+      ...?extra,
+      if (_accessToken != null) 'Authorization': 'Bearer $_accessToken',
+    };
+  }
+
+  // Refresh tokens are single use, so the new one replaces the old
+  static Future<bool> _refresh() async {
+    if (_refreshToken == null) return false;
+    final response = await http.post(
+      Uri.parse(ApiConstants.refreshToken),
+      body: {'refresh_token': _refreshToken},
+    );
+    if (response.statusCode != 200) {
+      clear();
+      return false;
+    }
+    save(json.decode(response.body)['tokens']);
+    return true;
+  }
+
+  static Future<http.Response> get(Uri url,
+      {Map<String, String>? headers}) async {
+    final response = await http.get(url, headers: AuthSession.headers(headers));
+    if (response.statusCode == 401 && await _refresh()) {
+      return http.get(url, headers: AuthSession.headers(headers));
+    }
+    return response;
+  }
+
+  static Future<http.Response> post(Uri url,
+      {Map<String, String>? headers, Object? body}) async {
+    final response =
+        await http.post(url, headers: AuthSession.headers(headers), body: body);
+    if (response.statusCode == 401 && await _refresh()) {
+      return http.post(url, headers: AuthSession.headers(headers), body: body);
+    }
+    return response;
+  }
+}
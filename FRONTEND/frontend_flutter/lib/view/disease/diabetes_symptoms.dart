@@ -2,8 +2,8 @@ import 'package:flutter/material.dart';
 import '../../common/colo_extension.dart';
 import 'package:flutter/services.dart';
 import 'dart:convert';
-import 'package:http/http.dart' as http;
 import '../../api_constants.dart';
+import 'package:fitness/common/auth_session.dart';
 import 'diabetes_output.dart';
 
 class DiabetesSymptomsView extends StatefulWidget {
@@ -200,7 +200,7 @@ class _DiabetesSymptomsViewState extends State<DiabetesSymptomsView> {
                         print(jsonEncode(requestData));
 
                         // Send request to backend
-                        final response = await http.post(
+                        final response = await AuthSession.post(
                           Uri.parse(ApiConstants.predictDiseaseDiabetes),
                           headers: {'Content-Type': 'application/json'},
                           body: jsonEncode(requestData),
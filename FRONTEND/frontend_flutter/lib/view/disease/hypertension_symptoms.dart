@@ -2,8 +2,8 @@ import 'package:flutter/material.dart';
 import '../../common/colo_extension.dart';
 import 'package:flutter/services.dart';
 import 'dart:convert';
-import 'package:http/http.dart' as http;
 import '../../api_constants.dart';
+import 'package:fitness/common/auth_session.dart';
 import 'hypertension_output.dart';
 
 class HypertensionSymptomsView extends StatefulWidget {
@@ -199,7 +199,7 @@ class _HypertensionSymptomsViewState extends State<HypertensionSymptomsView> {
                         };
 
                         // Send request to backend
-                        final response = await http.post(
+                        final response = await AuthSession.post(
                           Uri.parse(ApiConstants.predictDiseaseHypertension),
                           headers: {'Content-Type': 'application/json'},
                           body: jsonEncode(requestData),
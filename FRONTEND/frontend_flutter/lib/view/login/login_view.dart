@@ -10,6 +10,7 @@ import 'package:http/http.dart' as http;
 import 'dart:convert';
 import 'package:flutter_dotenv/flutter_dotenv.dart';
 import 'package:fitness/api_constants.dart';
+import 'package:fitness/common/auth_session.dart';
 
 class LoginView extends StatefulWidget {
   final Map<String, dynamic>? userDataFromSignup; // Accepts signup data
@@ -64,6 +65,7 @@ void _handleLogin(BuildContext context, String email, String password) async {
     if (response.statusCode == 200 && data['success'] == true) {
       // Extract user data properly from the 'data' field
       final userData = data['data'];
+      AuthSession.save(data['tokens']);
       print("userData from login func SUCCESS: $userData");
 
       // Navigate to the next screen on successful login
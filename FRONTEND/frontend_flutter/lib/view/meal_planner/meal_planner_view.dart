@@ -5,6 +5,7 @@ import 'package:simple_circular_progress_bar/simple_circular_progress_bar.dart';
 import 'package:http/http.dart' as http;
 import 'package:image_picker/image_picker.dart';
 import '../../../api_constants.dart';
+import 'package:fitness/common/auth_session.dart';
 import '../../common/colo_extension.dart';
 import '../../common_widget/find_eat_cell.dart';
 import '../../common_widget/round_button.dart';
@@ -248,7 +249,7 @@ class _MealPlannerViewState extends State<MealPlannerView>
       print("Category in request body: '${mealData['category']}'");
       print("Full request body: ${json.encode(mealData)}");
 
-      final response = await http.post(
+      final response = await AuthSession.post(
         Uri.parse('${ApiConstants.baseUrl}/meals/log/'),
         headers: {
           'Content-Type': 'application/json',
@@ -328,7 +329,7 @@ class _MealPlannerViewState extends State<MealPlannerView>
 
       final url = ApiConstants.mealsDataByDate(userId, formattedDate);
 
-      final response = await http.get(
+      final response = await AuthSession.get(
         Uri.parse(url),
         headers: {
           'Content-Type': 'application/json',
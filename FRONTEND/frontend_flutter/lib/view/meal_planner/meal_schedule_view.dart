@@ -1,11 +1,11 @@
 import 'package:calendar_agenda/calendar_agenda.dart';
 import 'package:flutter/material.dart';
 import 'package:simple_animation_progress_bar/simple_animation_progress_bar.dart';
-import 'package:http/http.dart' as http;
 import 'dart:convert';
 import 'package:intl/intl.dart';
 
 import '../../../api_constants.dart';
+import 'package:fitness/common/auth_session.dart';
 import '../../common/colo_extension.dart';
 import '../../common_widget/nutritions_row.dart';
 
@@ -135,7 +135,7 @@ class _MealScheduleViewState extends State<MealScheduleView> {
       final url = ApiConstants.mealsDataByDate(userId, formattedDate);
       print("Fetching meals from: $url");
 
-      final response = await http.get(
+      final response = await AuthSession.get(
         Uri.parse(url),
         headers: {
           'Content-Type': 'application/json',
@@ -276,7 +276,7 @@ class _MealScheduleViewState extends State<MealScheduleView> {
 
       final url = ApiConstants.mealsDataByDate(userId, formattedDate);
 
-      final response = await http.get(
+      final response = await AuthSession.get(
         Uri.parse(url),
         headers: {
           'Content-Type': 'application/json',
@@ -332,7 +332,7 @@ class _MealScheduleViewState extends State<MealScheduleView> {
 
       final url = ApiConstants.mealsDataByDate(userId, formattedDate);
 
-      final response = await http.get(
+      final response = await AuthSession.get(
         Uri.parse(url),
         headers: {
           'Content-Type': 'application/json',
@@ -388,7 +388,7 @@ class _MealScheduleViewState extends State<MealScheduleView> {
 
       final url = ApiConstants.mealsDataByDate(userId, formattedDate);
 
-      final response = await http.get(
+      final response = await AuthSession.get(
         Uri.parse(url),
         headers: {
           'Content-Type': 'application/json',
@@ -1,5 +1,6 @@
 import 'package:flutter/material.dart';
 
+import '../../common/auth_session.dart';
 import '../../common/colo_extension.dart';
 import '../../common_widget/round_button.dart';
 import '../../common_widget/setting_row.dart';
@@ -61,6 +62,7 @@ class _ProfileViewState extends State<ProfileView> {
           IconButton(
             icon: Icon(Icons.logout, color: Colors.red),
             onPressed: () {
+              AuthSession.clear();
               Navigator.push(
                 context,
                 MaterialPageRoute(builder: (context) => LoginView()),
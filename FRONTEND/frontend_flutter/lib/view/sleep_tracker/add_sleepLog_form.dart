@@ -1,8 +1,8 @@
 import 'package:flutter/material.dart';
-import 'package:http/http.dart' as http;
 import 'dart:convert';
 import 'package:fitness/common/colo_extension.dart';
 import 'package:fitness/api_constants.dart';
+import 'package:fitness/common/auth_session.dart';
 
 class SleepAddAlarmView2 extends StatefulWidget {
   final DateTime date; // optional, in case you pass from calendar
@@ -62,7 +62,7 @@ class _SleepAddAlarmViewState2 extends State<SleepAddAlarmView2> {
     setState(() => isSubmitting = true);
 
     try {
-      final response = await http.post(
+      final response = await AuthSession.post(
         Uri.parse(ApiConstants.logSleep),
         headers: {'Content-Type': 'application/json'},
         body: jsonEncode({
@@ -2,8 +2,8 @@ import 'package:fitness/view/sleep_tracker/sleep_schedule_view.dart';
 import 'package:fl_chart/fl_chart.dart';
 import 'package:flutter/material.dart';
 import 'dart:convert';
-import 'package:http/http.dart' as http;
 import 'package:fitness/api_constants.dart';
+import 'package:fitness/common/auth_session.dart';
 import '../../common/colo_extension.dart';
 import '../../common_widget/round_button.dart';
 import '../../common_widget/today_sleep_schedule_row.dart';
@@ -62,7 +62,7 @@ class _SleepTrackerViewState extends State<SleepTrackerView> {
     });
 
     try {
-      final response = await http.get(
+      final response = await AuthSession.get(
         Uri.parse(
             ApiConstants.getSleepLogsUserChart(widget.userData!['UserID'])),
       );